@@ -0,0 +1,522 @@
+# -*- coding: utf-8 -*-
+"""Columnar cache of parsed log lines, stored next to the log files.
+
+Parsing log lines is by far the most expensive part of analyzing them.
+The cache keeps the attributes of every line of a plain text log file in
+columns (``haproxy.log`` gets a ``haproxy.log.cache`` folder), one binary
+file per :class:`.Line` attribute:
+
+- integers (timers, queues...) as 64 bit integers,
+- numbers that lines keep as strings (bytes read, connections...) as 64 bit
+  integers too, turned back into strings when read,
+- the accept date as microseconds since the epoch,
+- strings (names, status codes, paths...) dictionary encoded: each line has
+  a 32 bit integer code, the strings themselves are stored only once, on a
+  file of their own.
+
+The columns are memory mapped, so that lines are created out of them with
+no parsing at all, and only the columns (and dictionaries) of the attributes
+that are needed are read. The raw log line is not stored, it is read back
+from the log file when needed.
+
+Just like the time index (see :mod:`haproxy.index`) the cache is extended
+when lines are appended to the log file, and rebuilt when it changes.
+"""
+from array import array
+from bisect import bisect_left
+from datetime import datetime
+from datetime import timedelta
+from haproxy.line import HTTP_REQUEST_ATTRIBUTES
+from haproxy.line import Line
+from haproxy.line import LINE_FIELDS
+from haproxy.line import LineType
+from haproxy.line import parse_accept_date
+from haproxy.readers import file_identity
+from haproxy.readers import head_checksum
+from haproxy.readers import is_appended
+from haproxy.readers import iter_lines
+from haproxy.readers import map_file
+from haproxy.readers import split_buffer
+from sys import intern
+
+import json
+import multiprocessing
+import os
+
+
+CACHE_SUFFIX = '.cache'
+
+CACHE_VERSION = 2
+
+EPOCH = datetime(1970, 1, 1)
+
+# value of integer columns for attributes that are not on a line
+NONE = -(2 ** 63)
+
+# values of number columns that are codes of their dictionary, for those
+# that are not plain numbers (e.g. ``+543``)
+STRINGS = NONE + 1
+STRINGS_END = STRINGS + 2 ** 32
+
+# log lines parsed by each worker process when building the cache
+BUILD_CHUNK_SIZE = 4 * 1024 * 1024
+
+# properties of Line, and the attributes they are computed from
+DERIVED_FIELDS = {
+    'ip': ('captured_request_headers', 'client_ip'),
+    'is_https': ('http_request_path',),
+    'request_date': ('accept_date',),
+}
+
+# attributes that are not worth caching, lines that need them are parsed:
+# the raw HTTP request is nearly unique on every line, and already cached
+# split in its parts
+UNCACHED_FIELDS = ('raw_accept_date', 'raw_http_request')
+
+# attributes that lines keep as strings, but are numbers
+NUMBER_FIELDS = (
+    'total_time',
+    'bytes_read',
+    'connections_active',
+    'connections_frontend',
+    'connections_backend',
+    'connections_server',
+    'retries',
+)
+
+
+def _column_kind(name):
+    if name in NUMBER_FIELDS:
+        return 'number'
+    converters = {
+        fields[name][1] for fields in LINE_FIELDS.values() if name in fields
+    }
+    if converters == {int}:
+        return 'int'
+    if converters == {parse_accept_date}:
+        return 'date'
+    return 'str'
+
+
+#: Cached attributes, and how they are stored.
+COLUMNS = {
+    name: _column_kind(name)
+    for fields in LINE_FIELDS.values()
+    for name in tuple(fields) + HTTP_REQUEST_ATTRIBUTES
+    if name not in UNCACHED_FIELDS
+}
+
+TYPECODES = {'int': 'q', 'date': 'q', 'number': 'q', 'str': 'i'}
+
+# columns with a dictionary of strings
+DICTIONARY_KINDS = ('number', 'str')
+
+# columns about the lines themselves: where they start, whether they are
+# valid and their type
+ROW_COLUMNS = {'offset': 'q', 'valid': 'b', 'log_type': 'b'}
+
+LOG_TYPES = tuple(LineType)
+
+# number attributes that lines keep as integers for some log types only,
+# e.g. total_time
+_INTEGER_FIELDS = {
+    log_type: frozenset(
+        name
+        for name, (_, converter) in LINE_FIELDS[log_type].items()
+        if converter is int and COLUMNS.get(name) == 'number'
+    )
+    for log_type in LineType
+}
+
+
+def cached_fields(plan):
+    """Attributes that need to be read from the cache to follow a plan.
+
+    :param plan: :class:`haproxy.planner.Plan` of the query.
+    :returns: set of attributes (``raw_line`` included, if needed), or
+      ``None`` if some of them are not cached and lines need to be parsed.
+    """
+    if plan is None or plan.fields is None:
+        return None
+    fields = set()
+    if plan.raw_line:
+        fields.add('raw_line')
+    for name in plan.fields:
+        fields.update(DERIVED_FIELDS.get(name, (name,)))
+    if not fields <= set(COLUMNS) | {'raw_line'}:
+        return None
+    return fields
+
+
+def _date_to_microseconds(date):
+    return (date - EPOCH) // timedelta(microseconds=1)
+
+
+def _encode_lines(buffer, chunk):
+    """Parse the lines of a byte range of a log file into columns.
+
+    :returns: ``(arrays, dictionaries)`` the values of every column, and the
+      strings of the string columns: their values are the positions of the
+      strings on those lists.
+    """
+    arrays = {name: array(code) for name, code in ROW_COLUMNS.items()}
+    arrays.update((name, array(TYPECODES[kind])) for name, kind in COLUMNS.items())
+    codes = {name: {} for name, kind in COLUMNS.items() if kind in DICTIONARY_KINDS}
+    missing = [
+        (arrays[name], -1 if kind == 'str' else NONE) for name, kind in COLUMNS.items()
+    ]
+
+    position = chunk[0]
+    for raw_line in iter_lines(buffer, chunk):
+        arrays['offset'].append(position)
+        position += len(raw_line)
+        line = Line(str(raw_line, 'utf-8', 'replace').strip())
+        if not line.is_valid:
+            arrays['valid'].append(0)
+            arrays['log_type'].append(0)
+            for values, value in missing:
+                values.append(value)
+            continue
+
+        arrays['valid'].append(1)
+        arrays['log_type'].append(LOG_TYPES.index(line.log_type))
+        for name, kind in COLUMNS.items():
+            value = getattr(line, name)
+            if kind == 'str':
+                if value is None:
+                    value = -1
+                else:
+                    value = codes[name].setdefault(str(value), len(codes[name]))
+            elif value is None:
+                value = NONE
+            elif kind == 'date':
+                value = _date_to_microseconds(value)
+            elif kind == 'number':
+                value = _encode_number(value, codes[name])
+            arrays[name].append(value)
+
+    dictionaries = {name: list(strings) for name, strings in codes.items()}
+    return arrays, dictionaries
+
+
+def _encode_number(value, codes):
+    """Value of a number column: the number itself, unless it would not be
+    the same string once turned back into a string.
+    """
+    if isinstance(value, int):
+        return value
+    try:
+        number = int(value)
+    except ValueError:
+        number = None
+    if number is None or str(number) != value or number < STRINGS_END:
+        return STRINGS + codes.setdefault(value, len(codes))
+    return number
+
+
+# mapped log file of the worker processes building the cache
+_buffer = None
+
+
+def _init_builder(buffer, logfile):
+    global _buffer
+    if buffer is None:
+        # not forked, see haproxy.logfile._pool
+        buffer = map_file(logfile)
+    _buffer = buffer
+
+
+def _encode_chunk(chunk):  # pragma: no cover
+    return _encode_lines(_buffer, chunk)
+
+
+class ColumnCache(object):
+    """Parsed log lines of a log file, stored in columns.
+
+    :param logfile: path of the log file.
+    """
+
+    def __init__(self, logfile):
+        self.logfile = logfile
+        self.identity = None
+        self.indexed = 0
+        self.checksum = 0
+        self.rows = 0
+        self._columns = {}
+        # dictionaries of strings, only read when needed (see dictionary)
+        self._dictionaries = {}
+        # dictionaries that need to be written
+        self._changed = set()
+        # code of every string of the dictionaries, only needed to extend them
+        self._codes = {}
+
+    def __getstate__(self):
+        # the mapped columns can not be pickled, they are mapped again
+        state = dict(self.__dict__)
+        state['_columns'] = {}
+        return state
+
+    @property
+    def path(self):
+        return f'{self.logfile}{CACHE_SUFFIX}'
+
+    def _column_path(self, name):
+        return os.path.join(self.path, f'{name}.col')
+
+    def _dictionary_path(self, name):
+        return os.path.join(self.path, f'{name}.json')
+
+    @classmethod
+    def load(cls, logfile):
+        """Read the cache of a log file.
+
+        :returns: the cache, or ``None`` if there is none or it can not be
+          read.
+        """
+        cache = cls(logfile)
+        try:
+            with open(os.path.join(cache.path, 'meta.json')) as meta_file:
+                data = json.load(meta_file)
+        except (OSError, ValueError):
+            return None
+        if data.get('version') != CACHE_VERSION:
+            return None
+        cache.identity = tuple(data['identity'])
+        cache.indexed = data['indexed']
+        cache.checksum = data['checksum']
+        cache.rows = data['rows']
+        return cache
+
+    def save(self):
+        """Write the dictionaries that changed and the metadata of the cache,
+        the columns are already written.
+
+        The metadata is written last, so that columns that are longer than
+        what it says (i.e. the cache was being extended when it was
+        interrupted) are truncated the next time.
+        """
+        for name in sorted(self._changed):
+            _write_json(self._dictionary_path(name), self._dictionaries[name])
+        self._changed = set()
+        data = {
+            'version': CACHE_VERSION,
+            'identity': self.identity,
+            'indexed': self.indexed,
+            'checksum': self.checksum,
+            'rows': self.rows,
+        }
+        _write_json(os.path.join(self.path, 'meta.json'), data)
+
+    def dictionary(self, name):
+        """Strings of a dictionary encoded column, read the first time."""
+        if name not in self._dictionaries:
+            with open(self._dictionary_path(name)) as dictionary_file:
+                strings = json.load(dictionary_file)
+            if COLUMNS[name] == 'str':
+                strings = [intern(value) for value in strings]
+            self._dictionaries[name] = strings
+        return self._dictionaries[name]
+
+    @staticmethod
+    def _typecode(name):
+        return ROW_COLUMNS.get(name) or TYPECODES[COLUMNS[name]]
+
+    def column(self, name):
+        """Values of a column, memory mapped."""
+        if name not in self._columns:
+            typecode = self._typecode(name)
+            buffer = map_file(self._column_path(name))
+            itemsize = array(typecode).itemsize
+            view = memoryview(buffer)[: self.rows * itemsize]
+            self._columns[name] = view.cast(typecode)
+        return self._columns[name]
+
+    def update(self, buffer, jobs=1):
+        """Bring the cache up to date with the (mapped) log file.
+
+        Lines that are not cached yet are parsed on worker processes.
+
+        :returns: whether the cache changed.
+        """
+        identity = file_identity(self.logfile)
+        if identity == self.identity:
+            return False
+
+        self._columns = {}
+        checksum = self.checksum
+        if not is_appended(buffer, identity, self.identity, self.indexed, checksum):
+            # a new, truncated or rewritten log file
+            self.indexed, self.rows = 0, 0
+            self._dictionaries = {
+                name: [] for name, kind in COLUMNS.items() if kind in DICTIONARY_KINDS
+            }
+            self._changed = set(self._dictionaries)
+            self._codes = {}
+        self.identity = identity
+
+        os.makedirs(self.path, exist_ok=True)
+        # only whole lines get cached, the last one might be half written
+        end = buffer.rfind(b'\n') + 1
+        if self.indexed < end:
+            chunks = -(-(end - self.indexed) // BUILD_CHUNK_SIZE)
+            chunks = split_buffer(buffer, chunks, self.indexed, end)
+            if len(chunks) == 1:
+                self._append(map(_encode_lines, [buffer], chunks))
+            else:
+                if 'fork' in multiprocessing.get_all_start_methods():
+                    context = multiprocessing.get_context('fork')
+                    initargs = (buffer, self.logfile)
+                else:
+                    context = multiprocessing.get_context()
+                    initargs = (None, self.logfile)
+                pool = context.Pool(
+                    min(jobs, len(chunks)),
+                    initializer=_init_builder,
+                    initargs=initargs,
+                )
+                with pool:
+                    self._append(pool.imap(_encode_chunk, chunks))
+        else:
+            self._append(())
+        self.indexed = max(self.indexed, end)
+        self.checksum = head_checksum(buffer, self.indexed)
+        return True
+
+    def _append(self, encoded_chunks):
+        """Append the columns of the encoded chunks to the column files.
+
+        The strings of each chunk are added to the dictionaries,
+        and their codes translated.
+        """
+        files = {}
+        try:
+            for name in list(ROW_COLUMNS) + list(COLUMNS):
+                files[name] = open(self._column_path(name), 'ab')
+                # drop what was left by an interrupted update
+                files[name].truncate(self.rows * array(self._typecode(name)).itemsize)
+            for arrays, dictionaries in encoded_chunks:
+                for name, strings in dictionaries.items():
+                    if strings:
+                        arrays[name] = self._translate(name, strings, arrays[name])
+                for name, values in arrays.items():
+                    values.tofile(files[name])
+                self.rows += len(arrays['offset'])
+        finally:
+            for file_obj in files.values():
+                file_obj.close()
+
+    def _translate(self, name, strings, codes):
+        """Codes of the strings of a chunk on the dictionary of the column."""
+        dictionary = self.dictionary(name)
+        if name not in self._codes:
+            self._codes[name] = {value: code for code, value in enumerate(dictionary)}
+        dictionary_codes = self._codes[name]
+        translation = []
+        for value in strings:
+            if value not in dictionary_codes:
+                dictionary_codes[value] = len(dictionary)
+                dictionary.append(value)
+                self._changed.add(name)
+            translation.append(dictionary_codes[value])
+
+        if COLUMNS[name] == 'number':
+            # only the values within the codes range are codes
+            for row, value in enumerate(codes):
+                if STRINGS <= value < STRINGS_END:
+                    codes[row] = STRINGS + translation[value - STRINGS]
+            return codes
+        # missing values stay missing, see _encode_lines
+        translation.append(-1)
+        return array('i', [translation[code] for code in codes])
+
+    def row_range(self, start=0, end=None):
+        """Rows of the lines within a byte range of the log file."""
+        offsets = self.column('offset')
+        first = bisect_left(offsets, start)
+        last = self.rows if end is None else bisect_left(offsets, end)
+        return first, last
+
+    def lines(self, buffer, rows, fields):
+        """Create lines out of the cached columns, without parsing them.
+
+        :param buffer: mapped log file, to read the raw lines from.
+        :param rows: ``(first, last)`` rows.
+        :param fields: attributes to set on the lines, see
+          :func:`cached_fields`. The raw line is only read back from the log
+          file if ``raw_line`` is among them (or the line is not valid).
+        :returns: generator of :class:`.Line` objects.
+        """
+        offsets = self.column('offset')
+        valid = self.column('valid')
+        log_types = self.column('log_type')
+        readers = [(name, self._reader(name)) for name in fields if name in COLUMNS]
+        with_raw_line = 'raw_line' in fields
+
+        first, last = rows
+        for row in range(first, last):
+            line = Line.__new__(Line)
+            if with_raw_line or not valid[row]:
+                end = offsets[row + 1] if row + 1 < self.rows else self.indexed
+                raw_line = buffer[offsets[row] : end]
+                line.raw_line = str(raw_line, 'utf-8', 'replace').strip()
+            if not valid[row]:
+                line.is_valid = False
+                yield line
+                continue
+
+            line.is_valid = True
+            log_type = LOG_TYPES[log_types[row]]
+            line.log_type = log_type
+            integers = _INTEGER_FIELDS[log_type]
+            for name, read in readers:
+                value = read(row)
+                if value is not None:
+                    if name in integers:
+                        value = int(value)
+                    setattr(line, name, value)
+            yield line
+
+    def _reader(self, name):
+        kind = COLUMNS[name]
+        values = self.column(name)
+        if kind == 'str':
+            # code -1, i.e. missing values, is the last one
+            strings = self.dictionary(name) + [None]
+            return lambda row: strings[values[row]]
+        if kind == 'date':
+            return lambda row: EPOCH + timedelta(microseconds=values[row])
+        if kind == 'number':
+            return lambda row: self._read_number(name, values[row])
+        return lambda row: None if values[row] == NONE else values[row]
+
+    def _read_number(self, name, value):
+        if value == NONE:
+            return None
+        if value < STRINGS_END:
+            return self.dictionary(name)[value - STRINGS]
+        return str(value)
+
+
+def _write_json(path, data):
+    """Write a JSON file, replacing it at once."""
+    with open(f'{path}.tmp', 'w') as json_file:
+        json.dump(data, json_file)
+    os.replace(f'{path}.tmp', path)
+
+
+def load_cache(logfile, buffer, jobs=1):
+    """Get the up to date cache of a log file, building it if needed.
+
+    :param buffer: mapped log file.
+    :param jobs: number of processes to parse the lines not cached yet.
+    :returns: the cache, or ``None`` if it can not be written.
+    """
+    cache = ColumnCache.load(logfile) or ColumnCache(logfile)
+    try:
+        if cache.update(buffer, jobs):
+            cache.save()
+    except OSError:
+        # the cache is only an optimization, e.g. the log folder might be
+        # read only: lines get parsed instead
+        return None
+    return cache
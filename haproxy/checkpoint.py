@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""Checkpoints of an incremental analysis of log files.
+
+A checkpoint is kept on a state file, it records up to where each log file
+was analyzed, and the commands with the results so far. The next analysis
+with the same state file resumes from there: only the lines added since then
+are processed, and the commands keep adding them up to their results.
+It is meant to analyze a live log file every now and then, e.g. from cron.
+
+Log files are recognized by what was analyzed of them, not by their name:
+
+- a log file that was appended to resumes where it was left,
+- a log file that was renamed by a log rotation (``haproxy.log`` became
+  ``haproxy.log.1``) resumes as well, under its new name; and so does a copy
+  of it (``copytruncate`` rotations), as its first bytes did not change,
+- a truncated or new log file is analyzed from its start.
+
+So that the lines written to a log file right before it was rotated are not
+missed, the rotated log file needs to be analyzed as well, e.g.
+``-l haproxy.log haproxy.log.1``. Compressed log files can not be resumed:
+they are either skipped, when already analyzed, or analyzed as a whole.
+
+The state file is a pickle: only use state files that you wrote yourself.
+"""
+from haproxy.readers import compression
+from haproxy.readers import file_identity
+from haproxy.readers import head_checksum
+
+import os
+import pickle
+
+
+CHECKPOINT_VERSION = 1
+
+
+class Checkpoint(object):
+    """Where the analysis of some log files was left.
+
+    :param path: path of the state file.
+    :param query: what was analyzed (commands, filters...), a state file can
+      only be resumed by the same query.
+    """
+
+    def __init__(self, path, query=None):
+        self.path = path
+        self.query = query
+        # commands with the results so far, None if nothing was analyzed yet
+        self.commands = None
+        # (identity, offset, checksum) of each log file: its file_identity,
+        # up to which byte it was analyzed, and head_checksum up to there
+        self.files = []
+
+    @classmethod
+    def load(cls, path):
+        """Read a checkpoint from a state file.
+
+        :returns: the checkpoint, or ``None`` if there is none or it can not
+          be read.
+        """
+        try:
+            with open(path, 'rb') as state_file:
+                data = pickle.load(state_file)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        if not isinstance(data, dict) or data.get('version') != CHECKPOINT_VERSION:
+            return None
+        checkpoint = cls(path, data['query'])
+        checkpoint.commands = data['commands']
+        checkpoint.files = data['files']
+        return checkpoint
+
+    def save(self):
+        """Write the checkpoint, replacing the state file at once so that it
+        is never left half written.
+        """
+        data = {
+            'version': CHECKPOINT_VERSION,
+            'query': self.query,
+            'commands': self.commands,
+            'files': self.files,
+        }
+        with open(f'{self.path}.tmp', 'wb') as state_file:
+            pickle.dump(data, state_file)
+        os.replace(f'{self.path}.tmp', self.path)
+
+    def offsets(self, logfiles, buffers):
+        """Byte offsets where the analysis of each log file resumes.
+
+        Each recorded log file is matched with the log file with the same
+        inode, or else the first one with the same first bytes.
+
+        :param logfiles: paths of the log files.
+        :param buffers: the mapped log files.
+        :returns: dictionary of log file path and byte offset.
+        """
+        offsets = {logfile: 0 for logfile in logfiles}
+        pending = list(zip(logfiles, buffers))
+        for identity, offset, checksum in self.files:
+            candidates = [
+                (logfile, buffer)
+                for logfile, buffer in pending
+                if offset <= len(buffer) and head_checksum(buffer, offset) == checksum
+            ]
+            candidates.sort(key=lambda item: file_identity(item[0])[2] != identity[2])
+            if not candidates:
+                continue
+            logfile, buffer = candidates[0]
+            pending.remove((logfile, buffer))
+            if compression(buffer) is None or offset == len(buffer):
+                offsets[logfile] = offset
+        return offsets
+
+    def advance(self, logfiles, buffers):
+        """Record that the log files were analyzed.
+
+        Plain text log files up to their last whole line, a half written line
+        is analyzed the next time. Compressed log files as a whole.
+        """
+        self.files = []
+        for logfile, buffer in zip(logfiles, buffers):
+            if compression(buffer) is None:
+                offset = buffer.rfind(b'\n') + 1
+            else:
+                offset = len(buffer)
+            checksum = head_checksum(buffer, offset)
+            self.files.append((file_identity(logfile), offset, checksum))
+
+
+def load_checkpoint(path, query):
+    """Get the checkpoint of a state file, or a new one if there is none.
+
+    :param query: what is going to be analyzed, see :class:`Checkpoint`.
+    :raises ValueError: if the state file was written by another query.
+    """
+    checkpoint = Checkpoint.load(path)
+    if checkpoint is None:
+        return Checkpoint(path, query)
+    if checkpoint.query != query:
+        raise ValueError(
+            f'state file {path} was written with other commands or filters, '
+            'remove it to start over'
+        )
+    return checkpoint
@@ -7,6 +7,14 @@ import time
 
 
 class BaseCommandMixin:
+
+    #: :class:`.Line` attributes read by the command, ``None`` if unknown.
+    fields = None
+
+    #: Whether the command needs to get the lines in time order,
+    #: even when they come from different log files.
+    ordered = False
+
     @classmethod
     def command_line_name(cls):
         """Convert class name to lowercase with underscores.
@@ -24,6 +32,18 @@ class BaseCommandMixin:
     def raw_results(self):  # pragma: no cover
         raise NotImplementedError
 
+    def partial(self):
+        """Return an empty command of the same kind.
+
+        Worker processes run partial commands on their part of the log file,
+        and send them back to be combined with :meth:`merge`.
+        """
+        return type(self)()
+
+    def merge(self, other):  # pragma: no cover
+        """Add the partial results of another command of the same kind."""
+        raise NotImplementedError
+
     def json_data(self):
         return self.raw_results()
 
@@ -40,6 +60,13 @@ class BaseCommandMixin:
             underline = '=' * len(command_name)
             print(f'{command_name}\n{underline}\n{results}\n')
 
+    def report(self, output=None):
+        """Print the results so far, while following log files.
+
+        See :meth:`haproxy.logfile.Log.follow`.
+        """
+        self.results(output=output)
+
 
 class AttributeCounterMixin:
 
@@ -48,9 +75,17 @@ class AttributeCounterMixin:
     def __init__(self):
         self.stats = defaultdict(int)
 
+    @property
+    def fields(self):
+        return (self.attribute_name,)
+
     def __call__(self, line):
         self.stats[getattr(line, self.attribute_name)] += 1
 
+    def merge(self, other):
+        for key, value in other.stats.items():
+            self.stats[key] += value
+
     def raw_results(self):
         return self.stats
 
@@ -94,12 +129,17 @@ class SortTrimMixin:
 class Counter(BaseCommandMixin):
     """Count valid lines."""
 
+    fields = ()
+
     def __init__(self):
         self.counter = 0
 
     def __call__(self, line):
         self.counter += 1
 
+    def merge(self, other):
+        self.counter += other.counter
+
     def raw_results(self):
         return self.counter
 
@@ -170,6 +210,8 @@ class SlowRequests(BaseCommandMixin):
        or globally.
     """
 
+    fields = ('time_wait_response',)
+
     threshold = 1000
 
     def __init__(self):
@@ -180,6 +222,9 @@ class SlowRequests(BaseCommandMixin):
         if response_time >= self.threshold:
             self.slow_requests.append(response_time)
 
+    def merge(self, other):
+        self.slow_requests.extend(other.slow_requests)
+
     def raw_results(self):
         return sorted(self.slow_requests)
 
@@ -214,6 +259,8 @@ class AverageResponseTime(SlowRequests):
 class AverageWaitingTime(BaseCommandMixin):
     """Return the average time valid requests wait on HAProxy before being dispatched to a backend server."""
 
+    fields = ('time_wait_queues',)
+
     def __init__(self):
         self.waiting_times = []
 
@@ -222,6 +269,9 @@ class AverageWaitingTime(BaseCommandMixin):
         if waiting_time >= 0:
             self.waiting_times.append(waiting_time)
 
+    def merge(self, other):
+        self.waiting_times.extend(other.waiting_times)
+
     def raw_results(self):
         total_requests = float(len(self.waiting_times))
         if total_requests > 0:
@@ -253,6 +303,9 @@ class QueuePeaks(BaseCommandMixin):
       set to 1.
     """
 
+    fields = ('accept_date', 'queue_backend')
+    ordered = True
+
     def __init__(self):
         self.requests = {}
         self.threshold = 1
@@ -275,6 +328,9 @@ class QueuePeaks(BaseCommandMixin):
         key = self._generate_key(line.accept_date)
         self.requests[key] = (line.queue_backend, line.accept_date)
 
+    def merge(self, other):
+        self.requests.update(other.requests)
+
     def raw_results(self):
         sorted_requests = OrderedDict(sorted(self.requests.items()))
         peaks = []
@@ -352,6 +408,8 @@ class ConnectionType(BaseCommandMixin):
       The ports are hardcoded, they should be configurable.
     """
 
+    fields = ('is_https',)
+
     def __init__(self):
         self.https = 0
         self.non_https = 0
@@ -362,6 +420,10 @@ class ConnectionType(BaseCommandMixin):
         else:
             self.non_https += 1
 
+    def merge(self, other):
+        self.https += other.https
+        self.non_https += other.non_https
+
     def raw_results(self):
         return self.https, self.non_https
 
@@ -382,8 +444,12 @@ class RequestsPerMinute(BaseCommandMixin):
       command output can be huge otherwise.
     """
 
+    fields = ('accept_date',)
+
     def __init__(self):
         self.requests = defaultdict(int)
+        # windows already given by report()
+        self.reported = set()
 
     def generate_key(self, accept_date):
         date_with_minute_precision = accept_date.replace(second=0, microsecond=0)
@@ -394,6 +460,27 @@ class RequestsPerMinute(BaseCommandMixin):
         key = self.generate_key(line.accept_date)
         self.requests[key] += 1
 
+    def merge(self, other):
+        for key, value in other.requests.items():
+            self.requests[key] += value
+
+    def report(self, output=None):
+        """Print only the windows that closed since the last report, i.e. those
+        before the window of the latest line that were not reported yet.
+
+        They are still kept, :meth:`results` gives all of them.
+        """
+        if not self.requests:
+            return
+        latest = max(self.requests)
+        closed = type(self)()
+        for key, value in self.requests.items():
+            if key < latest and key not in self.reported:
+                closed.requests[key] = value
+        if closed.requests:
+            self.reported.update(closed.requests)
+            closed.results(output=output)
+
     def raw_results(self):
         """Return the list of requests sorted by the timestamp."""
         data = sorted(self.requests.items(), key=lambda data_info: data_info[0])
@@ -432,8 +519,27 @@ class RequestsPerHour(RequestsPerMinute):
 class Print(BaseCommandMixin):
     """Returns the raw lines to be printed."""
 
+    fields = ('raw_line',)
+    ordered = True
+
+    def __init__(self):
+        # partial commands keep the lines, to be printed once merged
+        self.lines = None
+
     def __call__(self, line):
-        print(line.raw_line)
+        if self.lines is None:
+            print(line.raw_line)
+        else:
+            self.lines.append(line.raw_line)
+
+    def partial(self):
+        partial = type(self)()
+        partial.lines = []
+        return partial
+
+    def merge(self, other):
+        for raw_line in other.lines:
+            print(raw_line)
 
     def raw_results(self):
         return
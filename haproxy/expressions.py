@@ -0,0 +1,384 @@
+# -*- coding: utf-8 -*-
+"""Boolean expressions of filters, see
+:func:`haproxy.filters.filter_expression`.
+
+An expression like ``status_code_family[5] and (backend[api] or
+backend[web]) and not ip_range[10.0.0.0/8]`` is parsed into a tree of
+:class:`Filter`, :class:`Not`, :class:`And`, :class:`Or` and
+:class:`Constant` nodes (``not`` binds tighter than ``and``, which binds
+tighter than ``or``; a comma is an ``and``, as on ``-f``).
+
+The tree is then optimized (see :func:`optimize`):
+
+- constants are folded (``x and false`` is ``false``, ``not true`` is
+  ``false``, ``x or not x`` is ``true``),
+- repeated subexpressions are evaluated once (``x and x`` is ``x``, ``(a and
+  b) or (a and c)`` is ``a and (b or c)``), and every filter is created
+  once however many times it appears,
+- the operands of ``and`` and ``or`` are sorted by cost, so that the cheap
+  ones short-circuit the expensive ones.
+
+The result is compiled, with the other filters, into a single predicate (see
+:func:`haproxy.filters.compile_filters`).
+"""
+from haproxy import filters
+from haproxy.planner import required_fields
+from haproxy.utils import VALID_FILTERS
+
+import re
+
+
+TOKEN_REGEX = re.compile(
+    r'\s*(?:'
+    r'(?P<open>\()|(?P<close>\))|(?P<comma>,)|'
+    r'(?P<keyword>and|or|not|true|false)(?![\w\[])|'
+    r'(?P<name>\w+)(?:\[(?P<argument>[^\]]*)\])?'
+    r')'
+)
+
+# words and characters that make an argument of -f an expression, rather
+# than a list of filters
+EXPRESSION_REGEX = re.compile(r'[()]|\b(and|or|not|true|false)\b')
+
+# arguments of filters, they can have any word or character
+ARGUMENT_REGEX = re.compile(r'\[[^\]]*\]')
+
+
+def is_expression(text):
+    """Whether the argument of ``-f`` is an expression, not only filters
+    separated by commas.
+    """
+    return EXPRESSION_REGEX.search(ARGUMENT_REGEX.sub('[]', text)) is not None
+
+
+class Node(object):
+    """A node of the tree of an expression, equal to those of the same type
+    and fields.
+    """
+
+    __slots__ = ()
+
+    def key(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.key() == other.key()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((type(self).__name__, self.key()))
+
+
+class Constant(Node):
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __repr__(self):
+        return 'true' if self.value else 'false'
+
+
+class Filter(Node):
+    __slots__ = ('name', 'argument')
+
+    def __init__(self, name, argument=None):
+        self.name = name
+        self.argument = argument
+
+    def __repr__(self):
+        if self.argument is None:
+            return self.name
+        return f'{self.name}[{self.argument}]'
+
+
+class Not(Node):
+    __slots__ = ('operand',)
+
+    def __init__(self, operand):
+        self.operand = operand
+
+    def __repr__(self):
+        return f'not {self.operand!r}'
+
+
+class And(Node):
+    __slots__ = ('operands',)
+
+    def __init__(self, operands):
+        self.operands = tuple(operands)
+
+    def __repr__(self):
+        return '(' + ' and '.join(repr(operand) for operand in self.operands) + ')'
+
+
+class Or(Node):
+    __slots__ = ('operands',)
+
+    def __init__(self, operands):
+        self.operands = tuple(operands)
+
+    def __repr__(self):
+        return '(' + ' or '.join(repr(operand) for operand in self.operands) + ')'
+
+
+def parse_expression(text):
+    """Parse an expression into its tree.
+
+    :raises ValueError: if it is not valid, or a filter does not exist.
+    """
+    tokens = []
+    position = 0
+    text = text.rstrip()
+    while position < len(text):
+        match = TOKEN_REGEX.match(text, position)
+        if match is None or match.end() == position:
+            raise ValueError(
+                f'Error on filter expression at "{text[position:].strip()}"'
+            )
+        position = match.end()
+        tokens.append(match)
+    parser = _Parser(tokens, text)
+    node = parser.disjunction()
+    if parser.position < len(tokens):
+        parser.error()
+    return node
+
+
+class _Parser(object):
+    """Recursive descent parser of the tokens of an expression."""
+
+    def __init__(self, tokens, text):
+        self.tokens = tokens
+        self.text = text
+        self.position = 0
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return None
+
+    def accept(self, group, value=None):
+        token = self.peek()
+        if token is None or token.group(group) is None:
+            return False
+        if value is not None and token.group(group) != value:
+            return False
+        self.position += 1
+        return True
+
+    def error(self):
+        token = self.peek()
+        if token is None:
+            raise ValueError(f'Error on filter expression "{self.text}": incomplete')
+        raise ValueError(
+            f'Error on filter expression at "{self.text[token.start():].strip()}"'
+        )
+
+    def disjunction(self):
+        operands = [self.conjunction()]
+        while self.accept('keyword', 'or'):
+            operands.append(self.conjunction())
+        return operands[0] if len(operands) == 1 else Or(operands)
+
+    def conjunction(self):
+        operands = [self.negation()]
+        while self.accept('keyword', 'and') or self.accept('comma'):
+            operands.append(self.negation())
+        return operands[0] if len(operands) == 1 else And(operands)
+
+    def negation(self):
+        if self.accept('keyword', 'not'):
+            return Not(self.negation())
+        return self.atom()
+
+    def atom(self):
+        token = self.peek()
+        if self.accept('open'):
+            node = self.disjunction()
+            if not self.accept('close'):
+                self.error()
+            return node
+        if self.accept('keyword', 'true'):
+            return Constant(True)
+        if self.accept('keyword', 'false'):
+            return Constant(False)
+        if self.accept('name'):
+            name = token.group('name')
+            if name not in VALID_FILTERS or name == 'expression':
+                raise ValueError(
+                    f'filter "{name}" is not available. '
+                    'Use --list-filters to get a list of all available filters.'
+                )
+            return Filter(name, token.group('argument'))
+        self.error()
+
+
+def optimize(node, cost):
+    """Simplify a tree, and sort the operands of ``and`` and ``or`` by cost.
+
+    :param cost: function that tells the cost of evaluating a node.
+    """
+    if isinstance(node, Not):
+        operand = optimize(node.operand, cost)
+        if isinstance(operand, Constant):
+            return Constant(not operand.value)
+        if isinstance(operand, Not):
+            return operand.operand
+        return Not(operand)
+    if not isinstance(node, (And, Or)):
+        return node
+
+    kind = type(node)
+    # the value that decides an `and` (false) or an `or` (true) on its own
+    decisive = kind is Or
+    operands = []
+    for child in (optimize(operand, cost) for operand in node.operands):
+        # (a and b) and c is a and b and c
+        for operand in child.operands if type(child) is kind else (child,):
+            if isinstance(operand, Constant):
+                if operand.value is decisive:
+                    return Constant(decisive)
+                continue
+            if operand not in operands:
+                operands.append(operand)
+    # x and not x is false, x or not x is true
+    for operand in operands:
+        if Not(operand) in operands:
+            return Constant(decisive)
+    if not operands:
+        return Constant(not decisive)
+    if len(operands) == 1:
+        return operands[0]
+
+    factored = _factor(kind, operands)
+    if factored is not None:
+        return optimize(factored, cost)
+    return kind(sorted(operands, key=cost))
+
+
+def _factor(kind, operands):
+    """Take the operands that all the operands of an `or` of `and` (or the
+    other way around) share out of them: ``(a and b) or (a and c)`` is ``a and
+    (b or c)``.
+    """
+    dual = And if kind is Or else Or
+    groups = [
+        operand.operands if type(operand) is dual else (operand,)
+        for operand in operands
+    ]
+    shared = [operand for operand in groups[0] if all(operand in g for g in groups)]
+    if not shared:
+        return None
+    rests = []
+    for group in groups:
+        rest = [operand for operand in group if operand not in shared]
+        # a or (a and b) is a: an empty `and` is true
+        rests.append(dual(rest) if rest else Constant(dual is And))
+    return dual(shared + [kind(rests)])
+
+
+class Expression(object):
+    """A parsed and optimized expression of filters.
+
+    :param text: the expression.
+    :raises ValueError: if it is not valid, or a filter does not exist.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        tree = parse_expression(text)
+        # every filter is created once, however many times it appears
+        self.filters = {}
+        self._create_filters(tree)
+        self.tree = optimize(tree, self._cost)
+        self.cost = self._cost(self.tree)
+        used = [self.filters[leaf] for leaf in self._leaves(self.tree)]
+        self.fields = required_fields(used)
+        if self.fields is not None:
+            self.fields = tuple(sorted(self.fields))
+        self.raw_text = max(self._raw_texts(self.tree), key=len, default=None)
+        namespace = {}
+        source = (
+            'def evaluate(line):\n'
+            f'    if {self.condition("node", namespace)}:\n'
+            '        return True\n'
+            '    return False\n'
+        )
+        exec(compile(source, '<expression>', 'exec'), namespace)
+        self.evaluate = namespace['evaluate']
+
+    def _create_filters(self, node):
+        if isinstance(node, Filter):
+            if node not in self.filters:
+                factory = VALID_FILTERS[node.name]['obj']
+                self.filters[node] = (
+                    factory() if node.argument is None else factory(node.argument)
+                )
+        elif isinstance(node, Not):
+            self._create_filters(node.operand)
+        elif isinstance(node, (And, Or)):
+            for operand in node.operands:
+                self._create_filters(operand)
+
+    def _leaves(self, node):
+        if isinstance(node, Filter):
+            yield node
+        elif isinstance(node, Not):
+            yield from self._leaves(node.operand)
+        elif isinstance(node, (And, Or)):
+            for operand in node.operands:
+                yield from self._leaves(operand)
+
+    def _cost(self, node):
+        if isinstance(node, Filter):
+            return filters.cost(self.filters[node])
+        if isinstance(node, Not):
+            return self._cost(node.operand)
+        if isinstance(node, (And, Or)):
+            return sum(self._cost(operand) for operand in node.operands)
+        return 0
+
+    def _raw_texts(self, node):
+        """Raw texts that every line that meets the expression contains."""
+        if isinstance(node, Filter):
+            raw_text = getattr(self.filters[node], 'raw_text', None)
+            if raw_text is not None:
+                yield raw_text
+        elif isinstance(node, And):
+            for operand in node.operands:
+                yield from self._raw_texts(operand)
+
+    def condition(self, name, namespace):
+        """The source code of the expression, see
+        :func:`haproxy.filters.condition`.
+        """
+        names = {}
+        for index, node in enumerate(self.filters):
+            names[node] = f'{name}_{index}'
+        return self._condition(self.tree, names, namespace)
+
+    def _condition(self, node, names, namespace):
+        if isinstance(node, Constant):
+            return repr(node.value)
+        if isinstance(node, Filter):
+            return filters.condition(self.filters[node], names[node], namespace)
+        if isinstance(node, Not):
+            return f'not ({self._condition(node.operand, names, namespace)})'
+        joiner = ' and ' if isinstance(node, And) else ' or '
+        return joiner.join(
+            f'({self._condition(operand, names, namespace)})'
+            for operand in node.operands
+        )
+
+    def __getstate__(self):
+        # the compiled expression can not be pickled, it is compiled again
+        return self.text
+
+    def __setstate__(self, text):
+        self.__init__(text)
+
+    def __repr__(self):
+        return f'Expression({self.tree!r})'
@@ -1,4 +1,30 @@
 # -*- coding: utf-8 -*-
+"""Filters for :class:`.Line` objects.
+
+Every ``filter_*`` function returns a filter: a callable that tells whether a
+line passes it, with the attributes it reads on ``fields``. Filters are
+``functools.partial`` objects of module level functions, so that they can be
+sent to worker processes.
+
+Filters can also tell, on ``raw_text``, a text that every line passing them
+contains, as bytes. Lines without it are skipped before being parsed, see
+:func:`raw_texts`.
+
+The filters given to analyze log files are compiled, see
+:func:`compile_filters`, into a single predicate that evaluates the cheapest
+and most selective ones first.
+"""
+from functools import lru_cache
+from functools import partial
+from haproxy.networks import IPSet
+from haproxy.networks import Networks
+from haproxy.patterns import Patterns
+
+
+def _ip(ip, log_line):
+    return log_line.ip == ip
+
+
 def filter_ip(ip):
     """Filter :class:`.Line` objects by IP.
 
@@ -8,31 +34,68 @@ def filter_ip(ip):
     :rtype: function
     """
 
-    def filter_func(log_line):
-        return log_line.ip == ip
+    filter_func = partial(_ip, ip)
+    filter_func.fields = ('ip',)
+    filter_func.raw_text = _raw_text(ip)
+    return filter_func
+
+
+def _ips(ips, log_line):
+    return log_line.ip in ips
+
+
+def filter_ips(ips):
+    """Filter :class:`.Line` objects whose IP is any of the given ones.
+
+    Many IPs can be given, separated by commas, or on a file, one per line,
+    with ``@`` and its path. They are packed in memory, so that lists of
+    hundreds of thousands of IPs (e.g. blocklists) are cheap to hold, and to
+    look up (see :class:`haproxy.networks.IPSet`).
 
+    :param ips: IPs that you want to filter to.
+    :type ips: string
+    :returns: a function that filters by the provided IPs.
+    :rtype: function
+    """
+    values = _values(ips)
+    filter_func = partial(_ips, IPSet(values))
+    filter_func.fields = ('ip',)
+    filter_func.raw_text = _raw_text(values[0]) if len(values) == 1 else None
     return filter_func
 
 
+def _ip_range(networks, log_line):
+    return log_line.ip in networks
+
+
 def filter_ip_range(ip_range):
     """Filter :class:`.Line` objects by IP range.
 
-    Both *192.168.1.203* and *192.168.1.10* are valid if the provided ip
-    range is ``192.168.1`` whereas *192.168.2.103* is not valid (note the
-    *.2.*).
+    Ranges are networks in CIDR notation (``10.0.0.0/8``, ``2001:db8::/32``),
+    single IPs, or the first octets (or groups, for IPv6, e.g. ``fe80::``) of
+    the IPs: both *192.168.1.203* and *192.168.1.10* are valid if the
+    provided ip range is ``192.168.1`` whereas *192.168.2.103* and
+    *192.168.10.1* are not valid.
+
+    Many ranges can be given, separated by commas, or on a file, one per
+    line, with ``@`` and its path (see :mod:`haproxy.networks`).
 
-    :param ip_range: IP range that you want to filter to.
+    :param ip_range: IP ranges that you want to filter to.
     :type ip_range: string
-    :returns: a function that filters by the provided IP range.
+    :returns: a function that filters by the provided IP ranges.
     :rtype: function
     """
+    networks = Networks(_values(ip_range))
+    filter_func = partial(_ip_range, networks)
+    filter_func.fields = ('ip',)
+    filter_func.raw_text = None
+    if len(networks) == 1:
+        filter_func.raw_text = _network_raw_text(networks.networks[0])
+    return filter_func
 
-    def filter_func(log_line):
-        ip = log_line.ip
-        if ip:
-            return ip.startswith(ip_range)
 
-    return filter_func
+def _path(path, log_line):
+    return path in log_line.http_request_path
 
 
 def filter_path(path):
@@ -44,12 +107,37 @@ def filter_path(path):
     :rtype: function
     """
 
-    def filter_func(log_line):
-        return path in log_line.http_request_path
+    filter_func = partial(_path, path)
+    filter_func.fields = ('http_request_path',)
+    filter_func.raw_text = _raw_text(path)
+    return filter_func
+
+
+def _paths(patterns, log_line):
+    return patterns.search(log_line.http_request_path)
+
+
+def filter_paths(paths):
+    """Filter :class:`.Line` objects whose request path contains any of the
+    given parts of paths.
 
+    Many parts of paths can be given, separated by commas, or on a file, one
+    per line, with ``@`` and its path (see :mod:`haproxy.patterns`).
+
+    :param paths: parts of paths, one of them needs to be on the request path.
+    :type paths: string
+    :returns: a function that filters by the provided paths.
+    :rtype: function
+    """
+    filter_func = partial(_paths, Patterns(_values(paths)))
+    filter_func.fields = ('http_request_path',)
     return filter_func
 
 
+def _ssl(log_line):
+    return log_line.is_https
+
+
 def filter_ssl(ignore=True):
     """Filter :class:`.Line` objects that from SSL connections.
 
@@ -60,12 +148,16 @@ def filter_ssl(ignore=True):
     :rtype: function
     """
 
-    def filter_func(log_line):
-        return log_line.is_https
-
+    filter_func = partial(_ssl)
+    filter_func.fields = ('is_https',)
+    filter_func.raw_text = b':443'
     return filter_func
 
 
+def _slow_requests(slowness, log_line):
+    return slowness <= log_line.time_wait_response
+
+
 def filter_slow_requests(slowness):
     """Filter :class:`.Line` objects by their response time.
 
@@ -77,13 +169,15 @@ def filter_slow_requests(slowness):
     :rtype: function
     """
 
-    def filter_func(log_line):
-        slowness_int = int(slowness)
-        return slowness_int <= log_line.time_wait_response
-
+    filter_func = partial(_slow_requests, int(slowness))
+    filter_func.fields = ('time_wait_response',)
     return filter_func
 
 
+def _wait_on_queues(max_waiting, log_line):
+    return max_waiting >= log_line.time_wait_queues
+
+
 def filter_wait_on_queues(max_waiting):
     """Filter :class:`.Line` objects by their queueing time in
     HAProxy.
@@ -96,13 +190,15 @@ def filter_wait_on_queues(max_waiting):
     :rtype: function
     """
 
-    def filter_func(log_line):
-        waiting = int(max_waiting)
-        return waiting >= log_line.time_wait_queues
-
+    filter_func = partial(_wait_on_queues, int(max_waiting))
+    filter_func.fields = ('time_wait_queues',)
     return filter_func
 
 
+def _status_code(http_status, log_line):
+    return log_line.status_code == http_status
+
+
 def filter_status_code(http_status):
     """Filter :class:`.Line` objects by their HTTP status code.
 
@@ -113,12 +209,40 @@ def filter_status_code(http_status):
     :rtype: function
     """
 
-    def filter_func(log_line):
-        return log_line.status_code == http_status
+    filter_func = partial(_status_code, http_status)
+    filter_func.fields = ('status_code',)
+    filter_func.raw_text = _raw_text(http_status)
+    return filter_func
+
+
+def _status_codes(http_statuses, log_line):
+    return log_line.status_code in http_statuses
+
+
+def filter_status_codes(http_statuses):
+    """Filter :class:`.Line` objects whose HTTP status code is any of the
+    given ones.
 
+    Many status codes can be given, separated by commas, or on a file, one
+    per line, with ``@`` and its path.
+
+    :param http_statuses: HTTP status codes (200, 404, 502...) to filter
+      lines with.
+    :type http_statuses: string
+    :returns: a function that filters by HTTP status codes.
+    :rtype: function
+    """
+    values = frozenset(_values(http_statuses))
+    filter_func = partial(_status_codes, values)
+    filter_func.fields = ('status_code',)
+    filter_func.raw_text = _raw_text(*values) if len(values) == 1 else None
     return filter_func
 
 
+def _status_code_family(family_number, log_line):
+    return log_line.status_code.startswith(family_number)
+
+
 def filter_status_code_family(family_number):
     """Filter :class:`.Line` objects by their family of HTTP status
     code, i.e. 2xx, 3xx, 4xx
@@ -130,12 +254,15 @@ def filter_status_code_family(family_number):
     :rtype: function
     """
 
-    def filter_func(log_line):
-        return log_line.status_code.startswith(family_number)
-
+    filter_func = partial(_status_code_family, family_number)
+    filter_func.fields = ('status_code',)
     return filter_func
 
 
+def _http_method(http_method, log_line):
+    return log_line.http_request_method == http_method
+
+
 def filter_http_method(http_method):
     """Filter :class:`.Line` objects by their HTTP method used (i.e.
     GET, POST...).
@@ -146,12 +273,39 @@ def filter_http_method(http_method):
     :rtype: function
     """
 
-    def filter_func(log_line):
-        return log_line.http_request_method == http_method
+    filter_func = partial(_http_method, http_method)
+    filter_func.fields = ('http_request_method',)
+    filter_func.raw_text = _raw_text(http_method)
+    return filter_func
+
+
+def _http_methods(http_methods, log_line):
+    return log_line.http_request_method in http_methods
+
+
+def filter_http_methods(http_methods):
+    """Filter :class:`.Line` objects whose HTTP method is any of the given
+    ones.
 
+    Many HTTP methods can be given, separated by commas, or on a file, one
+    per line, with ``@`` and its path.
+
+    :param http_methods: HTTP methods (POST, GET...).
+    :type http_methods: string
+    :returns: a function that filters by the given HTTP methods.
+    :rtype: function
+    """
+    values = frozenset(_values(http_methods))
+    filter_func = partial(_http_methods, values)
+    filter_func.fields = ('http_request_method',)
+    filter_func.raw_text = _raw_text(*values) if len(values) == 1 else None
     return filter_func
 
 
+def _backend(backend_name, log_line):
+    return log_line.backend_name == backend_name
+
+
 def filter_backend(backend_name):
     """Filter :class:`.Line` objects by the HAProxy backend name
     they were processed with.
@@ -162,12 +316,16 @@ def filter_backend(backend_name):
     :rtype: function
     """
 
-    def filter_func(log_line):
-        return log_line.backend_name == backend_name
-
+    filter_func = partial(_backend, backend_name)
+    filter_func.fields = ('backend_name',)
+    filter_func.raw_text = _raw_text(backend_name, suffix='/')
     return filter_func
 
 
+def _frontend(frontend_name, log_line):
+    return log_line.frontend_name == frontend_name
+
+
 def filter_frontend(frontend_name):
     """Filter :class:`.Line` objects by the HAProxy frontend name
     the connection arrived from.
@@ -178,12 +336,16 @@ def filter_frontend(frontend_name):
     :rtype: function
     """
 
-    def filter_func(log_line):
-        return log_line.frontend_name == frontend_name
-
+    filter_func = partial(_frontend, frontend_name)
+    filter_func.fields = ('frontend_name',)
+    filter_func.raw_text = _raw_text(frontend_name)
     return filter_func
 
 
+def _server(server_name, log_line):
+    return log_line.server_name == server_name
+
+
 def filter_server(server_name):
     """Filter :class:`.Line` objects by the downstream server that
     handled the connection.
@@ -194,12 +356,22 @@ def filter_server(server_name):
     :rtype: function
     """
 
-    def filter_func(log_line):
-        return log_line.server_name == server_name
-
+    filter_func = partial(_server, server_name)
+    filter_func.fields = ('server_name',)
+    filter_func.raw_text = _raw_text(server_name, prefix='/')
     return filter_func
 
 
+def _response_size(size_value, log_line):
+    bytes_read = log_line.bytes_read
+    if bytes_read.startswith('+'):
+        bytes_read = int(bytes_read[1:])
+    else:
+        bytes_read = int(bytes_read)
+
+    return bytes_read >= size_value
+
+
 def filter_response_size(size):
     """Filter :class:`.Line` objects by the response size (in bytes).
 
@@ -210,18 +382,194 @@ def filter_response_size(size):
     :returns: a function that filters by the response size.
     :rtype: function
     """
+
     if size.startswith('+'):
         size_value = int(size[1:])
     else:
         size_value = int(size)
 
-    def filter_func(log_line):
-        bytes_read = log_line.bytes_read
-        if bytes_read.startswith('+'):
-            bytes_read = int(bytes_read[1:])
-        else:
-            bytes_read = int(bytes_read)
+    filter_func = partial(_response_size, size_value)
+    filter_func.fields = ('bytes_read',)
+    return filter_func
+
+
+def _expression(expression, log_line):
+    return expression.evaluate(log_line)
+
+
+def filter_expression(expression):
+    """Filter :class:`.Line` objects with a boolean expression of filters,
+    e.g. ``status_code_family[5] and (backend[api] or backend[web]) and not
+    ip_range[10.0.0.0/8]``.
 
-        return bytes_read >= size_value
+    Filters are combined with ``and``, ``or``, ``not`` and parentheses,
+    ``true`` and ``false`` are always and never met.
+    Expressions can be given to ``-f`` as they are.
+
+    :param expression: the expression (see :mod:`haproxy.expressions`).
+    :type expression: string
+    :returns: a function that filters by the expression.
+    :rtype: function
+    """
+    from haproxy.expressions import Expression
 
+    expression = Expression(expression)
+    filter_func = partial(_expression, expression)
+    filter_func.fields = expression.fields
+    filter_func.raw_text = expression.raw_text
     return filter_func
+
+
+def _values(argument):
+    """The values of the argument of a filter: separated by commas, or one
+    per line of a file if it is ``@`` and the path of the file.
+
+    Empty lines, and lines starting with ``#``, of files are ignored.
+    """
+    if argument.startswith('@'):
+        with open(argument[1:], encoding='utf-8') as values_file:
+            lines = (line.strip() for line in values_file)
+            return [line for line in lines if line and not line.startswith('#')]
+    return [value.strip() for value in argument.split(',') if value.strip()]
+
+
+def _network_raw_text(network):
+    """The raw text of the IPs of an IPv4 network, their first octets."""
+    if network.version != 4 or network.prefixlen % 8 or not network.prefixlen:
+        return None
+    octets = str(network.network_address).split('.')[: network.prefixlen // 8]
+    suffix = '.' if network.prefixlen < 32 else ''
+    return _raw_text('.'.join(octets), suffix=suffix)
+
+
+def _raw_text(text, prefix='', suffix=''):
+    """The raw text of a filter argument, the value of an attribute of the
+    lines that pass it.
+
+    Unless the attribute could have a value that is not on the log line:
+    ``invalid`` on lines with a bad HTTP request, or characters that could
+    not be decoded.
+    """
+    if not text or text in 'invalid' or '\ufffd' in text or '\n' in text:
+        return None
+    return f'{prefix}{text}{suffix}'.encode('utf-8')
+
+
+@lru_cache(maxsize=32)
+def raw_texts(filters):
+    """The texts that a raw log line needs to contain to pass all the given
+    filters, the longest (likely the most selective) first.
+
+    :param filters: filters a line needs to pass.
+    :type filters: tuple
+    :returns: a tuple of bytes, empty if the filters do not tell any.
+    :rtype: tuple
+    """
+    texts = {getattr(f, 'raw_text', None) for f in filters}
+    texts.discard(None)
+    return tuple(sorted(texts, key=lambda text: (-len(text), text)))
+
+
+# expressions that filters are compiled to, ``{}`` being their argument, and
+# their rank: the lower, the cheaper to evaluate and the fewer lines they
+# usually let pass, so the sooner they are evaluated
+_COMPILED = {
+    _status_code: ('line.status_code == {}', 0),
+    _http_method: ('line.http_request_method == {}', 0),
+    _backend: ('line.backend_name == {}', 0),
+    _frontend: ('line.frontend_name == {}', 0),
+    _server: ('line.server_name == {}', 0),
+    _ip: ('line.ip == {}', 0),
+    _status_codes: ('line.status_code in {}', 0),
+    _http_methods: ('line.http_request_method in {}', 0),
+    _status_code_family: ('line.status_code.startswith({})', 1),
+    _ip_range: ('line.ip in {}', 1),
+    _ips: ('line.ip in {}', 1),
+    _slow_requests: ('{} <= line.time_wait_response', 2),
+    _wait_on_queues: ('{} >= line.time_wait_queues', 2),
+    _ssl: ('line.is_https', 3),
+    _path: ('{} in line.http_request_path', 4),
+    _response_size: ('int(line.bytes_read) >= {}', 5),
+    _paths: ('{}.search(line.http_request_path)', 6),
+}
+
+# rank of filters that are not known, they are called as they are
+_UNKNOWN_RANK = 7
+
+
+@lru_cache(maxsize=32)
+def compile_filters(filters, negate=False):
+    """Compile filters into a single predicate, a function that tells whether
+    a line passes all of them (or, if ``negate``, not all of them).
+
+    Known filters are inlined in the predicate, cheap and selective ones
+    first, so that evaluating them takes a single function call per line.
+
+    Predicates are cached, as they are compiled again on every worker
+    process, and can not be pickled.
+
+    :param filters: filters a line needs to pass.
+    :type filters: tuple
+    :param negate: whether to reverse the filters.
+    :type negate: bool
+    :returns: the predicate, with the attributes it reads on ``fields`` and
+      the position of the filters in the order they are evaluated on
+      ``order``.
+    :rtype: function
+    """
+    order = sorted(range(len(filters)), key=lambda index: cost(filters[index]))
+    namespace = {}
+    conditions = []
+    for index in order:
+        expression = condition(filters[index], f'filter_{index}', namespace)
+        conditions.append(f'({expression})')
+    source = (
+        'def predicate(line):\n'
+        f'    if {" and ".join(conditions) or "True"}:\n'
+        f'        return {not negate}\n'
+        f'    return {negate}\n'
+    )
+    exec(compile(source, '<filters>', 'exec'), namespace)
+    predicate = namespace['predicate']
+    predicate.fields = tuple(
+        sorted({field for f in filters for field in getattr(f, 'fields', ())})
+    )
+    predicate.order = tuple(order)
+    return predicate
+
+
+def condition(filter_func, name, namespace):
+    """The source code of the condition a filter is compiled to, an
+    expression on ``line``.
+
+    The objects it references are added to the namespace the code is run
+    with, under names that start with the given one.
+    """
+    function = _function(filter_func)
+    if function is _expression:
+        return filter_func.args[0].condition(name, namespace)
+    expression, _ = _COMPILED.get(function, (None, None))
+    if expression is None:
+        namespace[name] = filter_func
+        return f'{name}(line)'
+    # arguments are referenced, never written in the source code
+    namespace[name] = filter_func.args[0] if filter_func.args else None
+    return expression.format(name)
+
+
+def cost(filter_func):
+    """How soon a filter is evaluated, the lower the sooner: how expensive it
+    is, and how many lines it usually lets pass.
+    """
+    function = _function(filter_func)
+    if function is _expression:
+        return filter_func.args[0].cost
+    _, rank = _COMPILED.get(function, (None, _UNKNOWN_RANK))
+    return rank + 1
+
+
+def _function(filter_func):
+    """The module level function of a filter, if it can be compiled."""
+    if isinstance(filter_func, partial) and not filter_func.keywords:
+        return filter_func.func
+    return None
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""Follow log files while they are being written, like ``tail -F``.
+
+Log files are read from their end, and every time they grow their new lines
+are read. Waiting for them to grow is done with inotify on Linux, and by
+polling elsewhere (or if inotify is not available).
+
+Log rotations are followed: when the log file is renamed or removed and a new
+one is created in its place, what is left of the old log file is read, and
+then the new one from its start. When the log file is truncated (e.g. by a
+``copytruncate`` rotation) it is read from its start again.
+"""
+import ctypes
+import ctypes.util
+import os
+import select
+import time
+
+
+# how often log files are checked when polling, in seconds
+POLL_INTERVAL = 0.5
+
+# inotify events of a folder that tell that log files within it changed
+IN_MODIFY = 0x002
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+
+INOTIFY_MASK = IN_MODIFY | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+
+class FollowedFile(object):
+    """A log file being followed.
+
+    :param path: path of the log file.
+    :param from_start: read the lines already on the log file, instead of
+      only the new ones.
+    """
+
+    def __init__(self, path, from_start=False):
+        self.path = path
+        self._file = open(path, 'rb')
+        if not from_start:
+            self._file.seek(0, os.SEEK_END)
+
+    def close(self):
+        self._file.close()
+
+    def read(self, size=-1):
+        """Read the lines added to the log file since the last time.
+
+        :param size: read at most (about) this many bytes, all by default.
+        :returns: the new data, only whole lines: a half written last line is
+          read once it is finished. Except for the last line of a rotated log
+          file, as nothing else is written to it.
+        """
+        current = self._current_stat()
+        if current is not None:
+            if current.st_ino != os.fstat(self._file.fileno()).st_ino:
+                # rotated: what is left of the old log file,
+                # the new one is read the next time
+                data = self._file.read()
+                self._file.close()
+                self._file = open(self.path, 'rb')
+                return data
+            if current.st_size < self._file.tell():
+                # truncated
+                self._file.seek(0)
+        # else it was moved away, and the new log file is not there yet
+
+        data = self._file.read(size)
+        if b'\n' not in data and len(data) == size:
+            # a line longer than size: read up to its end
+            data += self._file.readline()
+        end = data.rfind(b'\n') + 1
+        self._file.seek(end - len(data), os.SEEK_CUR)
+        return data[:end]
+
+    def _current_stat(self):
+        try:
+            return os.stat(self.path)
+        except FileNotFoundError:
+            return None
+
+
+class PollingWatcher(object):
+    """Wait for log files to change by checking them every now and then."""
+
+    def wait(self, timeout=None):
+        if timeout is None:
+            timeout = POLL_INTERVAL
+        time.sleep(min(timeout, POLL_INTERVAL))
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher(object):
+    """Wait for log files to change with inotify, only on Linux.
+
+    The folders of the log files are watched, rather than the log files
+    themselves, so that new log files created by a rotation are noticed.
+
+    :raises OSError: if inotify is not available.
+    """
+
+    def __init__(self, paths):
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            inotify_init1 = libc.inotify_init1
+            inotify_add_watch = libc.inotify_add_watch
+        except (OSError, AttributeError):
+            raise OSError('inotify is not available')
+        self.fd = inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1')
+        folders = {os.path.dirname(os.path.abspath(path)) for path in paths}
+        for folder in folders:
+            if inotify_add_watch(self.fd, os.fsencode(folder), INOTIFY_MASK) < 0:
+                self.close()
+                raise OSError(ctypes.get_errno(), 'inotify_add_watch', folder)
+
+    def wait(self, timeout=None):
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return
+        # only whether something changed matters, not the events
+        try:
+            while os.read(self.fd, 64 * 1024):
+                pass
+        except BlockingIOError:
+            pass
+
+    def close(self):
+        os.close(self.fd)
+
+
+def watch(paths):
+    """Get a watcher for the given log files: inotify if available, polling
+    otherwise.
+    """
+    try:
+        return InotifyWatcher(paths)
+    except OSError:
+        return PollingWatcher()
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""Sparse time index of log files, stored next to them.
+
+The index records the byte offset of the first line of every minute of a
+plain text log file, so that the lines of a time frame are found without
+even bisecting the log file. It is stored as JSON on a sidecar file
+(``haproxy.log`` gets ``haproxy.log.idx``) together with the size,
+modification time and inode of the log file, to know when it is outdated.
+
+Log files that are only appended to get their index extended from where it
+was left, truncated or replaced log files get a new one.
+"""
+from bisect import bisect_right
+from datetime import datetime
+from datetime import timedelta
+from haproxy.readers import compression
+from haproxy.readers import file_identity
+from haproxy.readers import head_checksum
+from haproxy.readers import is_appended
+from haproxy.readers import map_file
+from haproxy.readers import next_dated_line
+from haproxy.readers import seek_date
+
+import json
+import os
+
+
+INDEX_SUFFIX = '.idx'
+
+INDEX_VERSION = 1
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def date_to_minute(date):
+    """Minutes since the epoch of a (naive) ``datetime``."""
+    return (date - EPOCH) // timedelta(minutes=1)
+
+
+def minute_to_date(minute):
+    """``datetime`` of the start of a minute since the epoch."""
+    return EPOCH + timedelta(minutes=minute)
+
+
+class TimeIndex(object):
+    """Byte offsets of the first line of every minute of a log file.
+
+    :param logfile: path of the log file.
+    :param identity: ``(size, mtime, inode)`` of the log file when indexed.
+    :param indexed: byte offset up to where the log file is indexed,
+      only whole lines are.
+    :param checksum: CRC32 of the first bytes of the log file.
+    :param minutes: sorted list of minutes since the epoch.
+    :param offsets: byte offset of the first line of each minute.
+    """
+
+    def __init__(
+        self, logfile, identity=None, indexed=0, checksum=0, minutes=None, offsets=None
+    ):
+        self.logfile = logfile
+        self.identity = identity
+        self.indexed = indexed
+        self.checksum = checksum
+        self.minutes = minutes or []
+        self.offsets = offsets or []
+
+    @property
+    def path(self):
+        return f'{self.logfile}{INDEX_SUFFIX}'
+
+    @classmethod
+    def load(cls, logfile):
+        """Read the index of a log file.
+
+        :returns: the index, or ``None`` if there is none or it can not be
+          read.
+        """
+        index = cls(logfile)
+        try:
+            with open(index.path) as index_file:
+                data = json.load(index_file)
+        except (OSError, ValueError):
+            return None
+        if data.get('version') != INDEX_VERSION:
+            return None
+        index.identity = tuple(data['identity'])
+        index.indexed = data['indexed']
+        index.checksum = data['checksum']
+        index.minutes = data['minutes']
+        index.offsets = data['offsets']
+        return index
+
+    def save(self):
+        data = {
+            'version': INDEX_VERSION,
+            'identity': self.identity,
+            'indexed': self.indexed,
+            'checksum': self.checksum,
+            'minutes': self.minutes,
+            'offsets': self.offsets,
+        }
+        # replaced at once, an interrupted run does not leave half an index
+        with open(f'{self.path}.tmp', 'w') as index_file:
+            json.dump(data, index_file)
+        os.replace(f'{self.path}.tmp', self.path)
+
+    def update(self, buffer):
+        """Bring the index up to date with the (mapped) log file.
+
+        :returns: whether the index changed.
+        """
+        identity = file_identity(self.logfile)
+        if identity == self.identity:
+            return False
+
+        appended = is_appended(
+            buffer, identity, self.identity, self.indexed, self.checksum
+        )
+        if not appended:
+            # a new, truncated or rewritten log file
+            self.indexed, self.minutes, self.offsets = 0, [], []
+        self.identity = identity
+        self._index(buffer)
+        self.checksum = head_checksum(buffer, self.indexed)
+        return True
+
+    def _index(self, buffer):
+        """Index the lines added since the last time.
+
+        Instead of reading every line, the first line of the next minute is
+        looked for with a binary search (see
+        :func:`haproxy.readers.seek_date`).
+        """
+        # only whole lines get indexed, the last one might be half written
+        end = buffer.rfind(b'\n') + 1
+        position = self.indexed
+        while position < end:
+            line_start, line_end, date = next_dated_line(buffer, position, end)
+            if date is None:
+                break
+            minute = date_to_minute(date)
+            if not self.minutes or minute > self.minutes[-1]:
+                self.minutes.append(minute)
+                self.offsets.append(line_start)
+            next_minute = minute_to_date(minute + 1)
+            position = seek_date(buffer, next_minute, line_end, end)
+        self.indexed = max(self.indexed, end)
+
+    def window(self, start, end=None, tolerance=timedelta()):
+        """Byte range of the log file with the lines of a time frame.
+
+        It is a bit wider than the time frame: it starts at the first line of
+        the minute of ``start`` and ends at the first line of the minute
+        after ``end``, widened by ``tolerance`` for lines out of order.
+        The part of the log file that is not indexed yet is always included.
+
+        :returns: ``(start, end)`` byte offsets.
+        """
+        position = bisect_right(self.minutes, date_to_minute(start - tolerance)) - 1
+        start_offset = self.offsets[position] if position >= 0 else 0
+        end_offset = None
+        if end is not None:
+            position = bisect_right(self.minutes, date_to_minute(end + tolerance))
+            if position < len(self.offsets):
+                end_offset = self.offsets[position]
+        return start_offset, end_offset
+
+
+def load_index(logfile, buffer):
+    """Get the up to date index of a log file, building it if needed.
+
+    The index is saved if it changed, unless it can not be written.
+
+    :param buffer: mapped log file.
+    """
+    index = TimeIndex.load(logfile) or TimeIndex(logfile)
+    if index.update(buffer):
+        try:
+            index.save()
+        except OSError:
+            # the index is only an optimization,
+            # e.g. the log folder might be read only
+            pass
+    return index
+
+
+def build_index(logfile):
+    """Build or update the index of a log file, and save it.
+
+    :returns: the index, or ``None`` for compressed log files, as they can
+      not be indexed.
+    """
+    buffer = map_file(logfile)
+    if compression(buffer) is not None:
+        return None
+    index = TimeIndex.load(logfile) or TimeIndex(logfile)
+    if index.update(buffer):
+        index.save()
+    return index
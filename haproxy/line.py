@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
 from datetime import datetime
+from functools import lru_cache
+from sys import intern
 
 import enum
 import re
@@ -60,57 +62,328 @@ HTTP_REQUEST_REGEX = re.compile(
     r'(\s+(?P<protocol>\w+/\d\.\d))?'
 )
 
+ACCEPT_DATE_FORMAT = '%d/%b/%Y:%H:%M:%S.%f'
+ACCEPT_DATE_SECONDS_FORMAT = '%d/%b/%Y:%H:%M:%S'
+
+# an hour worth of different seconds fits in the cache
+ACCEPT_DATE_CACHE_SIZE = 4096
+
+# characters allowed on the client IP by HAPROXY_LINE_REGEX
+IP_CHARACTERS = frozenset('0123456789abcdefABCDEF+.:')
+
+
+def _is_number(value, sign=None):
+    """Check that the value is made only of digits, allowing an optional sign."""
+    if value[:1] == sign:
+        value = value[1:]
+    return value.isdecimal()
+
+
+def _all_numbers(values, last_sign=None):
+    """Check that all values are numbers, the last one can have a sign."""
+    for value in values[:-1]:
+        if not value.isdecimal():
+            return False
+    return _is_number(values[-1], last_sign)
+
+
+def tokenize_line(line):
+    """Split a log line in the standard HTTP or TCP log formats on its
+    fixed separators.
+
+    This is a much cheaper equivalent of ``HAPROXY_LINE_REGEX``: the
+    dictionary returned has the same keys and values as the named groups that
+    the regular expression matches (groups that do not match are left out).
+
+    Only log lines with the expected shape are handled, i.e. single spaces
+    between fields, three (HTTP) or one (TCP) fields between the bytes read and
+    the connection counters, no curly brackets within the captured headers...
+    For any other line ``None`` is returned, so callers fall back to the
+    regular expression.
+    """
+    # the regular expression separates fields on any whitespace, leave the
+    # lines with tabs, carriage returns... to it (``str.isprintable`` is false
+    # for all whitespace but the single space)
+    if not line.isprintable():
+        return None
+
+    # Dec  9 13:01:26 localhost haproxy[28029]:
+    # ignore the syslog prefix if present
+    position = line.find(']: ')
+    if position != -1:
+        line = line[position + 3 :]
+
+    # 127.0.0.1:39759
+    client, _, line = line.partition(' ')
+    client_ip, separator, client_port = client.rpartition(':')
+    if not separator or not client_ip or not client_port.isdecimal():
+        return None
+    if not IP_CHARACTERS.issuperset(client_ip):
+        return None
+
+    # [09/Dec/2013:12:59:46.633]
+    position = line.find('] ')
+    if line[:1] != '[' or position < 2:
+        return None
+    fields = {
+        'client_ip': client_ip,
+        'client_port': client_port,
+        'accept_date': line[1:position],
+    }
+    line = line[position + 2 :]
+
+    # {77.24.148.74} "GET /path/to/image HTTP/1.1"
+    position = line.find('"')
+    if position != -1:
+        http_request = line[position + 1 :]
+        if http_request[-1:] == '"':
+            http_request = http_request[:-1]
+        if not http_request or '"' in http_request:
+            return None
+        fields['http_request'] = http_request
+        line = line[:position]
+
+        position = line.find('{')
+        if position != -1:
+            headers = line[position + 1 : -2]
+            if line[-2:] != '} ':
+                return None
+            line = line[:position]
+            if '{' in headers or '}' in headers:
+                request, separator, response = headers.partition('} {')
+                if not separator or '{' in response or '}' in response:
+                    return None
+                if '{' in request or '}' in request:
+                    return None
+                fields['captured_request_headers'] = request
+                fields['captured_response_headers'] = response
+            else:
+                fields['headers'] = headers
+
+        if line[-1:] != ' ':
+            return None
+        line = line[:-1]
+    elif '{' in line:
+        return None
+
+    # loadbalancer default/instance8 0/51536/1/48082/99627 200 83285 - - ----
+    # 87/87/87/1/0 0/67
+    tokens = line.split(' ')
+    if '' in tokens or len(tokens) < 7:
+        return None
+
+    backend_name, separator, server_name = tokens[1].rpartition('/')
+    timers = tokens[2].split('/')
+    connections = tokens[-2].split('/')
+    queues = tokens[-1].split('/')
+    if not separator or len(connections) != 5 or len(queues) != 2:
+        return None
+    if not _all_numbers(connections, '+') or not _all_numbers(queues):
+        return None
+
+    if len(timers) == 5 and len(tokens) == 10:
+        status_code, bytes_read = tokens[3], tokens[4]
+        if not _is_number(status_code, '-') or not _is_number(bytes_read, '+'):
+            return None
+        for timer in timers[:4]:
+            if not _is_number(timer, '-'):
+                return None
+        if not _is_number(timers[4], '+'):
+            return None
+        fields['http_frontend_name'] = tokens[0]
+        fields['http_backend_name'] = backend_name
+        fields['http_server_name'] = server_name
+        fields['http_Tq'] = timers[0]
+        fields['http_Tw'] = timers[1]
+        fields['http_Tc'] = timers[2]
+        fields['http_Tr'] = timers[3]
+        fields['http_Ta'] = timers[4]
+        fields['http_status_code'] = status_code
+        fields['http_bytes_read'] = bytes_read
+        middle = tokens[5:8]
+    elif len(timers) == 3 and len(tokens) == 7:
+        bytes_read = tokens[3]
+        if not _is_number(bytes_read, '+'):
+            return None
+        if not _is_number(timers[0], '-') or not _is_number(timers[1], '-'):
+            return None
+        if not _is_number(timers[2], '+'):
+            return None
+        fields['tcp_frontend_name'] = tokens[0]
+        fields['tcp_backend_name'] = backend_name
+        fields['tcp_server_name'] = server_name
+        fields['tcp_Tw'] = timers[0]
+        fields['tcp_Tc'] = timers[1]
+        fields['tcp_Tt'] = timers[2]
+        fields['tcp_bytes_read'] = bytes_read
+        middle = tokens[4:5]
+    else:
+        return None
+
+    # cookies and termination state could otherwise be taken for timers or
+    # counters by the regular expression
+    for token in middle:
+        if '/' in token:
+            return None
+
+    fields['actconn'] = connections[0]
+    fields['feconn'] = connections[1]
+    fields['beconn'] = connections[2]
+    fields['srv_conn'] = connections[3]
+    fields['retries'] = connections[4]
+    fields['srv_queue'] = queues[0]
+    fields['backend_queue'] = queues[1]
+    return fields
+
+
+@lru_cache(maxsize=ACCEPT_DATE_CACHE_SIZE)
+def _parse_accept_date_seconds(date):
+    return datetime.strptime(date, ACCEPT_DATE_SECONDS_FORMAT)
+
+
+def parse_accept_date(raw_accept_date):
+    """Convert the accept date of a log line to a datetime object.
+
+    Equivalent to ``datetime.strptime(raw_accept_date, ACCEPT_DATE_FORMAT)``,
+    but the date with second precision (``09/Dec/2013:12:59:46``) is parsed
+    only once and cached, as lots of consecutive log lines share it,
+    only the milliseconds are added on every call.
+    """
+    date, separator, fraction = raw_accept_date.rpartition('.')
+    # %f accepts from one up to six digits, right padded with zeros
+    if separator and 0 < len(fraction) <= 6 and not fraction.strip('0123456789'):
+        microsecond = int(fraction.ljust(6, '0'))
+        return _parse_accept_date_seconds(date).replace(microsecond=microsecond)
+    return datetime.strptime(raw_accept_date, ACCEPT_DATE_FORMAT)
+
 
 class LineType(enum.Enum):
     HTTP = 0
     TCP = 1
 
 
+# Line attributes, the named group they come from and how to convert them,
+# if they need to be converted at all
+_COMMON_FIELDS = {
+    'client_ip': ('client_ip', None),
+    'client_port': ('client_port', int),
+    'raw_accept_date': ('accept_date', None),
+    'accept_date': ('accept_date', parse_accept_date),
+    'connections_active': ('actconn', None),
+    'connections_frontend': ('feconn', None),
+    'connections_backend': ('beconn', None),
+    'connections_server': ('srv_conn', None),
+    'retries': ('retries', None),
+    'queue_server': ('srv_queue', int),
+    'queue_backend': ('backend_queue', int),
+}
+
+LINE_FIELDS = {
+    LineType.HTTP: dict(
+        _COMMON_FIELDS,
+        frontend_name=('http_frontend_name', intern),
+        backend_name=('http_backend_name', intern),
+        server_name=('http_server_name', intern),
+        time_wait_request=('http_Tq', int),
+        time_wait_queues=('http_Tw', int),
+        time_connect_server=('http_Tc', int),
+        time_wait_response=('http_Tr', int),
+        total_time=('http_Ta', None),
+        status_code=('http_status_code', intern),
+        bytes_read=('http_bytes_read', None),
+        captured_request_headers=('captured_request_headers', None),
+        captured_response_headers=('captured_response_headers', None),
+        raw_http_request=('http_request', None),
+    ),
+    LineType.TCP: dict(
+        _COMMON_FIELDS,
+        frontend_name=('tcp_frontend_name', intern),
+        backend_name=('tcp_backend_name', intern),
+        server_name=('tcp_server_name', intern),
+        time_wait_queues=('tcp_Tw', int),
+        time_connect_server=('tcp_Tc', int),
+        total_time=('tcp_Tt', int),
+        bytes_read=('tcp_bytes_read', None),
+    ),
+}
+
+# Line attributes that are extracted out of the HTTP request
+HTTP_REQUEST_ATTRIBUTES = (
+    'http_request_method',
+    'http_request_path',
+    'http_request_protocol',
+)
+
+
 class Line(object):
     """For a precise and more detailed description of every field see:
     http://cbonte.github.io/haproxy-dconv/2.2/configuration.html#8.2.3
+
+    Lines keep millions of instances around, so their attributes are stored
+    on ``__slots__`` rather than on a per instance ``__dict__``.
+    Attributes that are not found on the log line are not stored at all,
+    reading them returns ``None``.
+
+    With ``lazy=True`` the log line is only split into its raw values:
+    attributes are converted (dates, integers, HTTP request...) the first time
+    they are accessed, and then kept.
+    That makes lines much cheaper to create when only a few attributes are
+    used, at the expense of keeping the raw values around.
     """
-    log_type = None
-
-    #: IP of the upstream server that made the connection to HAProxy.
-    client_ip = None
-    #: Port used by the upstream server that made the connection to HAProxy.
-    client_port = None
-
-    # raw string from log line and its python datetime version
-    raw_accept_date = None
-    #: datetime object with the exact date when the connection to HAProxy was
-    #: made. It's called access_date/request_date depending on the log type.
-    accept_date = request_date = None
-
-    #: HAProxy frontend that received the connection.
-    frontend_name = None
-    #: HAProxy backend that the connection was sent to.
-    backend_name = None
-    #: Downstream server that HAProxy send the connection to.
-    server_name = None
-
-    #: Time in milliseconds waiting the client to send the full HTTP request
-    #: (``Tq`` in HAProxy documentation).
-    time_wait_request = None
-    #: Time in milliseconds that the request spend on HAProxy queues
-    #: (``Tw`` in HAProxy documentation).
-    time_wait_queues = None
-    #: Time in milliseconds to connect to the final server
-    #: (``Tc`` in HAProxy documentation).
-    time_connect_server = None
-    #: Time in milliseconds waiting the downstream server to send the full
-    #: HTTP response (``Tr`` in HAProxy documentation).
-    time_wait_response = None
-    #: Total time in milliseconds between accepting the HTTP request and
-    #: sending back the HTTP response (``Tt`` or ``Ta`` in HAProxy
-    #: documentation depending on the log type).
-    total_time = None
-
-    #: HTTP status code returned to the client.
-    status_code = None
-    #: Total number of bytes send back to the client.
-    bytes_read = None
+
+    __slots__ = {
+        'raw_line': 'Log line as found on the log file.',
+        'is_valid': 'Whether the log line could be parsed or not.',
+        'log_type': 'Either ``LineType.HTTP`` or ``LineType.TCP``.',
+        'client_ip': 'IP of the upstream server that made the connection to HAProxy.',
+        'client_port': 'Port used by the upstream server that made the connection '
+        'to HAProxy.',
+        'raw_accept_date': 'Accept date as found on the log line.',
+        'accept_date': 'datetime object with the exact date when the connection '
+        'to HAProxy was made.',
+        'frontend_name': 'HAProxy frontend that received the connection.',
+        'backend_name': 'HAProxy backend that the connection was sent to.',
+        'server_name': 'Downstream server that HAProxy send the connection to.',
+        'time_wait_request': 'Time in milliseconds waiting the client to send the '
+        'full HTTP request (``Tq`` in HAProxy documentation).',
+        'time_wait_queues': 'Time in milliseconds that the request spend on HAProxy '
+        'queues (``Tw`` in HAProxy documentation).',
+        'time_connect_server': 'Time in milliseconds to connect to the final server '
+        '(``Tc`` in HAProxy documentation).',
+        'time_wait_response': 'Time in milliseconds waiting the downstream server '
+        'to send the full HTTP response (``Tr`` in HAProxy documentation).',
+        'total_time': 'Total time in milliseconds between accepting the HTTP '
+        'request and sending back the HTTP response (``Tt`` or ``Ta`` in HAProxy '
+        'documentation depending on the log type).',
+        'status_code': 'HTTP status code returned to the client.',
+        'bytes_read': 'Total number of bytes send back to the client.',
+        'connections_active': 'Total number of concurrent connections on the '
+        'process when the session was logged (``actconn`` in HAProxy '
+        'documentation).',
+        'connections_frontend': 'Total number of concurrent connections on the '
+        'frontend when the session was logged (``feconn`` in HAProxy '
+        'documentation).',
+        'connections_backend': 'Total number of concurrent connections handled by '
+        'the backend when the session was logged (``beconn`` in HAProxy '
+        'documentation).',
+        'connections_server': 'Total number of concurrent connections still active '
+        'on the server when the session was logged (``srv_conn`` in HAProxy '
+        'documentation).',
+        'retries': 'Number of connection retries experienced by this session when '
+        'trying to connect to the server.',
+        'queue_server': 'Total number of requests which were processed before this '
+        'one in the server queue (``srv_queue`` in HAProxy documentation).',
+        'queue_backend': 'Total number of requests which were processed before '
+        'this one in the backend\'s global queue (``backend_queue`` in HAProxy '
+        'documentation).',
+        'captured_request_headers': 'List of headers captured in the request.',
+        'captured_response_headers': 'List of headers captured in the response.',
+        'raw_http_request': 'HTTP request as found on the log line.',
+        'http_request_method': 'HTTP method (GET, POST...) used on this request.',
+        'http_request_path': 'Requested HTTP path.',
+        'http_request_protocol': 'HTTP version used on this request.',
+        '_fields': 'Raw values of a lazy line, decoded on first access.',
+    }
 
     # not used by now
     captured_request_cookie = None
@@ -119,48 +392,73 @@ class Line(object):
     # not used by now
     termination_state = None
 
-    #: Total number of concurrent connections on the process when the
-    #: session was logged (``actconn`` in HAProxy documentation).
-    connections_active = None
-    #: Total number of concurrent connections on the frontend when the
-    #: session was logged (``feconn`` in HAProxy documentation).
-    connections_frontend = None
-    #: Total number of concurrent connections handled by the backend when
-    #: the session was logged (``beconn`` in HAProxy documentation).
-    connections_backend = None
-    #: Total number of concurrent connections still active on the server
-    #: when the session was logged (``srv_conn`` in HAProxy documentation).
-    connections_server = None
-    #: Number of connection retries experienced by this session when
-    # trying to connect to the server.
-    retries = None
-
-    #: Total number of requests which were processed before this one in
-    #: the server queue (``srv_queue`` in HAProxy documentation).
-    queue_server = None
-    #: Total number of requests which were processed before this one in
-    #: the backend's global queue (``backend_queue`` in HAProxy documentation).
-    queue_backend = None
-
-    # List of headers captured in the request.
-    captured_request_headers = None
-    # List of headers captured in the response.
-    captured_response_headers = None
-
-    raw_http_request = None
-    #: HTTP method (GET, POST...) used on this request.
-    http_request_method = None
-    #: Requested HTTP path.
-    http_request_path = None
-    #: HTTP version used on this request.
-    http_request_protocol = None
-
-    raw_line = None
-
-    def __init__(self, line):
+    # attributes with only a handful of different values, interned so that all
+    # lines share the same string objects
+    _interned = (
+        'frontend_name',
+        'backend_name',
+        'server_name',
+        'status_code',
+        'http_request_method',
+        'http_request_protocol',
+    )
+
+    def __init__(self, line, lazy=False):
         self.raw_line = line
 
-        self.is_valid = self._parse_line(line)
+        self.is_valid = self._parse_line(line, lazy=lazy)
+
+    def __getattr__(self, name):
+        # only called for slots that have not been set, either because they
+        # are not on the log line or because they have not been decoded yet
+        if name not in Line.__slots__:
+            raise AttributeError(
+                f'{type(self).__name__!r} object has no attribute {name!r}'
+            )
+        if name == '_fields' or self._fields is None:
+            return None
+
+        if name in HTTP_REQUEST_ATTRIBUTES:
+            if self.log_type is LineType.HTTP and self.raw_http_request is not None:
+                self._parse_http_request()
+                return getattr(self, name)
+            return None
+
+        try:
+            group, converter = LINE_FIELDS[self.log_type][name]
+        except KeyError:
+            return None
+        value = self._fields.get(group)
+        if converter is not None and value is not None:
+            value = converter(value)
+        setattr(self, name, value)
+        return value
+
+    def __getstate__(self):
+        # do not decode the attributes of lazy lines only to pickle them
+        state = []
+        for name in Line.__slots__:
+            try:
+                state.append(_SLOTS[name].__get__(self))
+            except AttributeError:
+                state.append(None)
+        return tuple(state)
+
+    def __setstate__(self, state):
+        for name, value in zip(Line.__slots__, state):
+            if value is not None:
+                setattr(self, name, value)
+        for name in self._interned:
+            value = getattr(self, name)
+            if value is not None:
+                setattr(self, name, intern(value))
+
+    @property
+    def request_date(self):
+        """datetime object with the exact date when the connection to HAProxy was
+        made. It's called access_date/request_date depending on the log type.
+        """
+        return self.accept_date
 
     @property
     def is_https(self):
@@ -192,81 +490,58 @@ class Line(object):
                 return ip
         return self.client_ip
 
-    def _parse_http_fields(self, matches):
-        self.frontend_name = matches.group('http_frontend_name')
-        self.backend_name = matches.group('http_backend_name')
-        self.server_name = matches.group('http_server_name')
-
-        self.time_wait_request = int(matches.group('http_Tq'))
-        self.time_wait_queues = int(matches.group('http_Tw'))
-        self.time_connect_server = int(matches.group('http_Tc'))
-        self.time_wait_response = int(matches.group('http_Tr'))
-        self.total_time = matches.group('http_Ta')
-
-        self.status_code = matches.group('http_status_code')
-        self.bytes_read = matches.group('http_bytes_read')
+    def decode(self, names=None):
+        """Decode the given attributes of a lazy line, all of them by default,
+        and drop its raw values.
 
-        self.captured_request_headers = matches.group('captured_request_headers')
-        self.captured_response_headers = matches.group('captured_response_headers')
-        if matches.group('headers') is not None:
-            self.captured_request_headers = matches.group('headers')
-
-        self.raw_http_request = matches.group('http_request')
-        if self.raw_http_request is not None:
+        Attributes that are not decoded read as ``None`` afterwards.
+        """
+        if names is None:
+            names = tuple(LINE_FIELDS.get(self.log_type, ())) + HTTP_REQUEST_ATTRIBUTES
+        for name in names:
+            getattr(self, name)
+        self._fields = None
+
+    def _parse_fields(self, fields):
+        for name, (group, converter) in LINE_FIELDS[self.log_type].items():
+            value = fields.get(group)
+            if converter is None or value is None:
+                setattr(self, name, value)
+            else:
+                setattr(self, name, converter(value))
+
+        if self.log_type is LineType.HTTP and self.raw_http_request is not None:
             self._parse_http_request()
 
-    def _parse_tcp_fields(self, matches):
-        self.frontend_name = matches.group('tcp_frontend_name')
-        self.backend_name = matches.group('tcp_backend_name')
-        self.server_name = matches.group('tcp_server_name')
+    def _parse_line(self, line, lazy=False):
+        fields = tokenize_line(line)
+        if fields is None:
+            matches = HAPROXY_LINE_REGEX.match(line)
+            if matches is None:
+                return False
+            fields = matches.groupdict()
 
-        self.time_wait_queues = int(matches.group('tcp_Tw'))
-        self.time_connect_server = int(matches.group('tcp_Tc'))
-        self.total_time = int(matches.group('tcp_Tt'))
+        if fields.get('headers') is not None:
+            fields['captured_request_headers'] = fields['headers']
 
-        self.bytes_read = matches.group('tcp_bytes_read')
-
-    def _parse_protocol_specific_fields(self, matches):
-        if matches.group("http_frontend_name") is not None:
+        if fields.get('http_frontend_name') is not None:
             self.log_type = LineType.HTTP
-            self._parse_http_fields(matches)
         else:
             self.log_type = LineType.TCP
-            self._parse_tcp_fields(matches)
-
-        self.connections_active = matches.group('actconn')
-        self.connections_frontend = matches.group('feconn')
-        self.connections_backend = matches.group('beconn')
-        self.connections_server = matches.group('srv_conn')
-        self.retries = matches.group('retries')
-
-        self.queue_server = int(matches.group('srv_queue'))
-        self.queue_backend = int(matches.group('backend_queue'))
-
-    def _parse_line(self, line):
-        matches = HAPROXY_LINE_REGEX.match(line)
-        if matches is None:
-            return False
-
-        self.client_ip = matches.group('client_ip')
-        self.client_port = int(matches.group('client_port'))
 
-        self.raw_accept_date = matches.group('accept_date')
-        self.accept_date = self._parse_accept_date()
-        self.request_date = self.accept_date
-
-        self._parse_protocol_specific_fields(matches)
+        if lazy:
+            self._fields = fields
+        else:
+            self._parse_fields(fields)
         return True
 
-    def _parse_accept_date(self):
-        return datetime.strptime(self.raw_accept_date, '%d/%b/%Y:%H:%M:%S.%f')
-
     def _parse_http_request(self):
         matches = HTTP_REQUEST_REGEX.match(self.raw_http_request)
         if matches:
-            self.http_request_method = matches.group('method')
+            self.http_request_method = intern(matches.group('method'))
             self.http_request_path = matches.group('path')
-            self.http_request_protocol = matches.group('protocol')
+            protocol = matches.group('protocol')
+            self.http_request_protocol = protocol and intern(protocol)
         else:
             self.handle_bad_http_request()
 
@@ -279,7 +554,17 @@ class Line(object):
             print(f'Could not process HTTP request {self.raw_http_request}')
 
 
+# slot descriptors, to read slots without decoding lazy attributes
+_SLOTS = {name: Line.__dict__[name] for name in Line.__slots__}
+
+
 # it is not coverage covered as this is executed by the multiprocessor module,
 # and setting it up on coverage just for two lines is not worth it
-def parse_line(line):  # pragma: no cover
-    return Line(line.strip())
+def parse_line(line, plan=None):  # pragma: no cover
+    if plan is None or not plan.lazy:
+        return Line(line.strip())
+    # only the attributes in the plan are decoded and sent back
+    log_line = Line(line.strip(), lazy=True)
+    if log_line.is_valid:
+        log_line.decode(plan.fields)
+    return log_line
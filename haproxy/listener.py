@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+"""Receive log lines over syslog, as HAProxy sends them.
+
+Instead of analyzing log files, HAProxy can send its log lines straight to a
+listener (``log 192.168.1.1:5140 local0`` on its configuration):
+
+- over UDP, every datagram holds one log line (or several, one per line),
+- over TCP, log lines are either separated by new lines, or prefixed by their
+  length (octet counting, see RFC 6587).
+
+The syslog priority (``<134>``) is removed, the rest of the syslog header is
+ignored when parsing the log lines, as it is on log files.
+
+Lines are received by an asyncio event loop on a thread of its own, grouped in
+batches, and put on a bounded queue to be analyzed. When the analysis can not
+keep up, the batches that do not fit on the queue are dropped, and counted.
+"""
+from threading import Thread
+
+import asyncio
+import queue
+import re
+import socket
+
+
+# lines that are received are grouped in batches of this many lines,
+# and batches are put on the queue at least this often (in seconds)
+BATCH_LINES = 1000
+FLUSH_INTERVAL = 0.05
+
+# batches waiting to be analyzed, the next ones are dropped
+QUEUE_SIZE = 1000
+
+# longest line accepted, over TCP a client sending longer lines is
+# disconnected
+MAX_LINE = 64 * 1024
+
+# size of the UDP receive buffer, to absorb bursts
+UDP_BUFFER = 8 * 1024 * 1024
+
+# length prefix of TCP messages with octet counting
+OCTET_COUNT_REGEX = re.compile(rb'(\d{1,9}) ')
+
+
+class SyslogListener(object):
+    """Receive log lines over syslog on UDP and/or TCP.
+
+    It is meant to be followed like a log file (see :mod:`haproxy.follow`):
+    :meth:`read` gets the next batch of lines, :meth:`wait` waits for one.
+
+    :param udp: ``(host, port)`` to listen on UDP, if any.
+    :param tcp: ``(host, port)`` to listen on TCP, if any.
+    :param batch_lines: lines on each batch.
+    :param queue_size: batches waiting to be analyzed, at most.
+    """
+
+    def __init__(self, udp=None, tcp=None, batch_lines=BATCH_LINES, queue_size=None):
+        self.udp = udp
+        self.tcp = tcp
+        self.batch_lines = batch_lines
+        self.batches = queue.Queue(queue_size or QUEUE_SIZE)
+        # lines received, and those dropped because the queue was full
+        self.received = 0
+        self.dropped = 0
+        # addresses listened on, with the actual ports if 0 was given
+        self.udp_address = None
+        self.tcp_address = None
+        self._lines = []
+        self._next = None
+        self._loop = None
+        self._transports = []
+        self._thread = None
+
+    def start(self):
+        """Listen on the addresses given, on a thread.
+
+        :raises OSError: if they can not be listened on.
+        """
+        self._loop = asyncio.new_event_loop()
+        try:
+            transports = self._loop.run_until_complete(self._listen())
+        except OSError:
+            self._loop.close()
+            self._loop = None
+            raise
+        self._transports = transports
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    async def _listen(self):
+        transports = []
+        if self.udp is not None:
+            family = socket.AF_INET6 if ':' in self.udp[0] else socket.AF_INET
+            sock = socket.socket(family, socket.SOCK_DGRAM)
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, UDP_BUFFER)
+            except OSError:
+                pass
+            try:
+                sock.bind(self.udp)
+            except OSError:
+                sock.close()
+                raise
+            sock.setblocking(False)
+            # datagrams are read right from the socket, many at once, which is
+            # much faster than getting them one by one from a transport
+            self._loop.add_reader(sock, self._receive, sock)
+            self.udp_address = sock.getsockname()[:2]
+            transports.append(sock)
+        if self.tcp is not None:
+            server = await self._loop.create_server(
+                lambda: _SyslogStream(self), *self.tcp
+            )
+            self.tcp_address = server.sockets[0].getsockname()[:2]
+            transports.append(server)
+        return transports
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.call_later(FLUSH_INTERVAL, self._flush_later)
+        self._loop.run_forever()
+        for transport in self._transports:
+            if isinstance(transport, socket.socket):
+                self._loop.remove_reader(transport)
+            transport.close()
+        self._loop.run_until_complete(asyncio.sleep(0))
+        self._loop.close()
+
+    def _receive(self, sock):
+        """Syslog over UDP: every datagram is a log line, or a few of them."""
+        add = self.add
+        receive = sock.recv
+        try:
+            for _ in range(self.batch_lines):
+                data = receive(MAX_LINE)
+                if b'\n' not in data:
+                    if data and not data.isspace():
+                        add(data)
+                    continue
+                for line in data.split(b'\n'):
+                    if line and not line.isspace():
+                        add(line)
+        except (BlockingIOError, InterruptedError):
+            pass
+
+    def _flush_later(self):
+        self.flush()
+        self._loop.call_later(FLUSH_INTERVAL, self._flush_later)
+
+    def add(self, line):
+        """Add a received syslog message to the current batch.
+
+        Only on the thread of the event loop.
+        """
+        if line[:1] == b'<':
+            # the syslog priority
+            line = line[line.find(b'>') + 1 :]
+        self._lines.append(line)
+        if len(self._lines) >= self.batch_lines:
+            self.flush()
+
+    def flush(self):
+        """Put the current batch on the queue, or drop it if the queue is
+        full.
+        """
+        lines = self._lines
+        if not lines:
+            return
+        self._lines = []
+        self.received += len(lines)
+        lines.append(b'')
+        try:
+            self.batches.put_nowait(b'\n'.join(lines))
+        except queue.Full:
+            self.dropped += len(lines) - 1
+
+    def read(self, size=-1):
+        """Get the next batch of lines, if there is one already.
+
+        :param size: ignored, batches are small.
+        :returns: the lines of the batch, or ``b''``.
+        """
+        if self._next is not None:
+            batch, self._next = self._next, None
+            return batch
+        try:
+            return self.batches.get_nowait()
+        except queue.Empty:
+            return b''
+
+    def wait(self, timeout=None):
+        """Wait until there is a batch of lines to read."""
+        if self._next is not None:
+            return
+        try:
+            self._next = self.batches.get(timeout=timeout)
+        except queue.Empty:
+            pass
+
+    def close(self):
+        """Stop listening. Lines not yet read are discarded."""
+        if self._thread is None:
+            return
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._thread = None
+
+
+class _SyslogStream(asyncio.Protocol):
+    """Syslog over TCP: log lines separated by new lines, or prefixed by
+    their length.
+    """
+
+    def __init__(self, listener):
+        self.listener = listener
+        self.buffer = b''
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        add = self.listener.add
+        buffer = self.buffer + data
+        position = 0
+        while position < len(buffer):
+            match = OCTET_COUNT_REGEX.match(buffer, position)
+            if match is not None:
+                start = match.end()
+                end = start + int(match.group(1))
+                if end > len(buffer):
+                    break
+                line = buffer[start:end].rstrip(b'\r\n')
+                position = end
+            else:
+                end = buffer.find(b'\n', position)
+                if end < 0:
+                    break
+                line = buffer[position:end].rstrip(b'\r')
+                position = end + 1
+            if line:
+                add(line)
+        self.buffer = buffer[position:]
+        if len(self.buffer) > MAX_LINE:
+            # all the lines waiting on the buffer are lost
+            lines = sum(1 for line in self.buffer.split(b'\n') if line.strip())
+            self.listener.received += lines
+            self.listener.dropped += lines
+            self.buffer = b''
+            self.transport.close()
+
+    def eof_received(self):
+        if self.buffer:
+            self.listener.add(self.buffer.rstrip(b'\r\n'))
+            self.buffer = b''
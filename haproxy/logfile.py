@@ -1,18 +1,304 @@
 # -*- coding: utf-8 -*-
+from collections import deque
 from datetime import datetime
+from datetime import timedelta
+from haproxy.cache import cached_fields
+from haproxy.cache import load_cache
+from haproxy.filters import compile_filters
+from haproxy.filters import raw_texts
+from haproxy.follow import FollowedFile
+from haproxy.follow import watch
+from haproxy.index import load_index
 from haproxy.line import parse_line
+from haproxy.readers import compression
+from haproxy.readers import file_identity
+from haproxy.readers import find_logfiles
+from haproxy.readers import gzip_members
+from haproxy.readers import GzipMember
+from haproxy.readers import iter_lines
+from haproxy.readers import line_blocks
+from haproxy.readers import lines_containing
+from haproxy.readers import map_file
+from haproxy.readers import merge_lines
+from haproxy.readers import prefetch
+from haproxy.readers import read_blocks
+from haproxy.readers import seek_date
+from haproxy.readers import split_buffer
+from haproxy.stats import Stats
 from haproxy.utils import date_str_to_datetime
 from haproxy.utils import delta_str_to_timedelta
-from multiprocessing import Pool
+
+import atexit
+import gc
+import multiprocessing
+import os
+import signal
+import time
+import weakref
+import zlib
+
+
+# files are split in chunks of (roughly) this size, each one of them parsed
+# by a worker process on its own
+CHUNK_SIZE = 8 * 1024 * 1024
+
+# cached log files are split in ranges of (at most) this many rows
+CACHE_ROWS = 500000
+
+# seconds to wait for the blocks still being processed when listening stops
+FINISH_TIMEOUT = 5
+
+# less than this many bytes of log lines are processed serially, on the main
+# process: starting worker processes would take longer than parsing them
+SERIAL_SIZE = 2 * 1024 * 1024
+
+# each worker process gets at least this many bytes of log lines to process
+JOB_SIZE = 2 * 1024 * 1024
+
+# roughly how much bigger log files are once decompressed, and how many bytes
+# of log lines are worth processing a cached row
+COMPRESSION_RATIO = 10
+CACHED_ROW_SIZE = 20
+
+
+class Results(object):
+    """Results of processing (part of) a log file.
+
+    The amount of valid and invalid lines, and of lines skipped before being
+    parsed as they could not pass the filters, the invalid lines themselves if
+    they have to be shown, and the commands that processed the valid ones.
+    They are small, so that worker processes can send them back.
+    ``source`` is the index of the log file they come from.
+    """
+
+    def __init__(self, commands, source=0):
+        self.commands = commands
+        self.source = source
+        self.valid_lines = 0
+        self.invalid_lines = 0
+        self.skipped_lines = 0
+        self.invalid = []
+        # see haproxy.stats, only with Log(stats=True)
+        self.stats = None
+
+
+class LinesCollector(object):
+    """Command that keeps all the lines it is given."""
+
+    fields = None
+
+    def __init__(self):
+        self.lines = []
+
+    def __call__(self, line):
+        self.lines.append(line)
+
+    def partial(self):
+        return type(self)()
+
+
+# what worker processes run, see _init_worker
+_worker = None
+
+# pools kept for the next runs (see Log._workers), stopped on exit
+_kept_pools = weakref.WeakSet()
+
+
+def _terminate_kept_pools():
+    for pool in list(_kept_pools):
+        pool.terminate()
+
+
+def _init_worker(log, buffers, commands, filters, negate):
+    global _worker
+    # on Ctrl+C only the main process is interrupted, it stops the workers:
+    # a worker interrupted while holding a lock of the pool would hang it
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if buffers is None:
+        # not forked: the mappings can not be shared, map the log files again
+        buffers = [map_file(logfile) for logfile in log.logfiles]
+    _worker = (log, buffers, commands, filters, negate)
+
+
+def _pool(processes, log, buffers, commands, filters, negate):
+    """Pool of worker processes, see :func:`_init_worker`.
+
+    Forked workers share the mappings of the log files, elsewhere (e.g. on
+    Windows) they map the log files again.
+
+    Forked workers also share, copy-on-write, the memory of the filters (e.g.
+    sets of hundreds of thousands of IPs): objects are frozen while forking,
+    so that the garbage collector of the workers never writes to them.
+    """
+    # gc.freeze() is not available before Python 3.7
+    freeze = getattr(gc, 'freeze', None)
+    if 'fork' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('fork')
+    else:
+        context = multiprocessing.get_context()
+        buffers = None
+        freeze = None
+    if freeze is not None:
+        gc.collect()
+        freeze()
+    try:
+        return context.Pool(
+            processes,
+            initializer=_init_worker,
+            initargs=(log, buffers, commands, filters, negate),
+        )
+    finally:
+        if freeze is not None:
+            gc.unfreeze()
+
+
+def _process_serially(tasks, log, buffers, commands, filters, negate):
+    """Run the tasks on the main process, like a worker process would.
+
+    See :func:`_init_worker`.
+    """
+    global _worker
+    try:
+        for task in tasks:
+            # set before each task, other runs may be interleaved with this one
+            _worker = (log, buffers, commands, filters, negate)
+            yield _process_task(task)
+    finally:
+        _worker = None
+
+
+def _same(first, second):
+    """Whether two lists of lists hold the very same objects."""
+    return len(first) == len(second) and all(
+        len(one) == len(other) and all(a is b for a, b in zip(one, other))
+        for one, other in zip(first, second)
+    )
+
+
+def _process_task(task):  # pragma: no cover
+    """Run a task of :meth:`Log.tasks`: a function, the index of the log
+    file and the part of it to process.
+    """
+    function, source, argument = task
+    if _worker[0].stats is None:
+        return function(source, argument)
+
+    wall, cpu = time.perf_counter(), time.process_time()
+    output = function(source, argument)
+    results = output[3] if isinstance(output, tuple) else output
+    if results is not None:
+        results.stats.add_task(
+            time.perf_counter() - wall,
+            time.process_time() - cpu,
+            results.valid_lines + results.invalid_lines + results.skipped_lines,
+        )
+    return output
+
+
+def _process_chunk(source, chunk):  # pragma: no cover
+    log, buffers, commands, filters, negate = _worker
+    results = log.results(commands, source)
+    log.process_buffer(buffers[source], results, filters, negate, chunk)
+    return results
+
+
+def _process_block(source, block):  # pragma: no cover
+    log, _, commands, filters, negate = _worker
+    results = log.results(commands, source)
+    log.process_buffer(block, results, filters, negate)
+    return results
+
+
+def _process_file(source, logfile):  # pragma: no cover
+    """Decompress and process a whole compressed log file."""
+    log, buffers, commands, filters, negate = _worker
+    results = log.results(commands, source)
+    opener = compression(buffers[source])
+    for block in read_blocks(opener(logfile), CHUNK_SIZE):
+        log.process_buffer(block, results, filters, negate)
+    return results
+
+
+def _process_rows(source, rows):  # pragma: no cover
+    """Process the lines of a range of rows of the cache of a log file."""
+    log, buffers, commands, filters, negate = _worker
+    results = log.results(commands, source)
+    cache = log.caches[source]
+    lines = cache.lines(buffers[source], rows, cached_fields(log.plan))
+    log.process_parsed_lines(lines, results, filters, negate)
+    return results
+
+
+def _process_member(source, offset):  # pragma: no cover
+    """Decompress and process a gzip member.
+
+    Lines can span over members: the data up to the first new line (`head`)
+    and after the last one (`tail`) are sent back to be joined with the
+    neighbouring members. `head` is ``None`` if there is no new line at all.
+    """
+    log, buffers, commands, filters, negate = _worker
+    results = log.results(commands, source)
+    member = GzipMember(buffers[source], offset)
+    head, tail = None, b''
+    try:
+        for block in line_blocks(member):
+            if not block.endswith(b'\n'):
+                tail = block
+                continue
+            if head is None:
+                position = block.find(b'\n') + 1
+                head, block = block[:position], block[position:]
+            log.process_buffer(block, results, filters, negate)
+    except (zlib.error, EOFError):
+        # not a gzip member, but the gzip magic bytes within compressed data
+        return None
+    return member.end, head, tail, results
 
 
 class Log(object):
-    def __init__(self, logfile=None, start=None, delta=None, show_invalid=False):
+    def __init__(
+        self,
+        logfile=None,
+        start=None,
+        delta=None,
+        show_invalid=False,
+        plan=None,
+        jobs=None,
+        merge_by_date=False,
+        seek=False,
+        seek_tolerance=None,
+        index=False,
+        cache=False,
+        checkpoint=None,
+        stats=False,
+    ):
         self.logfile = logfile
+        self.logfiles = []
+        if logfile is not None:
+            if isinstance(logfile, (str, os.PathLike)):
+                logfile = [logfile]
+            self.logfiles = find_logfiles(logfile)
         self.show_invalid = show_invalid
+        self.plan = plan
+        self.jobs = jobs or os.cpu_count()
+        self.merge_by_date = merge_by_date
+        self.seek = seek
+        self.index = index
+        self.cache = cache
+        # columnar caches of the log files, by their position on logfiles
+        self.caches = {}
+        # where the analysis resumes, see haproxy.checkpoint
+        self.checkpoint = checkpoint
+        self.offsets = {}
+        # where the time goes, see haproxy.stats
+        self.stats = Stats() if stats else None
+        self.seek_tolerance = timedelta()
         self.start = None
         self.end = None
 
+        if seek_tolerance:
+            self.seek_tolerance = delta_str_to_timedelta(seek_tolerance)
+
         if start:
             self.start = date_str_to_datetime(start)
 
@@ -24,26 +310,569 @@ class Log(object):
 
         self.invalid_lines = 0
         self.valid_lines = 0
+        # lines that could not pass the filters, not even parsed
+        self.skipped_lines = 0
 
-    def __iter__(self):
+        # how the last run processed the log files, see processes()
+        self.mode = None
+        # worker processes and mappings of the log files, kept for the next
+        # runs, see _workers() and _map_files()
+        self._pool = None
+        self._mappings = {}
+        self._lines_collector = LinesCollector()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # neither can be pickled, nor are they needed on worker processes
+        state['_pool'] = None
+        state['_mappings'] = {}
+        return state
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Stop the worker processes and unmap the log files."""
+        if self._pool is not None:
+            self._pool[0].terminate()
+            self._pool = None
+        self._mappings = {}
+
+    def chunks(self, buffer, logfile=None):
+        """Byte ranges of a mapped log file to be parsed by each worker.
+
+        Workers are shared among all log files.
+        """
+        start, end = self.window(buffer, logfile)
+        jobs = -(-self.jobs // len(self.logfiles))
+        chunks = max(jobs, -(-(end - start) // CHUNK_SIZE))
+        return split_buffer(buffer, chunks, start, end)
+
+    def row_ranges(self, source, buffer):
+        """Ranges of rows of the cache of a log file to be processed by each
+        worker, only those of the time frame (see :meth:`window`).
+        """
+        logfile = self.logfiles[source]
+        first, last = self.caches[source].row_range(*self.window(buffer, logfile))
+        jobs = -(-self.jobs // len(self.logfiles))
+        chunks = max(jobs, -(-(last - first) // CACHE_ROWS))
+        offsets = [first + (last - first) * index // chunks for index in range(chunks)]
+        offsets.append(last)
+        return [rows for rows in zip(offsets, offsets[1:]) if rows[0] < rows[1]]
+
+    def load_caches(self, buffers):
+        """Load, and build or update, the columnar caches of the log files.
+
+        Only if the attributes that commands and filters need are cached,
+        and only for plain text log files whose cache can be written.
+        """
+        self.caches = {}
+        if not self.cache or cached_fields(self.plan) is None:
+            return
+        for source, buffer in enumerate(buffers):
+            if compression(buffer) is None:
+                logfile = self.logfiles[source]
+                cache = load_cache(logfile, buffer, self.jobs)
+                if cache is not None:
+                    self.caches[source] = cache
+
+    def window(self, buffer, logfile=None):
+        """Byte range of a mapped log file with the lines of the time frame.
+
+        Without ``seek`` nor ``index``, or without a time frame, the whole log
+        file. Otherwise it is found on the time index of the log file (see
+        :mod:`haproxy.index`) and/or with a binary search (see
+        :func:`haproxy.readers.seek_date`), widened by ``seek_tolerance`` on
+        both sides, so that lines slightly out of order are not missed.
+        Lines within the range still get their date checked.
+
+        With a ``checkpoint``, only the whole lines after where the last
+        analysis was left.
+        """
+        start, end = self.offsets.get(logfile, 0), len(buffer)
+        if self.checkpoint is not None:
+            # a half written line is analyzed the next time
+            end = buffer.rfind(b'\n') + 1
+        if self.index and logfile is not None:
+            # built or updated even without a time frame, for the next time
+            index = load_index(logfile, buffer)
+            if self.start is not None:
+                index_start, index_end = index.window(
+                    self.start, self.end, self.seek_tolerance
+                )
+                start = max(start, index_start)
+                if index_end is not None:
+                    end = min(end, index_end)
+        if not self.seek or self.start is None:
+            return start, end
+        start = seek_date(buffer, self.start - self.seek_tolerance, start, end)
+        if self.end is not None:
+            # lines dated exactly at the end are still within the time frame
+            after_end = self.end + self.seek_tolerance + timedelta(microseconds=1)
+            end = seek_date(buffer, after_end, start, end)
+        return start, end
+
+    def tasks(self, buffers):
+        """What worker processes are given to process the log files.
+
+        Plain text log files are split in chunks (or their cache in ranges of
+        rows), multi-member gzip files in their members, and other compressed
+        log files are processed as a whole. Compressed log files that were
+        already analyzed (see :mod:`haproxy.checkpoint`) are skipped.
+        """
+        tasks = []
+        for source, buffer in enumerate(buffers):
+            members = gzip_members(buffer)
+            done = self.offsets.get(self.logfiles[source]) == len(buffer)
+            if compression(buffer) is not None and done:
+                continue
+            if source in self.caches:
+                tasks.extend(
+                    (_process_rows, source, rows)
+                    for rows in self.row_ranges(source, buffer)
+                )
+            elif len(members) > 1:
+                tasks.extend((_process_member, source, offset) for offset in members)
+            elif compression(buffer) is not None:
+                tasks.append((_process_file, source, self.logfiles[source]))
+            else:
+                chunks = self.chunks(buffer, self.logfiles[source])
+                tasks.extend((_process_chunk, source, chunk) for chunk in chunks)
+        return tasks
+
+    def results(self, commands, source=0):
+        """:class:`Results` for partial commands, and stats if measured."""
+        results = Results([cmd.partial() for cmd in commands], source)
+        if self.stats is not None:
+            results.stats = Stats()
+        return results
+
+    def process_buffer(self, buffer, results, filters=(), negate=False, chunk=None):
+        """Process the lines of (a byte range of) a buffer, see
+        :meth:`process_lines`.
+
+        Lines that lack the raw text the filters require (see
+        :func:`haproxy.filters.raw_texts`) are skipped before being parsed,
+        and counted as such. Not if the filters are negated, nor if invalid
+        lines have to be shown, as then every line needs to be parsed.
+
+        :param buffer: mapped log file, or block of lines read.
+        :param chunk: ``(start, end)`` byte offsets of the lines to process,
+          the whole buffer by default.
+        """
+        if results.stats is not None:
+            start, end = chunk or (0, len(buffer))
+            results.stats.bytes += end - start
+        texts = () if negate or self.show_invalid else raw_texts(tuple(filters))
+        if not texts:
+            self.process_lines(iter_lines(buffer, chunk), results, filters, negate)
+            return
+        lines, total = lines_containing(buffer, texts, chunk)
+        processed = results.valid_lines + results.invalid_lines
+        self.process_lines(lines, results, filters, negate)
+        processed = results.valid_lines + results.invalid_lines - processed
+        results.skipped_lines += total - processed
+
+    def process_lines(self, raw_lines, results, filters=(), negate=False):
+        """Parse the given lines and run the filters and commands on them.
+
+        :param raw_lines: iterable of lines as read from a log file, i.e.
+          bytes-like objects, they are only decoded to be parsed.
+        :param results: :class:`Results` where to keep the counters and whose
+          commands are run on the lines.
+        :param filters: list of filters a line needs to pass.
+        :param negate: reverse the filters, only lines that do not pass all of
+          them are given to the commands.
+        """
+        plan = self.plan
+        if results.stats is not None:
+            lines = results.stats.timed_lines(raw_lines, plan)
+        else:
+            lines = (
+                parse_line(str(raw_line, 'utf-8', 'replace'), plan=plan)
+                for raw_line in raw_lines
+            )
+        self.process_parsed_lines(lines, results, filters, negate)
+
+    def process_parsed_lines(self, lines, results, filters=(), negate=False):
+        """Run the filters and commands on already parsed lines.
+
+        See :meth:`process_lines`. With stats, every filter and command but
+        the lines collector is measured too (see :mod:`haproxy.stats`).
+        """
+        passes = compile_filters(tuple(filters), negate)
+        commands = results.commands
+        stats = results.stats
+        if stats is not None:
+            passes = stats.timed_filters(filters, passes.order, negate)
+            names = [
+                None if isinstance(cmd, LinesCollector) else cmd.command_line_name()
+                for cmd in commands
+            ]
+            commands = [
+                stats.timed_command(cmd, name) for cmd, name in zip(commands, names)
+            ]
+        for line in lines:
+            if not line.is_valid:
+                results.invalid_lines += 1
+                if self.show_invalid:
+                    results.invalid.append(line.raw_line)
+                continue
+
+            results.valid_lines += 1
+            if not line.is_within_time_frame(self.start, self.end):
+                continue
+            if passes(line):
+                for cmd in commands:
+                    cmd(line)
+
+    def processes(self, buffers, tasks):
+        """How many worker processes to run the tasks on.
+
+        As many as ``jobs``, but no more than tasks, and only one for every
+        :data:`JOB_SIZE` bytes of log lines: parsing is cheaper than starting
+        worker processes and sending them the work on small log files.
+
+        :returns: the amount of processes, 1 to process the log files serially
+          on the main process.
+        """
+        size = self._size(buffers, tasks)
+        if self.jobs == 1 or size < SERIAL_SIZE:
+            return 1
+        return max(1, min(self.jobs, len(tasks), -(-size // JOB_SIZE)))
+
+    def _size(self, buffers, tasks):
+        """Roughly how many bytes of log lines the tasks process."""
+        members = {}
+        for function, source, _ in tasks:
+            if function is _process_member:
+                members[source] = members.get(source, 0) + 1
+        size = 0
+        for function, source, argument in tasks:
+            if function is _process_chunk:
+                size += argument[1] - argument[0]
+            elif function is _process_rows:
+                size += (argument[1] - argument[0]) * CACHED_ROW_SIZE
+            elif function is _process_member:
+                size += len(buffers[source]) * COMPRESSION_RATIO // members[source]
+            else:
+                size += len(buffers[source]) * COMPRESSION_RATIO
+        return size
+
+    def _map_files(self):
+        """Map the log files, reusing the mappings of the previous run for
+        those that did not change since.
+        """
+        mappings = {}
+        for logfile in self.logfiles:
+            identity = file_identity(logfile)
+            mapping = self._mappings.get(logfile)
+            if mapping is None or mapping[0] != identity:
+                mapping = (identity, map_file(logfile))
+            mappings[logfile] = mapping
+        self._mappings = mappings
+        return [mappings[logfile][1] for logfile in self.logfiles]
+
+    def _workers(self, processes, buffers, commands, filters, negate):
+        """Pool of worker processes, see :func:`_pool`.
+
+        It is kept for the next runs: workers get the mappings of the log
+        files, the commands and the filters when started, so it is reused by
+        the runs with the very same ones, and enough processes.
+        """
+        state = [buffers, commands, filters, [negate], list(self.caches.values())]
+        if self._pool is not None:
+            pool, size, pool_state = self._pool
+            if size >= processes and _same(pool_state, state):
+                return pool
+            pool.terminate()
+        pool = _pool(processes, self, buffers, commands, filters, negate)
+        if not _kept_pools:
+            # registered once multiprocessing registered its own exit handler,
+            # to run before it: pools left running when it does are broken
+            atexit.unregister(_terminate_kept_pools)
+            atexit.register(_terminate_kept_pools)
+        _kept_pools.add(pool)
+        self._pool = (pool, processes, state)
+        return pool
+
+    def _run(self, commands, filters, negate):
+        """Process the log files, on worker processes unless they are small
+        (see :meth:`processes`).
+
+        Each task runs partial commands on its part of the log files,
+        their results are yielded in the order of the log files.
+        """
         start = datetime.now()
-        with open(self.logfile) as logfile, Pool() as pool:
-            for index, line in enumerate(pool.imap(parse_line, logfile)):
-                if line.is_valid:
-                    self.valid_lines += 1
-                    if line.is_within_time_frame(self.start, self.end):
-                        yield line
-                else:
-                    if self.show_invalid:
-                        print(line.raw_line)
-                    self.invalid_lines += 1
-
-                if index % 10000 == 0 and index > 0:  # pragma: no cover
-                    print('.', end='', flush=True)
+        wall, cpu = time.perf_counter(), time.process_time()
+        # forked workers share the mappings, no data is sent to them
+        buffers = self._map_files()
+        if self.checkpoint is not None:
+            self.offsets = self.checkpoint.offsets(self.logfiles, buffers)
+        self.load_caches(buffers)
+        tasks = self.tasks(buffers)
+        processes = self.processes(buffers, tasks)
+        if len(tasks) == 1 and tasks[0][0] is _process_file:
+            # a single compressed stream: decompress it on a thread,
+            # workers get blocks of whole lines
+            _, source, logfile = tasks[0]
+            size = len(buffers[source]) * COMPRESSION_RATIO
+            if self.jobs > 1 and size >= SERIAL_SIZE:
+                processes = min(self.jobs, -(-size // JOB_SIZE))
+            blocks = read_blocks(compression(buffers[source])(logfile), CHUNK_SIZE)
+            tasks = ((_process_block, source, block) for block in prefetch(blocks))
 
+        state = (buffers, commands, filters, negate)
+        if processes == 1:
+            self.mode = 'serial'
+            outputs = _process_serially(tasks, self, *state)
+        else:
+            self.mode = f'{processes} processes'
+            outputs = self._workers(processes, *state).imap(_process_task, tasks)
+        if isinstance(tasks, list):
+            outputs = self._join_members(buffers, tasks, outputs, *state[1:])
+        for results in outputs:
+            self.valid_lines += results.valid_lines
+            self.invalid_lines += results.invalid_lines
+            self.skipped_lines += results.skipped_lines
+            for raw_line in results.invalid:
+                print(raw_line)
+            if results.stats is not None:
+                self.stats.merge(results.stats)
+
+            yield results
+
+            print('.', end='', flush=True)
+
+        if self.checkpoint is not None:
+            self.checkpoint.advance(self.logfiles, buffers)
+        if self.stats is not None:
+            self.stats.wall += time.perf_counter() - wall
+            self.stats.cpu += time.process_time() - cpu
         end = datetime.now()
-        print(f'\nIt took {end - start}')
+        print(f'\nIt took {end - start} ({self.mode})')
+
+    def _process_rest(self, source, data, commands, filters, negate):
+        results = self.results(commands, source)
+        self.process_buffer(data, results, filters, negate)
+        return results
+
+    def _join_members(self, buffers, tasks, outputs, commands, filters, negate):
+        """Results of the tasks, and of the lines spanning over gzip members.
+
+        Members that do not start right where the previous one ended
+        (allowing for zero padding) are false positives of
+        :func:`haproxy.readers.gzip_members`, their results are discarded.
+        """
+        source, expected, rest = None, 0, b''
+        for (function, task_source, offset), output in zip(tasks, outputs):
+            if task_source != source:
+                if rest:
+                    yield self._process_rest(source, rest, commands, filters, negate)
+                source, expected, rest = task_source, 0, b''
+            if function is not _process_member:
+                yield output
+                continue
+
+            if output is None or offset < expected:
+                continue
+            if buffers[source][expected:offset].strip(b'\x00'):
+                continue
+            end, head, tail, results = output
+            expected = end
+            if head is not None:
+                rest += head
+                yield self._process_rest(source, rest, commands, filters, negate)
+                rest = b''
+            rest += tail
+            yield results
+
+        if rest:
+            yield self._process_rest(source, rest, commands, filters, negate)
+
+    def _merges_lines(self):
+        """Whether lines of different log files need to be merged by date."""
+        return self.merge_by_date and len(self.logfiles) > 1
+
+    def process(self, commands, filters=(), negate=False):
+        """Run the commands on all the lines that pass the filters.
+
+        Lines are parsed, filtered and processed on worker processes, only
+        the partial results of the commands are sent back and merged on the
+        given commands.
+
+        With ``merge_by_date``, commands that need the lines in time order
+        (see :attr:`haproxy.commands.BaseCommandMixin.ordered`) are run on
+        the main process instead, once the lines of all the log files are
+        merged by their accept date.
+        """
+        ordered = []
+        if self._merges_lines():
+            ordered = [cmd for cmd in commands if cmd.ordered]
+        unordered = [cmd for cmd in commands if cmd not in ordered]
+        if not ordered:
+            for results in self._run(unordered, filters, negate):
+                self._merge(unordered, results)
+            return
+
+        lines = [[] for _ in self.logfiles]
+        collector = self._lines_collector
+        for results in self._run(unordered + [collector], filters, negate):
+            self._merge(unordered, results)
+            lines[results.source].extend(results.commands[-1].lines)
+        if self.stats is not None:
+            ordered = [
+                self.stats.timed_command(cmd, cmd.command_line_name())
+                for cmd in ordered
+            ]
+        for line in merge_lines(lines):
+            for cmd in ordered:
+                cmd(line)
+
+    def _merge(self, commands, results):
+        """Merge the partial results of the commands."""
+        begin = time.perf_counter()
+        for cmd, partial in zip(commands, results.commands):
+            cmd.merge(partial)
+        if self.stats is not None:
+            self.stats.stages['merge'] += time.perf_counter() - begin
+
+    def follow(self, commands, filters=(), negate=False, interval=None, lines=None):
+        """Run the commands on the lines written to the log files from now on,
+        while they are being written (see :mod:`haproxy.follow`).
+
+        Lines are processed on the main process as they come, in blocks of
+        all the lines written meanwhile.
+
+        :param interval: seconds between reports.
+        :param lines: amount of new lines between reports.
+        :returns: generator that yields every time a report is due,
+          the commands have the results so far.
+        """
+        # opened right away, lines written before the first report is asked
+        # for are not missed
+        files = [FollowedFile(logfile) for logfile in self.logfiles]
+        watcher = watch(self.logfiles)
+        return self._follow(files, watcher, commands, filters, negate, interval, lines)
+
+    def listen(
+        self, listener, commands, filters=(), negate=False, interval=None, lines=None
+    ):
+        """Run the commands on the lines received by a syslog listener (see
+        :mod:`haproxy.listener`), like :meth:`follow` does on log files.
+
+        With more than one job, the batches of lines received are processed
+        on worker processes, only a few of them at a time: when workers can
+        not keep up, batches wait on the queue of the listener, and are
+        dropped once it is full.
+
+        :param listener: a :class:`haproxy.listener.SyslogListener`, it is
+          started right away.
+        """
+        listener.start()
+        pool = None
+        if self.jobs > 1:
+            pool = _pool(self.jobs, self, [], commands, filters, negate)
+        return self._follow(
+            [listener], listener, commands, filters, negate, interval, lines, pool
+        )
+
+    def _follow(
+        self, files, watcher, commands, filters, negate, interval, lines, pool=None
+    ):
+        results = Results(commands)
+        next_report = interval and time.monotonic() + interval
+        reported = 0
+        # results of the blocks being processed on the pool, in order
+        pending = deque()
+        try:
+            while True:
+                found = False
+                for followed in files:
+                    data = followed.read(CHUNK_SIZE)
+                    if not data:
+                        continue
+                    found = True
+                    if pool is None:
+                        self.process_buffer(data, results, filters, negate)
+                        continue
+                    task = (_process_block, 0, data)
+                    pending.append(pool.apply_async(_process_task, (task,)))
+                    while pending and (
+                        pending[0].ready() or len(pending) > 2 * self.jobs
+                    ):
+                        self._merge_results(results, pending.popleft().get())
+                self._update_counters(results)
+
+                now = time.monotonic()
+                if lines and self.total_lines - reported >= lines:
+                    reported = self.total_lines
+                    yield
+                elif interval and now >= next_report:
+                    while pending:
+                        self._merge_results(results, pending.popleft().get())
+                    self._update_counters(results)
+                    next_report = now + interval
+                    yield
+                elif pending and not found:
+                    # nothing new meanwhile
+                    self._merge_results(results, pending.popleft().get())
+                elif not found:
+                    timeout = max(0, next_report - now) if interval else None
+                    watcher.wait(timeout)
+        finally:
+            watcher.close()
+            for followed in files:
+                followed.close()
+            if pool is not None:
+                self._finish_pool(pool, pending, results)
+
+    def _merge_results(self, results, partial):
+        """Add the results of a worker process to the given ones."""
+        for cmd, cmd_partial in zip(results.commands, partial.commands):
+            cmd.merge(cmd_partial)
+        results.valid_lines += partial.valid_lines
+        results.invalid_lines += partial.invalid_lines
+        results.skipped_lines += partial.skipped_lines
+        results.invalid.extend(partial.invalid)
+
+    def _update_counters(self, results):
+        self.valid_lines = results.valid_lines
+        self.invalid_lines = results.invalid_lines
+        self.skipped_lines = results.skipped_lines
+        for raw_line in results.invalid:
+            print(raw_line)
+        results.invalid = []
+
+    def _finish_pool(self, pool, pending, results):
+        """Wait (a bit) for the blocks still being processed, and stop the
+        worker processes.
+        """
+        try:
+            while pending:
+                partial = pending.popleft().get(FINISH_TIMEOUT)
+                self._merge_results(results, partial)
+        except multiprocessing.TimeoutError:
+            pass
+        finally:
+            self._update_counters(results)
+            pool.terminate()
+
+    def __iter__(self):
+        results_iterator = self._run([self._lines_collector], [], False)
+        if not self._merges_lines():
+            for results in results_iterator:
+                yield from results.commands[0].lines
+            return
+
+        lines = [[] for _ in self.logfiles]
+        for results in results_iterator:
+            lines[results.source].extend(results.commands[0].lines)
+        yield from merge_lines(lines)
 
     @property
     def total_lines(self):
-        return self.valid_lines + self.invalid_lines
+        return self.valid_lines + self.invalid_lines + self.skipped_lines
@@ -1,19 +1,43 @@
 # -*- encoding: utf-8 -*-
+from haproxy.checkpoint import load_checkpoint
+from haproxy.expressions import is_expression
+from haproxy.expressions import parse_expression
+from haproxy.index import build_index
+from haproxy.listener import SyslogListener
 from haproxy.logfile import Log
+from haproxy.planner import plan_query
+from haproxy.readers import find_logfiles
 from haproxy.utils import VALID_COMMANDS
 from haproxy.utils import VALID_FILTERS
 from haproxy.utils import validate_arg_date
 from haproxy.utils import validate_arg_delta
 
 import argparse
+import json
 import os
+import re
+import sys
+
+
+# seconds between the reports of --follow
+DEFAULT_REPORT_INTERVAL = 10
+
+# commas separating filters, but not those within their arguments
+FILTERS_SEPARATOR_REGEX = re.compile(r',(?![^\[]*\])')
 
 
 def create_parser():
     desc = 'Analyze HAProxy log files and outputs statistics about it'
     parser = argparse.ArgumentParser(description=desc)
 
-    parser.add_argument('-l', '--log', help='HAProxy log file to analyze')
+    parser.add_argument(
+        '-l',
+        '--log',
+        nargs='+',
+        action='append',
+        help='HAProxy log files to analyze, or glob patterns matching them '
+        '(e.g. "haproxy.log.*"). They can be compressed with gzip, bzip2 or xz.',
+    )
 
     parser.add_argument(
         '-s',
@@ -35,6 +59,89 @@ def create_parser():
         'given, the time on the first line will be used instead.',
     )
 
+    parser.add_argument(
+        '--seek',
+        action='store_true',
+        help='Use with -s (and -d) to find the lines within the time frame '
+        'with a binary search, instead of reading the whole log file. '
+        'Lines are expected to be (nearly) sorted by date. '
+        'Only for log files that are not compressed.',
+    )
+
+    parser.add_argument(
+        '--seek-tolerance',
+        help='How much lines can be out of order, as a time delta '
+        '(see -d), when using --seek. Defaults to 0s.',
+    )
+
+    parser.add_argument(
+        '--index',
+        action='store_true',
+        help='Use (and build or update if needed) a time index of each log file, '
+        'stored next to it, to find the lines within the time frame given '
+        'with -s (and -d). Only for log files that are not compressed.',
+    )
+
+    parser.add_argument(
+        '--build-index',
+        action='store_true',
+        help='Only build or update the time index of each log file, see --index.',
+    )
+
+    parser.add_argument(
+        '--cache',
+        action='store_true',
+        help='Keep the parsed log lines of each log file on a cache, stored '
+        'next to it, so that they are not parsed again on the next runs. '
+        'Only for log files that are not compressed.',
+    )
+
+    parser.add_argument(
+        '--state',
+        help='State file where to keep up to where the log files were '
+        'analyzed and the results so far. The next runs with the same state '
+        'file only analyze the lines added since, e.g. when run from cron. '
+        'Include the rotated log file to not miss its last lines '
+        '(e.g. -l haproxy.log haproxy.log.1).',
+    )
+
+    parser.add_argument(
+        '--follow',
+        action='store_true',
+        help='Keep analyzing the lines written to the log files from now on, '
+        'reporting the results every now and then (see --report-interval and '
+        '--report-lines) until interrupted with Ctrl+C. '
+        'Log rotations are followed.',
+    )
+
+    parser.add_argument(
+        '--report-interval',
+        type=float,
+        help='Seconds between the reports of --follow. '
+        'Defaults to 10, unless --report-lines is given.',
+    )
+
+    parser.add_argument(
+        '--report-lines',
+        type=int,
+        help='Report the results of --follow every time this many lines '
+        'were written.',
+    )
+
+    parser.add_argument(
+        '--listen-udp',
+        metavar='[HOST:]PORT',
+        help='Instead of log files, analyze the log lines received over syslog '
+        'on this UDP address, e.g. 5140 or 0.0.0.0:5140. Like with --follow, '
+        'results are reported every now and then until interrupted.',
+    )
+
+    parser.add_argument(
+        '--listen-tcp',
+        metavar='[HOST:]PORT',
+        help='Like --listen-udp, over TCP. Both can be given.',
+    )
+
     parser.add_argument(
         '-c',
         '--command',
@@ -47,7 +154,11 @@ def create_parser():
         '--filter',
         help='List of filters to apply on the log file. Passed as comma '
         'separated and parameters within square brackets, e.g '
-        'ip[192.168.1.1],ssl,path[/some/path]. See '
+        'ip[192.168.1.1],ssl,path[/some/path]. Some of them take many '
+        'values, comma separated too, or on a file given as @ and its path, '
+        'e.g. ip_range[10.0.0.0/8,192.168.1] or ip_range[@office.txt]. '
+        'Filters can also be combined with and, or, not and parentheses, e.g. '
+        '"status_code_family[5] and (backend[api] or backend[web])". See '
         '--list-filters to get a full list of them.',
     )
 
@@ -69,6 +180,39 @@ def create_parser():
         '--list-filters', action='store_true', help='Lists all filters available.'
     )
 
+    parser.add_argument(
+        '-j',
+        '--jobs',
+        type=int,
+        help='Number of processes used to parse the log file. '
+        'Defaults to the number of CPUs, small log files are parsed '
+        'with fewer processes, or none at all.',
+    )
+
+    parser.add_argument(
+        '--merge-by-date',
+        action='store_true',
+        help='When analyzing multiple log files, give their lines sorted by '
+        'date to the commands that need it, e.g. queue_peaks and print. '
+        'Lines of each log file are expected to be already sorted.',
+    )
+
+    parser.add_argument(
+        '--stats',
+        action='store_true',
+        help='Measure where the time goes: reading, decoding, parsing, '
+        'filtering, each worker process... and print it as JSON on stderr. '
+        'Processing gets a bit slower.',
+    )
+
+    parser.add_argument(
+        '--profile',
+        action='store_true',
+        help='Print, with the results, how many lines each filter gets and '
+        'lets pass, how long each filter and command takes, and how much '
+        'memory each command holds. Processing gets a bit slower.',
+    )
+
     parser.add_argument('--json', action='store_true', help='Output results in json.')
     parser.add_argument(
         '--invalid',
@@ -92,6 +236,21 @@ def parse_arguments(args):
         'list_filters': None,
         'json': None,
         'invalid_lines': None,
+        'jobs': None,
+        'merge_by_date': None,
+        'seek': None,
+        'seek_tolerance': None,
+        'index': None,
+        'build_index': None,
+        'cache': None,
+        'state': None,
+        'follow': None,
+        'report_interval': None,
+        'report_lines': None,
+        'listen_udp': None,
+        'listen_tcp': None,
+        'stats': None,
+        'profile': None,
     }
 
     if args.list_commands:
@@ -115,6 +274,46 @@ def parse_arguments(args):
         validate_arg_delta(args.delta)
         data['delta'] = args.delta
 
+    if args.seek_tolerance is not None:
+        validate_arg_delta(args.seek_tolerance, '--seek-tolerance')
+        data['seek_tolerance'] = args.seek_tolerance
+
+    if args.build_index:
+        if args.log is None:
+            raise ValueError('--build-index needs the log files given with -l')
+        data['build_index'] = True
+
+    if args.follow:
+        data['follow'] = True
+
+    if args.report_interval is not None:
+        if args.report_interval <= 0:
+            raise ValueError('--report-interval needs to be positive')
+        data['report_interval'] = args.report_interval
+
+    if args.report_lines is not None:
+        if args.report_lines < 1:
+            raise ValueError('--report-lines needs to be at least 1')
+        data['report_lines'] = args.report_lines
+
+    if args.listen_udp is not None:
+        data['listen_udp'] = _validate_arg_address(args.listen_udp, '--listen-udp')
+
+    if args.listen_tcp is not None:
+        data['listen_tcp'] = _validate_arg_address(args.listen_tcp, '--listen-tcp')
+
+    if args.log is not None and (args.listen_udp or args.listen_tcp):
+        raise ValueError('log files can not be analyzed while listening')
+
+    # options that only make sense on log files processed at once
+    for option in ('seek', 'index', 'cache', 'state', 'stats', 'profile'):
+        value = getattr(args, option)
+        if not value:
+            continue
+        if args.follow or args.listen_udp or args.listen_tcp:
+            raise ValueError(f'--{option} can not be used with --follow nor listening')
+        data[option] = value
+
     if args.command is not None:
         data['commands'] = parse_arg_commands(args.command)
 
@@ -122,8 +321,16 @@ def parse_arguments(args):
         data['filters'] = parse_arg_filters(args.filter)
 
     if args.log is not None:
-        _validate_arg_logfile(args.log)
-        data['log'] = args.log
+        data['log'] = _validate_arg_logfiles(
+            [path for paths in args.log for path in paths]
+        )
+
+    if args.jobs is not None:
+        _validate_arg_jobs(args.jobs)
+        data['jobs'] = args.jobs
+
+    if args.merge_by_date:
+        data['merge_by_date'] = True
 
     if args.json is not None:
         data['json'] = args.json
@@ -146,7 +353,13 @@ def parse_arg_commands(commands_list):
 
 
 def parse_arg_filters(filters_arg):
-    input_filters = filters_arg.split(',')
+    if is_expression(filters_arg):
+        # validate it already
+        parse_expression(filters_arg)
+        return [('expression', filters_arg)]
+
+    # commas within square brackets separate the values of an argument
+    input_filters = FILTERS_SEPARATOR_REGEX.split(filters_arg)
 
     return_data = []
     for filter_expression in input_filters:
@@ -159,7 +372,7 @@ def parse_arg_filters(filters_arg):
                     f'Error on filter "{filter_expression}". '
                     f'It is missing an opening square bracket.'
                 )
-            filter_name, filter_arg = filter_expression.split('[')
+            filter_name, _, filter_arg = filter_expression.partition('[')
             filter_arg = filter_arg[:-1]  # remove the closing square bracket
 
         if filter_name not in VALID_FILTERS:
@@ -167,15 +380,42 @@ def parse_arg_filters(filters_arg):
                 f'filter "{filter_name}" is not available. Use --list-filters to get a list of all available filters.'
             )
 
+        if filter_name == 'ip_range' and filter_arg is not None:
+            # networks are parsed right away, not once processing started
+            try:
+                VALID_FILTERS[filter_name]['obj'](filter_arg)
+            except (OSError, ValueError) as error:
+                raise ValueError(f'Error on filter "{filter_expression}". {error}')
+
         return_data.append((filter_name, filter_arg))
 
     return return_data
 
 
-def _validate_arg_logfile(filename):
-    filepath = os.path.join(os.getcwd(), filename)
-    if not os.path.exists(filepath):
-        raise ValueError(f'filename {filepath} does not exist')
+def _validate_arg_logfiles(filenames):
+    logfiles = find_logfiles(filenames)
+    for filename in logfiles:
+        filepath = os.path.join(os.getcwd(), filename)
+        if not os.path.exists(filepath):
+            raise ValueError(f'filename {filepath} does not exist')
+    return logfiles
+
+
+def _validate_arg_address(address, option):
+    """Split a ``[HOST:]PORT`` address, IPv6 hosts go within brackets.
+
+    Without a host, only local connections are accepted.
+    """
+    host, _, port = address.rpartition(':')
+    host = host.strip('[]') or 'localhost'
+    if not port.isdecimal() or int(port) > 65535:
+        raise ValueError(f'{option} needs a port, e.g. 5140 or 0.0.0.0:5140')
+    return host, int(port)
+
+
+def _validate_arg_jobs(jobs):
+    if jobs < 1:
+        raise ValueError('--jobs needs to be at least 1')
 
 
 def print_commands():
@@ -193,7 +433,26 @@ def print_filters():
 def show_help(data):
     # make sure that if no arguments are passed the help is shown
     show = True
-    ignore_keys = ('log', 'json', 'negate_filter', 'invalid_lines')
+    ignore_keys = (
+        'log',
+        'json',
+        'negate_filter',
+        'invalid_lines',
+        'jobs',
+        'merge_by_date',
+        'seek',
+        'seek_tolerance',
+        'index',
+        'cache',
+        'state',
+        'follow',
+        'report_interval',
+        'report_lines',
+        'listen_udp',
+        'listen_tcp',
+        'stats',
+        'profile',
+    )
     for key in data:
         if data[key] is not None and key not in ignore_keys:
             show = False
@@ -222,39 +481,165 @@ def main(args):
         # no need to process further
         return
 
+    # only index the log files
+    if args['build_index']:
+        build_indexes(args['log'])
+        # no need to process further
+        return
+
+    # get the commands and filters to use
+    filters_to_use = requested_filters(args)
+    cmds_to_use = requested_commands(args)
+
+    # only parse what the commands and filters need
+    plan = plan_query(
+        cmds_to_use,
+        filters_to_use,
+        time_frame=args['start'] is not None,
+        merge_by_date=args['merge_by_date'],
+    )
+
+    # resume the analysis where the last run left it
+    checkpoint = None
+    if args['state']:
+        query = (
+            args['commands'],
+            args['filters'],
+            bool(args['negate_filter']),
+            args['start'],
+            args['delta'],
+            bool(args['merge_by_date']),
+        )
+        checkpoint = load_checkpoint(args['state'], query)
+        if checkpoint.commands is not None:
+            cmds_to_use = checkpoint.commands
+
     # initialize the log file
     log_file = Log(
         logfile=args['log'],
         start=args['start'],
         delta=args['delta'],
         show_invalid=args['invalid_lines'],
+        plan=plan,
+        jobs=args['jobs'],
+        merge_by_date=args['merge_by_date'],
+        seek=args['seek'],
+        seek_tolerance=args['seek_tolerance'],
+        index=args['index'],
+        cache=args['cache'],
+        checkpoint=checkpoint,
+        stats=args['stats'] or args['profile'],
     )
 
-    # get the commands and filters to use
-    filters_to_use = requested_filters(args)
-    cmds_to_use = requested_commands(args)
+    output = None
+    if args['json']:
+        output = 'json'
+
+    if args['follow'] or args['listen_udp'] or args['listen_tcp']:
+        follow(log_file, cmds_to_use, filters_to_use, args, output)
+        return
 
-    # double negation: when a user wants to negate the filters,
-    # the argument parsing sets `negate_filter` to True,
-    # but the filtering logic (the `all()`) returns True if the line meets all filters
-    # so reversing whatever `negate_filter` has is what the user wants :)
-    expected_filtering = True
-    if args['negate_filter']:
-        expected_filtering = False
     # process all log lines
-    for line in log_file:
-        if all((f(line) for f in filters_to_use)) is expected_filtering:
-            for cmd in cmds_to_use:
-                cmd(line)
+    with log_file:
+        log_file.process(cmds_to_use, filters_to_use, negate=args['negate_filter'])
+
+    if checkpoint is not None:
+        checkpoint.commands = cmds_to_use
+        checkpoint.save()
 
     # print the results
     print('\nRESULTS\n')
-    output = None
-    if args['json']:
-        output = 'json'
     for cmd in cmds_to_use:
         cmd.results(output=output)
 
+    if args['profile']:
+        filter_names = [
+            name if arg is None else f'{name}[{arg}]'
+            for name, arg in args['filters'] or ()
+        ]
+        print_profile(log_file.stats.profile(filter_names, cmds_to_use), output)
+
+    if args['stats']:
+        report = log_file.stats.report(
+            log_file.valid_lines,
+            log_file.invalid_lines,
+            log_file.mode,
+            log_file.skipped_lines,
+        )
+        print(json.dumps(report), file=sys.stderr)
+
+
+def print_profile(profile, output=None):
+    """Prints the cost and selectivity of filters and commands,
+    see :meth:`haproxy.stats.Stats.profile`.
+    """
+    if output == 'json':
+        print(json.dumps({'PROFILE': profile}))
+        return
+    print('PROFILE\n=======')
+    for data in profile['filters']:
+        print(
+            f"- filter {data['filter']}: {data['calls']} lines, "
+            f"{data['passed']} passed ({data['pass_rate']:.2%}), "
+            f"{data['seconds']:.3f}s"
+        )
+    for data in profile['commands']:
+        print(
+            f"- command {data['command']}: {data['calls']} lines, "
+            f"{data['seconds']:.3f}s, {data['memory'] / 1024:.1f} KiB held"
+        )
+    print()
+
+
+def follow(log_file, cmds_to_use, filters_to_use, args, output=None):
+    """Reports the results of the lines being written to the log files,
+    or received over syslog, until interrupted.
+    """
+    interval = args['report_interval']
+    if interval is None and args['report_lines'] is None:
+        interval = DEFAULT_REPORT_INTERVAL
+    options = {
+        'negate': args['negate_filter'],
+        'interval': interval,
+        'lines': args['report_lines'],
+    }
+    listener = None
+    if args['listen_udp'] or args['listen_tcp']:
+        listener = SyslogListener(udp=args['listen_udp'], tcp=args['listen_tcp'])
+        reports = log_file.listen(listener, cmds_to_use, filters_to_use, **options)
+        for protocol, address in (
+            ('UDP', listener.udp_address),
+            ('TCP', listener.tcp_address),
+        ):
+            if address is not None:
+                print(f'Listening on {protocol} {address[0]}:{address[1]}')
+    else:
+        reports = log_file.follow(cmds_to_use, filters_to_use, **options)
+    try:
+        for _ in reports:
+            for cmd in cmds_to_use:
+                cmd.report(output=output)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        reports.close()
+
+    if listener is not None:
+        print(f'\n{listener.received} lines received, {listener.dropped} dropped')
+    print('\nRESULTS\n')
+    for cmd in cmds_to_use:
+        cmd.results(output=output)
+
+
+def build_indexes(logfiles):
+    """Builds the time index of all log files."""
+    for logfile in logfiles:
+        index = build_index(logfile)
+        if index is None:
+            print(f'{logfile}: compressed log files can not be indexed')
+        else:
+            print(f'{logfile}: {len(index.minutes)} minutes indexed')
+
 
 def requested_filters(args):
     filters_list = []
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""Sets of IPv4 and IPv6 networks, to filter log lines by the IP they come
+from (see :func:`haproxy.filters.filter_ip_range`).
+
+Networks are given in CIDR notation (``10.0.0.0/8``, ``2001:db8::/32``), as
+single IPs, or as the first octets (``192.168``, ``192.168.``) or groups
+(``2001:db8``, ``fe80:``, ``fe80::``) of the IPs, the way ``ip_range`` always
+took them: they are the networks of all the IPs that start with those whole
+octets or groups. Groups need at least a colon, ``fe80`` is not a network.
+
+Every IP version gets a sorted table of the disjoint ranges of integers that
+its networks cover: telling whether an IP is on any of them is converting it
+to an integer, once, and a binary search, whatever the amount of networks.
+
+Long lists of single IPs (see :func:`haproxy.filters.filter_ips`) are packed
+on arrays of integers instead, see :class:`IPSet`.
+"""
+from array import array
+from bisect import bisect_left
+from bisect import bisect_right
+
+import ipaddress
+import re
+import socket
+
+
+# the first octets, or groups, of IPs, e.g. 192.168 or 2001:db8
+IPV4_PREFIX_REGEX = re.compile(r'\A\d{1,3}(\.\d{1,3}){0,2}\.?\Z')
+IPV6_PREFIX_REGEX = re.compile(r'\A[0-9a-fA-F]{1,4}(:[0-9a-fA-F]{1,4}){0,6}:{0,2}\Z')
+
+
+def ip_to_int(ip):
+    """An IPv4 or IPv6 address as an integer, or ``None`` if it is not one.
+
+    :param ip: the address, as text.
+    """
+    family = socket.AF_INET6 if ':' in ip else socket.AF_INET
+    try:
+        return int.from_bytes(socket.inet_pton(family, ip), 'big')
+    except (OSError, ValueError):
+        return None
+
+
+def parse_network(text):
+    """The IP network a text describes.
+
+    :param text: a network in CIDR notation, an IP, or the first octets (or
+      groups, for IPv6, with at least a colon) of the IPs of the network.
+      Groups followed by ``::`` are still the first groups of the IPs:
+      ``fe80::`` is ``fe80::/16``, not the single IP ``fe80::``.
+    :rtype: :class:`ipaddress.IPv4Network` or :class:`ipaddress.IPv6Network`
+    :raises ValueError: if the text is not a network.
+    """
+    text = text.strip()
+    if IPV4_PREFIX_REGEX.match(text):
+        separator, size, bits = '.', 4, 8
+    elif ':' in text and IPV6_PREFIX_REGEX.match(text):
+        separator, size, bits = ':', 8, 16
+    else:
+        try:
+            return ipaddress.ip_network(text, strict=False)
+        except ValueError:
+            raise ValueError(f'"{text}" is not an IP network')
+    parts = text.rstrip(separator).split(separator)
+    address = separator.join(parts + ['0'] * (size - len(parts)))
+    try:
+        return ipaddress.ip_network(f'{address}/{bits * len(parts)}')
+    except ValueError:
+        raise ValueError(f'"{text}" is not an IP network')
+
+
+class Networks(object):
+    """A set of IP networks: ``ip in networks`` tells whether an IP, as text,
+    is on any of them.
+
+    :param networks: the networks, as :func:`parse_network` takes them.
+    :raises ValueError: if any of them is not a network.
+    """
+
+    def __init__(self, networks):
+        self.networks = tuple(parse_network(network) for network in networks)
+        ranges = {4: [], 6: []}
+        for network in sorted(self.networks, key=lambda n: (n.version, n)):
+            first = int(network.network_address)
+            last = int(network.broadcast_address)
+            merged = ranges[network.version]
+            if merged and first <= merged[-1][1] + 1:
+                merged[-1][1] = max(merged[-1][1], last)
+            else:
+                merged.append([first, last])
+        # first and last integer of every range, by IP version
+        self._ipv4 = self._table(ranges[4])
+        self._ipv6 = self._table(ranges[6])
+
+    @staticmethod
+    def _table(ranges):
+        return (
+            tuple(first for first, _ in ranges),
+            tuple(last for _, last in ranges),
+        )
+
+    def __contains__(self, ip):
+        if not ip:
+            return False
+        firsts, lasts = self._ipv6 if ':' in ip else self._ipv4
+        if not firsts:
+            return False
+        number = ip_to_int(ip)
+        if number is None:
+            return False
+        index = bisect_right(firsts, number) - 1
+        return index >= 0 and number <= lasts[index]
+
+    def __len__(self):
+        return len(self.networks)
+
+    def __repr__(self):
+        return f'Networks({", ".join(str(network) for network in self.networks)})'
+
+
+class IPSet(object):
+    """A set of IPs: ``ip in ips`` tells whether an IP, as text, is one of
+    them.
+
+    IPv4 addresses are packed on arrays: the 16 low bits of every address,
+    sorted and grouped by their 16 high bits, and where each group starts.
+    That takes 2 bytes per address (plus 256 KiB), instead of the ~100 bytes
+    of a string on a set, and looking an address up is a binary search on its
+    group, a handful of addresses. Arrays are never written to, so forked
+    worker processes share them.
+    IPv6 addresses, seldom that many, are kept on a set of integers.
+
+    :param ips: the IPs, as text.
+    :raises ValueError: if any of them is not an IP.
+    """
+
+    def __init__(self, ips):
+        ipv4 = set()
+        ipv6 = set()
+        for ip in ips:
+            number = ip_to_int(ip)
+            if number is None:
+                raise ValueError(f'"{ip}" is not an IP')
+            (ipv6 if ':' in ip else ipv4).add(number)
+        numbers = sorted(ipv4)
+        self._lows = array('H', (number & 0xFFFF for number in numbers))
+        # start of the group of every 16 high bits on _lows, and its end
+        self._starts = array('I', bytes(4 * (0x10000 + 1)))
+        for number in numbers:
+            self._starts[(number >> 16) + 1] += 1
+        for high in range(0x10000):
+            self._starts[high + 1] += self._starts[high]
+        self._ipv6 = frozenset(ipv6)
+
+    def __contains__(self, ip):
+        if not ip:
+            return False
+        number = ip_to_int(ip)
+        if number is None:
+            return False
+        if ':' in ip:
+            return number in self._ipv6
+        high = number >> 16
+        start, end = self._starts[high], self._starts[high + 1]
+        if start == end:
+            return False
+        low = number & 0xFFFF
+        index = bisect_left(self._lows, low, start, end)
+        return index < end and self._lows[index] == low
+
+    def __len__(self):
+        return len(self._lows) + len(self._ipv6)
+
+    def __repr__(self):
+        return f'IPSet({len(self)} IPs)'
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""Sets of text patterns, to filter log lines that contain any of them (see
+:func:`haproxy.filters.filter_paths`).
+
+Patterns are compiled into an Aho-Corasick automaton: every character of a
+text is looked at once, to move from a state to the next one, and a state is
+reached as soon as the text read so far ends with any of the patterns.
+Searching a text takes as long whatever the amount of patterns.
+"""
+from collections import deque
+
+
+# state reached when a pattern is found, the search stops there
+FOUND = -1
+
+
+class Patterns(object):
+    """A set of patterns: :meth:`search` tells whether a text contains any
+    of them.
+
+    :param patterns: the patterns, as text.
+    """
+
+    def __init__(self, patterns):
+        self.patterns = tuple(patterns)
+        # a trie of the patterns: the next state for every character, and
+        # whether a pattern ends on the state
+        trie = [{}]
+        ends = [False]
+        for pattern in self.patterns:
+            state = 0
+            for char in pattern:
+                next_state = trie[state].get(char)
+                if next_state is None:
+                    next_state = len(trie)
+                    trie[state][char] = next_state
+                    trie.append({})
+                    ends.append(False)
+                state = next_state
+            ends[state] = True
+
+        # the trie becomes a deterministic automaton: on every state, the
+        # characters that do not continue a pattern go where the longest
+        # suffix of the text read so far that starts a pattern leads
+        transitions = [dict(trie[0])] + [None] * (len(trie) - 1)
+        fallback = [0] * len(trie)
+        pending = deque(trie[0].values())
+        while pending:
+            state = pending.popleft()
+            ends[state] = ends[state] or ends[fallback[state]]
+            transitions[state] = dict(transitions[fallback[state]])
+            transitions[state].update(trie[state])
+            for char, next_state in trie[state].items():
+                fallback[next_state] = transitions[fallback[state]].get(char, 0)
+                pending.append(next_state)
+
+        self._empty = ends[0]
+        # once a pattern is found nothing else needs to be read
+        for table in transitions:
+            for char, next_state in table.items():
+                if ends[next_state]:
+                    table[char] = FOUND
+        self._steps = [table.get for table in transitions]
+
+    def search(self, text):
+        """Whether the given text contains any of the patterns."""
+        if text is None:
+            return False
+        if self._empty:
+            return True
+        steps = self._steps
+        state = 0
+        for char in text:
+            state = steps[state](char, 0)
+            if state < 0:
+                return True
+        return False
+
+    def __getstate__(self):
+        # bound methods can not be pickled, the automaton is built again
+        return self.patterns
+
+    def __setstate__(self, patterns):
+        self.__init__(patterns)
+
+    def __len__(self):
+        return len(self.patterns)
+
+    def __repr__(self):
+        return f'Patterns({len(self.patterns)} patterns)'
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""Decide how much of every log line needs to be parsed.
+
+Commands and filters declare which :class:`.Line` attributes they read on
+their ``fields`` attribute. Out of them a :class:`Plan` is made, so that log
+lines only get the attributes that are going to be used decoded.
+"""
+import enum
+
+
+# attributes that every line has, whatever the strategy
+ALWAYS_AVAILABLE = frozenset(('raw_line', 'is_valid', 'log_type'))
+
+
+class Strategy(enum.Enum):
+    #: Lines are only validated, no attribute is decoded.
+    #: Counting newlines alone is not enough, as only valid lines are counted.
+    COUNT = 0
+    #: Only the attributes required are decoded.
+    PARTIAL = 1
+    #: All attributes are decoded, when it is not known which ones are read.
+    FULL = 2
+
+
+class Plan(object):
+    """How log lines are parsed: a :class:`Strategy` and the attributes
+    that need to be decoded (``None`` for all of them).
+
+    ``raw_line`` tells whether the raw log line itself is read, lines always
+    have it when parsed, but not when read from a cache (see
+    :mod:`haproxy.cache`).
+    """
+
+    def __init__(self, strategy, fields=None, raw_line=True):
+        self.strategy = strategy
+        self.fields = fields
+        self.raw_line = raw_line
+
+    def __repr__(self):
+        return f'Plan({self.strategy.name}, fields={self.fields})'
+
+    @property
+    def lazy(self):
+        return self.strategy is not Strategy.FULL
+
+
+FULL_PLAN = Plan(Strategy.FULL)
+
+
+def required_fields(consumers):
+    """Return the attributes read by the given commands and filters.
+
+    ``None`` is returned if any of them does not declare its attributes.
+    """
+    fields = set()
+    for consumer in consumers:
+        consumer_fields = getattr(consumer, 'fields', None)
+        if consumer_fields is None:
+            return None
+        fields.update(consumer_fields)
+    return fields
+
+
+def plan_query(commands, filters=(), time_frame=False, merge_by_date=False):
+    """Choose the cheapest way to parse lines for the given commands and
+    filters.
+
+    :param commands: command objects that will process the lines.
+    :param filters: filter functions that will be applied on the lines.
+    :param time_frame: whether lines will be checked to be within a time
+      frame, i.e. ``--start`` was given.
+    :param merge_by_date: whether lines of different log files will be
+      merged by their accept date, i.e. ``--merge-by-date`` was given.
+    :returns: the plan to parse log lines with.
+    :rtype: :class:`Plan`
+    """
+    fields = required_fields(list(commands) + list(filters))
+    if fields is None:
+        return FULL_PLAN
+
+    if time_frame or merge_by_date:
+        fields.add('accept_date')
+    raw_line = 'raw_line' in fields
+    fields -= ALWAYS_AVAILABLE
+
+    if not fields:
+        return Plan(Strategy.COUNT, (), raw_line)
+    return Plan(Strategy.PARTIAL, tuple(sorted(fields)), raw_line)
@@ -0,0 +1,434 @@
+# -*- coding: utf-8 -*-
+"""Read log lines out of log files.
+
+Log files are memory mapped: lines are found with ``find`` on the mapped
+buffer and handed over as ``memoryview`` slices of it, so nothing is copied
+nor decoded until the lines are parsed. Worker processes inherit the mapping
+when forked, instead of getting the data sent through pipes.
+
+Plain text log files can be seeked by date: HAProxy writes log lines
+(nearly) in time order, so the lines of a time frame are found with a binary
+search on the mapped log file, reading only the date of a few lines.
+
+Compressed log files (gzip, bzip2 and xz) are decompressed on a thread while
+the workers parse what was already decompressed. The members of multi-member
+gzip files are independent from each other, so each worker decompresses
+its own members.
+"""
+from functools import partial
+from haproxy.line import parse_accept_date
+from operator import attrgetter
+
+import bz2
+import glob
+import gzip
+import heapq
+import lzma
+import mmap
+import os
+import queue
+import re
+import threading
+import zlib
+
+
+# accept date of a log line, e.g. [09/Dec/2013:12:59:46.633]
+ACCEPT_DATE_REGEX = re.compile(rb'\[(\d+/\w+/\d+:\d+:\d+:\d+\.\d+)\]\s')
+
+# bytes at the start of a log file that are checksummed, to notice log files
+# that were rewritten in place
+CHECKSUM_SIZE = 4096
+
+# bytes of a mapped log file copied at once to count its lines
+BLOCK_SIZE = 1024 * 1024
+
+# magic bytes at the start of compressed files, and how to open them
+COMPRESSIONS = (
+    (b'\x1f\x8b', gzip.open),
+    (b'BZh', bz2.open),
+    (b'\xfd7zXZ\x00', lzma.open),
+)
+
+GZIP_MEMBER_MAGIC = b'\x1f\x8b\x08'
+
+# compressed bytes fed at once to the decompressor of a gzip member
+GZIP_READ_SIZE = 256 * 1024
+
+# compressed bytes decompressed to tell whether a gzip magic is the start of a
+# member or just happens to be found inside the compressed data
+GZIP_PROBE_SIZE = 16 * 1024
+
+
+def find_logfiles(paths):
+    """Expand the glob patterns among the given paths.
+
+    Paths that exist are kept as they are, patterns are replaced by the
+    files that they match, sorted by name. Patterns that do not match any
+    file are kept, so that opening them reports the error.
+
+    :param paths: list of paths and patterns.
+    :returns: list of paths.
+    """
+    logfiles = []
+    for path in paths:
+        matches = []
+        if not os.path.exists(path):
+            matches = sorted(glob.glob(os.fspath(path)))
+        logfiles.extend(matches or [path])
+    return logfiles
+
+
+def merge_lines(lines):
+    """Merge lists of lines, each of them sorted, by their accept date.
+
+    :param lines: list of lists of :class:`.Line` objects, e.g. one list
+      for each log file.
+    :returns: generator of all the lines, sorted by their accept date.
+    """
+    return heapq.merge(*lines, key=attrgetter('accept_date'))
+
+
+def file_identity(logfile):
+    """``(size, mtime, inode)`` of a file, to know whether it changed."""
+    stat = os.stat(logfile)
+    return stat.st_size, stat.st_mtime_ns, stat.st_ino
+
+
+def head_checksum(buffer, size):
+    """CRC32 of the first bytes of a log file, up to ``size`` bytes of it."""
+    return zlib.crc32(buffer[: min(size, CHECKSUM_SIZE)])
+
+
+def is_appended(buffer, identity, previous, size, checksum):
+    """Whether a log file was only appended to since it was last read.
+
+    It is the same file (inode), it did not shrink, and its first bytes did
+    not change.
+
+    :param buffer: mapped log file.
+    :param identity: current :func:`file_identity` of the log file.
+    :param previous: :func:`file_identity` of the log file when it was read.
+    :param size: amount of bytes that were read.
+    :param checksum: :func:`head_checksum` of the log file when it was read.
+    """
+    return (
+        previous is not None
+        and previous[2] == identity[2]
+        and size <= len(buffer)
+        and checksum == head_checksum(buffer, size)
+    )
+
+
+def map_file(logfile):
+    """Memory map a log file, read only.
+
+    :param logfile: path to the file to map.
+    :returns: the mapped file, or an empty ``bytes`` for empty files as
+      those can not be mapped.
+    """
+    with open(logfile, 'rb') as file_obj:
+        if os.fstat(file_obj.fileno()).st_size == 0:
+            return b''
+        # the mapping keeps its own file descriptor, the file can be closed
+        return mmap.mmap(file_obj.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def split_buffer(buffer, chunks, start=0, end=None):
+    """Split a buffer in byte ranges that start and end on line boundaries.
+
+    :param buffer: mapped log file (or any bytes-like object).
+    :param chunks: number of byte ranges wanted, fewer are returned if the
+      buffer does not have enough lines.
+    :param start: byte offset where to start, at a line boundary.
+    :param end: byte offset where to end, at a line boundary.
+      The end of the buffer by default.
+    :returns: list of ``(start, end)`` byte offsets.
+    """
+    if end is None:
+        end = len(buffer)
+    offsets = [start]
+    for index in range(1, chunks):
+        position = start + (end - start) * index // chunks
+        if position <= offsets[-1]:
+            continue
+        # move to the start of the next line,
+        # unless the position already is the start of a line
+        position = buffer.find(b'\n', position - 1) + 1
+        if offsets[-1] < position < end:
+            offsets.append(position)
+    offsets.append(end)
+    return list(zip(offsets, offsets[1:]))
+
+
+def iter_lines(buffer, chunk=None):
+    """Yield the lines of a byte range of a buffer, new line included.
+
+    Lines are ``memoryview`` slices of the buffer, no data is copied.
+
+    :param buffer: mapped log file (or any bytes-like object).
+    :param chunk: ``(start, end)`` byte offsets, they need to be on line
+      boundaries (see :func:`split_buffer`). The whole buffer by default.
+    """
+    start, end = chunk or (0, len(buffer))
+    view = memoryview(buffer)
+    find = buffer.find
+    while start < end:
+        # the last line might not end with a new line
+        position = find(b'\n', start, end) + 1 or end
+        yield view[start:position]
+        start = position
+
+
+def lines_containing(buffer, texts, chunk=None):
+    """Lines of a byte range of a buffer that contain all the given texts,
+    new line included, and how many lines the byte range has.
+
+    The first text is searched on the whole byte range at once: lines
+    without it are skipped without even being split. As with
+    :func:`iter_lines`, the buffer is searched where it is, only the lines
+    that contain the texts are sliced out of it.
+
+    :param buffer: mapped log file (or any bytes-like object).
+    :param texts: bytes that the lines need to contain, without new lines.
+    :param chunk: ``(start, end)`` byte offsets, on line boundaries.
+      The whole buffer by default.
+    :returns: ``(lines, total)``, lines being ``memoryview`` slices as
+      :func:`iter_lines` yields.
+    """
+    start, end = chunk or (0, len(buffer))
+    total = count_lines(buffer, start, end)
+    return _iter_lines_containing(buffer, texts, start, end), total
+
+
+def count_lines(buffer, start=0, end=None):
+    """How many lines a byte range of a buffer has, the last one might not
+    end with a new line.
+
+    Mappings can not count, the byte range is copied out of them in blocks of
+    :data:`BLOCK_SIZE` bytes to be counted, one at a time.
+    """
+    if end is None:
+        end = len(buffer)
+    total = 0
+    for position in range(start, end, BLOCK_SIZE):
+        total += buffer[position : min(position + BLOCK_SIZE, end)].count(b'\n')
+    if start < end and buffer[end - 1 : end] != b'\n':
+        total += 1
+    return total
+
+
+def _iter_lines_containing(buffer, texts, position, end):
+    view = memoryview(buffer)
+    find = buffer.find
+    rfind = buffer.rfind
+    first, others = texts[0], texts[1:]
+    while True:
+        found = find(first, position, end)
+        if found < 0:
+            return
+        start = rfind(b'\n', position, found) + 1 or position
+        position = find(b'\n', found, end) + 1 or end
+        for text in others:
+            if find(text, start, position) < 0:
+                break
+        else:
+            yield view[start:position]
+
+
+def read_accept_date(raw_line):
+    """Accept date of a log line, without parsing anything else of it.
+
+    :param raw_line: bytes-like log line.
+    :returns: a ``datetime`` or ``None`` if the line does not have one.
+    """
+    matches = ACCEPT_DATE_REGEX.search(raw_line)
+    if matches is None:
+        return None
+    try:
+        return parse_accept_date(matches.group(1).decode('ascii'))
+    except ValueError:
+        return None
+
+
+def next_dated_line(buffer, position, end):
+    """First line with an accept date, starting at the given offset.
+
+    :param buffer: mapped log file.
+    :param position: byte offset where to start, at a line boundary.
+    :param end: byte offset where to stop, at a line boundary.
+    :returns: ``(start, end, date)`` of the line, or ``(end, end, None)``
+      if there is none.
+    """
+    while position < end:
+        line_end = buffer.find(b'\n', position, end) + 1 or end
+        line_date = read_accept_date(buffer[position:line_end])
+        if line_date is not None:
+            return position, line_end, line_date
+        position = line_end
+    return end, end, None
+
+
+def seek_date(buffer, date, low=0, high=None):
+    """Offset of the first line dated at or after the given date.
+
+    The lines are expected to be sorted by their accept date, a binary search
+    finds the line reading only the date of a few lines on the way.
+    Lines without a date are skipped over.
+
+    :param buffer: mapped log file.
+    :param date: ``datetime`` to look for.
+    :param low: byte offset where to start searching, at a line boundary.
+    :param high: byte offset where to stop searching, at a line boundary.
+      The end of the buffer by default.
+    :returns: the byte offset of the line, ``high`` if all lines are older.
+    """
+    if high is None:
+        high = len(buffer)
+    while low < high:
+        middle = (low + high) // 2
+        line_start = max(low, buffer.rfind(b'\n', low, middle) + 1)
+        _, line_end, line_date = next_dated_line(buffer, line_start, high)
+        if line_date is not None and line_date < date:
+            low = line_end
+        else:
+            high = line_start
+    return low
+
+
+def line_blocks(chunks):
+    """Cut chunks of data on line boundaries.
+
+    :param chunks: iterable of ``bytes``, lines can span over them.
+    :returns: generator of ``bytes`` blocks made of whole lines,
+      only the last one might not end with a new line.
+    """
+    rest = b''
+    for chunk in chunks:
+        position = chunk.rfind(b'\n') + 1
+        if position:
+            yield rest + chunk[:position]
+            rest = chunk[position:]
+        else:
+            rest += chunk
+    if rest:
+        yield rest
+
+
+def compression(buffer):
+    """Function to open the file as a stream if its content is compressed.
+
+    :param buffer: mapped log file.
+    :returns: ``gzip.open``, ``bz2.open``, ``lzma.open``, or ``None`` for
+      plain text log files.
+    """
+    for magic, opener in COMPRESSIONS:
+        if buffer[: len(magic)] == magic:
+            return opener
+    return None
+
+
+def read_blocks(file_obj, size):
+    """Read a (decompressing) file object in blocks of whole lines.
+
+    The file object is closed once read.
+
+    :param size: amount of data to read at once, blocks are slightly
+      bigger or smaller than that.
+    """
+    with file_obj:
+        yield from line_blocks(iter(partial(file_obj.read, size), b''))
+
+
+def prefetch(iterable, size=2):
+    """Iterate over an iterable on a thread, keeping some items ready.
+
+    The stdlib decompressors release the GIL, so decompressing on a thread
+    overlaps with whatever the caller does with the previous blocks.
+
+    :param size: how many items can be waiting to be consumed, the thread
+      blocks once that many are.
+    """
+    items = queue.Queue(size)
+    done = object()
+
+    def produce():
+        try:
+            for item in iterable:
+                items.put((item, None))
+        # any error is raised again by the consumer, on its own thread
+        except Exception as error:  # noqa: B902
+            items.put((done, error))
+        else:
+            items.put((done, None))
+
+    threading.Thread(target=produce, daemon=True).start()
+    while True:
+        item, error = items.get()
+        if item is done:
+            break
+        yield item
+    if error is not None:
+        raise error
+
+
+class GzipMember(object):
+    """Decompressed data of the gzip member that starts at an offset.
+
+    Iterating over it yields the decompressed data, after that :attr:`end`
+    holds the offset right after the member.
+    It raises ``zlib.error`` or ``EOFError`` if the offset is not the start of
+    a (complete) gzip member: besides its header, its CRC and size are checked.
+    """
+
+    def __init__(self, buffer, offset, limit=None):
+        self.buffer = buffer
+        self.offset = offset
+        self.limit = limit
+        self.end = None
+
+    def __iter__(self):
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        position = self.offset
+        size = len(self.buffer)
+        if self.limit is not None:
+            size = min(size, self.offset + self.limit)
+        while not decompressor.eof:
+            if position >= size:
+                if self.limit is not None:
+                    return
+                raise EOFError(f'gzip member at {self.offset} is truncated')
+            data = self.buffer[position : position + GZIP_READ_SIZE]
+            position += len(data)
+            yield decompressor.decompress(data)
+        self.end = position - len(decompressor.unused_data)
+
+
+def _is_gzip_member(buffer, offset):
+    try:
+        for _ in GzipMember(buffer, offset, limit=GZIP_PROBE_SIZE):
+            pass
+    except (zlib.error, EOFError):
+        return False
+    return True
+
+
+def gzip_members(buffer):
+    """Offsets where the members of a gzip file (most probably) start.
+
+    The gzip magic bytes could also be found inside the compressed data,
+    every candidate besides the first one is probed by decompressing a bit of
+    it. Few of those false positives pass the probe: they fail once fully
+    decompressed, see :class:`GzipMember`.
+
+    :param buffer: mapped log file.
+    :returns: list of offsets, empty if the buffer is not gzip compressed.
+    """
+    if buffer[: len(GZIP_MEMBER_MAGIC)] != GZIP_MEMBER_MAGIC:
+        return []
+    offsets = [0]
+    position = buffer.find(GZIP_MEMBER_MAGIC, 1)
+    while position != -1:
+        if _is_gzip_member(buffer, position):
+            offsets.append(position)
+        position = buffer.find(GZIP_MEMBER_MAGIC, position + 1)
+    return offsets
@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+"""Where the time goes when analyzing log files, see ``--stats``.
+
+The processing of every log line is split in stages:
+
+- ``read``: getting the lines out of the log files (reading, decompressing,
+  loading them from a cache), and everything else a task does that is not
+  any of the stages below,
+- ``decode``: decoding the raw bytes of the lines,
+- ``parse``: splitting the lines in their raw values (tokenizer or regex),
+- ``convert``: converting the raw values that are used (dates, numbers...),
+- ``filter``: the filters (checking the time frame is left to ``read``),
+- ``command``: running the commands on the lines,
+- ``merge``: merging the partial results of the commands, on the main process.
+
+The wall time of each stage is measured on every line, the CPU time only for
+every task as a whole: measuring it is several times more expensive.
+Stages are summed over all worker processes, the time of each one of them is
+given on its own.
+
+The filter and command stages are also measured for every filter and command
+(see ``--profile``): how many lines they get, how many pass each filter (its
+selectivity), how long they take, and how much memory commands hold.
+"""
+from collections import deque
+from haproxy.line import Line
+
+import os
+import sys
+import time
+import types
+
+
+STAGES = ('read', 'decode', 'parse', 'convert', 'filter', 'command', 'merge')
+
+MEGABYTE = 1024 * 1024
+
+# objects that memory_size() does not follow, they are not held by commands
+NOT_FOLLOWED = (
+    type,
+    types.ModuleType,
+    types.FunctionType,
+    types.BuiltinFunctionType,
+    types.MethodType,
+)
+
+
+class Stats(object):
+    """Time spent on each stage, lines and bytes processed.
+
+    Like commands, they are measured on every task on its own, and merged.
+    """
+
+    def __init__(self):
+        self.stages = dict.fromkeys(STAGES, 0.0)
+        self.bytes = 0
+        # wall and CPU time of the whole analysis, on the main process
+        self.wall = 0.0
+        self.cpu = 0.0
+        # tasks, lines, wall and CPU time of every process, by its pid
+        self.workers = {}
+        # calls, lines that passed and time of every filter, by their position
+        self.filters = []
+        # calls and time of every command, by its name
+        self.commands = {}
+
+    def add_task(self, wall, cpu, lines):
+        """Account for a task, on the process that ran it.
+
+        The time it took that is not measured on any other stage is reading.
+        """
+        measured = sum(self.stages.values()) - self.stages['read']
+        self.stages['read'] += max(0.0, wall - measured)
+        worker = self.workers.setdefault(os.getpid(), [0, 0, 0.0, 0.0])
+        worker[0] += 1
+        worker[1] += lines
+        worker[2] += wall
+        worker[3] += cpu
+
+    def merge(self, other):
+        for stage, seconds in other.stages.items():
+            self.stages[stage] += seconds
+        self.bytes += other.bytes
+        for pid, (tasks, lines, wall, cpu) in other.workers.items():
+            worker = self.workers.setdefault(pid, [0, 0, 0.0, 0.0])
+            worker[0] += tasks
+            worker[1] += lines
+            worker[2] += wall
+            worker[3] += cpu
+        for index, (calls, passed, seconds) in enumerate(other.filters):
+            profile = self.filter(index)
+            profile[0] += calls
+            profile[1] += passed
+            profile[2] += seconds
+        for name, (calls, seconds) in other.commands.items():
+            profile = self.command(name)
+            profile[0] += calls
+            profile[1] += seconds
+
+    def filter(self, index):
+        """Calls, lines that passed and time of a filter."""
+        while len(self.filters) <= index:
+            self.filters.append([0, 0, 0.0])
+        return self.filters[index]
+
+    def command(self, name):
+        """Calls and time of a command."""
+        return self.commands.setdefault(name, [0, 0.0])
+
+    def timed_lines(self, raw_lines, plan=None):
+        """Parse raw lines as :func:`haproxy.line.parse_line` does, measuring
+        the decode, parse and convert stages of every line.
+        """
+        clock = time.perf_counter
+        stages = self.stages
+        fields = plan.fields if plan is not None and plan.lazy else None
+        for raw_line in raw_lines:
+            begin = clock()
+            text = str(raw_line, 'utf-8', 'replace')
+            decoded = clock()
+            # the parsing and conversion of the raw values apart
+            line = Line(text.strip(), lazy=True)
+            parsed = clock()
+            if line.is_valid:
+                line.decode(fields)
+            stages['decode'] += decoded - begin
+            stages['parse'] += parsed - decoded
+            stages['convert'] += clock() - parsed
+            yield line
+
+    def timed_filters(self, filters, order, negate=False):
+        """Predicate that tells the same as the compiled filters (see
+        :func:`haproxy.filters.compile_filters`), evaluating them one by one
+        to measure each of them, and the filter stage.
+
+        :param order: position of the filters in the order they are evaluated.
+        """
+        clock = time.perf_counter
+        stages = self.stages
+        profiled = [(filters[index], self.filter(index)) for index in order]
+        expected = not negate
+
+        def predicate(line):
+            begin = last = clock()
+            passed = True
+            for filter_func, profile in profiled:
+                passed = filter_func(line)
+                now = clock()
+                profile[0] += 1
+                profile[2] += now - last
+                last = now
+                if not passed:
+                    break
+                profile[1] += 1
+            stages['filter'] += last - begin
+            return bool(passed) is expected
+
+        return predicate
+
+    def timed_command(self, cmd, name=None):
+        """Command that runs the given one, measuring the command stage,
+        and the command on its own if it has a name.
+        """
+        clock = time.perf_counter
+        stages = self.stages
+        profile = None if name is None else self.command(name)
+
+        def command(line):
+            begin = clock()
+            cmd(line)
+            seconds = clock() - begin
+            stages['command'] += seconds
+            if profile is not None:
+                profile[0] += 1
+                profile[1] += seconds
+
+        return command
+
+    def profile(self, filter_names, commands):
+        """Cost and selectivity of every filter, cost of every command.
+
+        :param filter_names: names of the filters, in the order they run.
+        :param commands: the commands, with their results.
+        """
+        filters = []
+        for index, name in enumerate(filter_names):
+            calls, passed, seconds = self.filter(index)
+            filters.append(
+                {
+                    'filter': name,
+                    'calls': calls,
+                    'passed': passed,
+                    'pass_rate': round(passed / calls, 6) if calls else 0.0,
+                    'seconds': round(seconds, 6),
+                }
+            )
+        profiles = []
+        for cmd in commands:
+            name = cmd.command_line_name()
+            calls, seconds = self.command(name)
+            profiles.append(
+                {
+                    'command': name,
+                    'calls': calls,
+                    'seconds': round(seconds, 6),
+                    'memory': memory_size(cmd),
+                }
+            )
+        return {'filters': filters, 'commands': profiles}
+
+    def report(self, valid_lines, invalid_lines, mode=None, skipped_lines=0):
+        """The statistics, ready to be dumped as JSON.
+
+        :param valid_lines: amount of valid lines processed.
+        :param invalid_lines: amount of lines that could not be parsed.
+        :param mode: how the log files were processed,
+          see :attr:`haproxy.logfile.Log.mode`.
+        :param skipped_lines: amount of lines skipped before being parsed,
+          as they could not pass the filters.
+
+        Skipped lines are not known to be valid or not, ``invalid_lines`` only
+        counts the lines that were parsed. With skipped lines the rate of
+        invalid lines is unknown, and reported as ``None``.
+        """
+        parsed = valid_lines + invalid_lines
+        lines = parsed + skipped_lines
+        if skipped_lines or not parsed:
+            invalid_rate = None if skipped_lines else 0.0
+        else:
+            invalid_rate = round(invalid_lines / parsed, 6)
+        wall = self.wall or float('inf')
+        return {
+            'mode': mode,
+            'wall': round(self.wall, 6),
+            'cpu': round(self.cpu, 6),
+            'lines': lines,
+            'valid_lines': valid_lines,
+            'invalid_lines': invalid_lines,
+            'skipped_lines': skipped_lines,
+            'invalid_rate': invalid_rate,
+            'bytes': self.bytes,
+            'lines_per_second': round(lines / wall, 1),
+            'mb_per_second': round(self.bytes / MEGABYTE / wall, 3),
+            'stages': {stage: round(self.stages[stage], 6) for stage in STAGES},
+            'workers': [
+                {
+                    'pid': pid,
+                    'tasks': tasks,
+                    'lines': worker_lines,
+                    'wall': round(worker_wall, 6),
+                    'cpu': round(worker_cpu, 6),
+                }
+                for pid, (tasks, worker_lines, worker_wall, worker_cpu) in sorted(
+                    self.workers.items()
+                )
+            ],
+        }
+
+
+def memory_size(obj):
+    """Roughly how many bytes an object holds, with all the objects it refers
+    to (containers, attributes, slots), each one counted once.
+
+    Classes, modules and functions are not followed.
+    """
+    seen = set()
+    size = 0
+    pending = [obj]
+    while pending:
+        current = pending.pop()
+        if id(current) in seen or isinstance(current, NOT_FOLLOWED):
+            continue
+        seen.add(id(current))
+        size += sys.getsizeof(current)
+        if isinstance(current, dict):
+            pending.extend(current.keys())
+            pending.extend(current.values())
+        elif isinstance(current, (list, tuple, set, frozenset, deque)):
+            pending.extend(current)
+        if hasattr(current, '__dict__'):
+            pending.append(vars(current))
+        for cls in type(current).__mro__:
+            for name in getattr(cls, '__slots__', ()):
+                try:
+                    # without triggering __getattr__, e.g. decoding lazy lines
+                    pending.append(cls.__dict__[name].__get__(current))
+                except (AttributeError, KeyError):
+                    pass
+    return size
@@ -21,6 +21,21 @@ def test_parser_arguments_defaults():
         'list_filters': None,
         'json': False,
         'invalid_lines': False,
+        'jobs': None,
+        'merge_by_date': None,
+        'seek': None,
+        'seek_tolerance': None,
+        'index': None,
+        'build_index': None,
+        'cache': None,
+        'state': None,
+        'follow': None,
+        'report_interval': None,
+        'report_lines': None,
+        'listen_udp': None,
+        'listen_tcp': None,
+        'stats': None,
+        'profile': None,
     }
 
 
@@ -32,6 +47,11 @@ def test_parser_arguments_defaults():
         ('--negate-filter', 'negate_filter'),
         ('-n', 'negate_filter'),
         ('--json', 'json'),
+        ('--merge-by-date', 'merge_by_date'),
+        ('--seek', 'seek'),
+        ('--index', 'index'),
+        ('--cache', 'cache'),
+        ('--follow', 'follow'),
     ],
 )
 def test_parser_boolean_arguments(argument, option):
@@ -115,12 +135,35 @@ def test_filters_arguments(filters_list, is_valid):
         assert data['filters'] == [(x, None) for x in filters_list.split(',')]
 
 
+@pytest.mark.parametrize(
+    'filter_expression, message',
+    [
+        ('ssl or potatoes', 'filter "potatoes" is not available'),
+        ('(ssl or backend[api]', 'incomplete'),
+    ],
+)
+def test_filters_expression_not_valid(filter_expression, message):
+    """Check that expressions are validated when parsing arguments."""
+    with pytest.raises(ValueError) as exception_info:
+        parse_arg_filters(filter_expression)
+    assert message in str(exception_info)
+
+
 @pytest.mark.parametrize(
     'filter_expression, expected',
     [
         ('ip_range', [('ip_range', None)]),
         ('ip_rangelala]', None),
-        ('ip_range[lala]', [('ip_range', 'lala')]),
+        ('ip_range[10.1]', [('ip_range', '10.1')]),
+        (
+            'ip_range[10.0.0.0/8,192.168],ssl',
+            [('ip_range', '10.0.0.0/8,192.168'), ('ssl', None)],
+        ),
+        ('ssl,ip_range1,2]', None),
+        (
+            'ssl or not ip_range[10.0.0.0/8]',
+            [('expression', 'ssl or not ip_range[10.0.0.0/8]')],
+        ),
     ],
 )
 def test_filters_with_arguments(filter_expression, expected):
@@ -137,6 +180,32 @@ def test_filters_with_arguments(filter_expression, expected):
         assert data == expected
 
 
+def test_filters_with_arguments_on_file(tmp_path):
+    """Check that the ranges of ip_range can be given on a file."""
+    ranges = tmp_path / 'ranges.txt'
+    ranges.write_text('10.0.0.0/8\n192.168\n')
+    data = parse_arg_filters(f'ip_range[@{ranges}]')
+    assert data == [('ip_range', f'@{ranges}')]
+
+
+@pytest.mark.parametrize(
+    'filter_expression, message',
+    [
+        ('ip_range[lala]', '"lala" is not an IP network'),
+        ('ssl,ip_range[10.0.0.0/8,fe80]', '"fe80" is not an IP network'),
+        ('ip_range[@non-existing-file.txt]', 'non-existing-file.txt'),
+    ],
+)
+def test_filters_ip_range_not_valid(filter_expression, message):
+    """Check that the ranges of ip_range are validated when parsing
+    arguments.
+    """
+    with pytest.raises(ValueError) as exception_info:
+        parse_arg_filters(filter_expression)
+    assert 'Error on filter "ip_range[' in str(exception_info.value)
+    assert message in str(exception_info.value)
+
+
 @pytest.mark.parametrize(
     'filename, is_valid',
     [
@@ -149,8 +218,159 @@ def test_log_argument(filename, is_valid):
     parser = create_parser()
     if is_valid:
         data = parse_arguments(parser.parse_args(['-l', filename]))
-        assert data['log'] == filename
+        assert data['log'] == [filename]
     else:
         with pytest.raises(ValueError) as exception_info:
             parse_arguments(parser.parse_args(['-l', filename]))
         assert f'{filename} does not exist' in str(exception_info)
+
+
+def test_build_index_argument():
+    """Check that the log files to index are required."""
+    parser = create_parser()
+    data = parse_arguments(
+        parser.parse_args(['--build-index', '-l', 'haproxy/tests/conftest.py'])
+    )
+    assert data['build_index'] is True
+    with pytest.raises(ValueError) as exception_info:
+        parse_arguments(parser.parse_args(['--build-index']))
+    assert '--build-index needs the log files' in str(exception_info)
+
+
+def test_state_argument():
+    """Check that the state file is kept."""
+    parser = create_parser()
+    data = parse_arguments(parser.parse_args(['--state', 'haproxy.state']))
+    assert data['state'] == 'haproxy.state'
+
+
+@pytest.mark.parametrize(
+    'argument, value, expected',
+    [
+        ('--report-interval', '2.5', 2.5),
+        ('--report-interval', '0', None),
+        ('--report-lines', '100', 100),
+        ('--report-lines', '0', None),
+    ],
+)
+def test_report_arguments(argument, value, expected):
+    """Check that the reports of --follow are validated."""
+    parser = create_parser()
+    if expected is None:
+        with pytest.raises(ValueError) as exception_info:
+            parse_arguments(parser.parse_args([argument, value]))
+        assert argument in str(exception_info)
+    else:
+        data = parse_arguments(parser.parse_args([argument, value]))
+        assert data[argument[2:].replace('-', '_')] == expected
+
+
+@pytest.mark.parametrize(
+    'address, expected',
+    [
+        ('5140', ('localhost', 5140)),
+        ('0.0.0.0:514', ('0.0.0.0', 514)),
+        ('[::1]:5140', ('::1', 5140)),
+        ('localhost', None),
+        ('0.0.0.0:70000', None),
+    ],
+)
+@pytest.mark.parametrize('argument', ['--listen-udp', '--listen-tcp'])
+def test_listen_arguments(argument, address, expected):
+    """Check that the addresses to listen on are validated."""
+    parser = create_parser()
+    if expected is None:
+        with pytest.raises(ValueError) as exception_info:
+            parse_arguments(parser.parse_args([argument, address]))
+        assert f'{argument} needs a port' in str(exception_info)
+    else:
+        data = parse_arguments(parser.parse_args([argument, address]))
+        assert data[argument[2:].replace('-', '_')] == expected
+
+
+def test_listen_with_log_argument():
+    """Check that log files can not be given while listening."""
+    parser = create_parser()
+    arguments = ['--listen-udp', '5140', '-l', 'haproxy/tests/files/small.log']
+    with pytest.raises(ValueError) as exception_info:
+        parse_arguments(parser.parse_args(arguments))
+    assert 'can not be analyzed while listening' in str(exception_info)
+
+
+@pytest.mark.parametrize(
+    'arguments', [['--follow'], ['--listen-udp', '5140'], ['--listen-tcp', '5140']]
+)
+@pytest.mark.parametrize('option', ['--stats', '--profile'])
+def test_stats_argument(option, arguments):
+    """Check that stats are only measured on log files processed at once."""
+    parser = create_parser()
+    with pytest.raises(ValueError) as exception_info:
+        parse_arguments(parser.parse_args([option] + arguments))
+    assert f'{option} can not be used' in str(exception_info)
+
+
+@pytest.mark.parametrize(
+    'arguments', [['--follow'], ['--listen-udp', '5140'], ['--listen-tcp', '5140']]
+)
+@pytest.mark.parametrize(
+    'option', [['--state', 'state.json'], ['--cache'], ['--seek'], ['--index']]
+)
+def test_log_files_only_arguments(option, arguments):
+    """Check that the options for log files processed at once are not
+    silently ignored when following them or listening.
+    """
+    parser = create_parser()
+    with pytest.raises(ValueError) as exception_info:
+        parse_arguments(parser.parse_args(option + arguments))
+    assert f'{option[0]} can not be used with --follow' in str(exception_info)
+
+
+@pytest.mark.parametrize('jobs, is_valid', [('1', True), ('64', True), ('0', False)])
+def test_jobs_argument(jobs, is_valid):
+    """Check that the number of processes is validated."""
+    parser = create_parser()
+    if is_valid:
+        data = parse_arguments(parser.parse_args(['--jobs', jobs]))
+        assert data['jobs'] == int(jobs)
+    else:
+        with pytest.raises(ValueError) as exception_info:
+            parse_arguments(parser.parse_args(['-j', jobs]))
+        assert '--jobs needs to be at least 1' in str(exception_info)
+
+
+def test_log_argument_multiple_files(tmp_path):
+    """Check that multiple log files and glob patterns can be given."""
+    for name in ('haproxy.log', 'haproxy.log.1', 'haproxy.log.2.gz', 'other.log'):
+        (tmp_path / name).write_text('')
+    parser = create_parser()
+    arguments = ['-l', f'{tmp_path}/haproxy.log.*', f'{tmp_path}/other.log']
+    arguments.extend(['-l', f'{tmp_path}/haproxy.log'])
+    data = parse_arguments(parser.parse_args(arguments))
+    assert data['log'] == [
+        f'{tmp_path}/haproxy.log.1',
+        f'{tmp_path}/haproxy.log.2.gz',
+        f'{tmp_path}/other.log',
+        f'{tmp_path}/haproxy.log',
+    ]
+
+
+def test_log_argument_pattern_without_matches(tmp_path):
+    """Check that glob patterns need to match some log file."""
+    parser = create_parser()
+    with pytest.raises(ValueError) as exception_info:
+        parse_arguments(parser.parse_args(['-l', f'{tmp_path}/*.log']))
+    assert 'does not exist' in str(exception_info)
+
+
+@pytest.mark.parametrize('tolerance, is_valid', [('30s', True), ('2m', True), ('2', False)])
+def test_seek_tolerance_argument(tolerance, is_valid):
+    """Check that the seek tolerance is validated."""
+    parser = create_parser()
+    arguments = parser.parse_args(['--seek', '--seek-tolerance', tolerance])
+    if is_valid:
+        data = parse_arguments(arguments)
+        assert data['seek_tolerance'] == tolerance
+    else:
+        with pytest.raises(ValueError) as exception_info:
+            parse_arguments(arguments)
+        assert '--seek-tolerance argument is not valid' in str(exception_info)
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+from haproxy import commands
+from haproxy import filters
+from haproxy.cache import cached_fields
+from haproxy.cache import COLUMNS
+from haproxy.cache import ColumnCache
+from haproxy.cache import load_cache
+from haproxy.line import Line
+from haproxy.planner import FULL_PLAN
+from haproxy.planner import Plan
+from haproxy.planner import plan_query
+from haproxy.planner import Strategy
+from haproxy.readers import map_file
+from haproxy.tests.conftest import DEFAULT_DATA
+from haproxy.tests.test_tokenizer import HTTP_VARIATIONS
+from haproxy.tests.test_tokenizer import LINE_ATTRIBUTES
+from haproxy.tests.test_tokenizer import TCP_VARIATIONS
+
+import os
+import pytest
+
+
+CACHED_ATTRIBUTES = [
+    name
+    for name in LINE_ATTRIBUTES
+    if name not in ('raw_accept_date', 'raw_http_request')
+] + ['ip', 'is_https']
+
+
+@pytest.fixture
+def logfile(tmp_path, http_line_factory, tcp_line_factory):
+    """Log file with all sorts of lines, invalid ones included."""
+    lines = [
+        http_line_factory(**{**DEFAULT_DATA, **variation}).raw_line
+        for variation in HTTP_VARIATIONS
+    ]
+    lines.extend(
+        tcp_line_factory(**{**DEFAULT_DATA, **variation}).raw_line
+        for variation in TCP_VARIATIONS
+    )
+    lines.extend(['', 'something completely different'])
+    file_path = tmp_path / 'haproxy.log'
+    file_path.write_text(''.join(f'{line}\n' for line in lines))
+    return file_path
+
+
+def _meta(logfile):
+    with open(f'{logfile}.cache/meta.json') as meta_file:
+        return meta_file.read()
+
+
+def _cached_lines(logfile, fields=None):
+    buffer = map_file(logfile)
+    cache = load_cache(logfile, buffer)
+    if fields is None:
+        fields = set(COLUMNS) | {'raw_line'}
+    return list(cache.lines(buffer, (0, cache.rows), fields))
+
+
+def _parsed_lines(logfile):
+    # lines only end on new lines, as when analyzing log files
+    with open(logfile, newline='\n') as file_obj:
+        return [Line(raw_line.strip()) for raw_line in file_obj]
+
+
+def test_cached_lines_are_identical(logfile):
+    """Check that lines created out of the cache are equal to parsed ones."""
+    cached = _cached_lines(logfile)
+    parsed = _parsed_lines(logfile)
+    assert len(cached) == len(parsed)
+    for cached_line, parsed_line in zip(cached, parsed):
+        assert cached_line.is_valid is parsed_line.is_valid
+        assert cached_line.raw_line == parsed_line.raw_line
+        if not parsed_line.is_valid:
+            continue
+        for attribute in CACHED_ATTRIBUTES:
+            if attribute == 'is_https' and parsed_line.http_request_path is None:
+                continue
+            cached_value = getattr(cached_line, attribute)
+            assert cached_value == getattr(parsed_line, attribute), attribute
+            assert type(cached_value) is type(getattr(parsed_line, attribute))
+
+
+def test_cached_lines_only_fields(logfile):
+    """Check that only the attributes asked for are set."""
+    line = _cached_lines(logfile, {'status_code'})[0]
+    assert line.is_valid
+    assert line.status_code == '200'
+    assert line.server_name is None
+    assert line.raw_line is None
+
+
+def test_cache_files(logfile):
+    """Check that the cache is stored next to the log file, and loaded back."""
+    buffer = map_file(logfile)
+    cache = load_cache(logfile, buffer)
+    assert os.path.exists(f'{logfile}.cache/meta.json')
+    assert os.path.exists(f'{logfile}.cache/accept_date.col')
+
+    loaded = ColumnCache.load(logfile)
+    assert loaded.rows == cache.rows
+    # dictionaries are only read when needed
+    assert loaded._dictionaries == {}
+    assert loaded.dictionary('server_name') == cache.dictionary('server_name')
+    assert loaded.update(buffer) is False
+    assert list(loaded.column('time_wait_response')) == list(
+        cache.column('time_wait_response')
+    )
+    # strings are stored only once
+    assert len(loaded.dictionary('status_code')) < loaded.rows
+    assert 'status_code' not in _meta(logfile)
+
+
+def test_cache_extended(logfile, http_line_factory):
+    """Check that lines appended to the log file are added to the cache."""
+    buffer = map_file(logfile)
+    rows = load_cache(logfile, buffer).rows
+    with open(logfile, 'a') as file_obj:
+        file_obj.write(http_line_factory(**{**DEFAULT_DATA, 'http_status_code': '418'}).raw_line + '\n')
+        # half written line
+        file_obj.write('Dec  9 13:01:26 localhost haproxy[28029]: 127.0')
+
+    cache = load_cache(logfile, map_file(logfile))
+    assert cache.rows == rows + 1
+    lines = _cached_lines(logfile)
+    assert lines[-1].status_code == '418'
+    assert cache.dictionary('status_code').count('418') == 1
+    assert [line.raw_line for line in lines] == [
+        line.raw_line for line in _parsed_lines(logfile)
+    ][:-1]
+
+
+def test_cache_rebuilt(logfile, http_line_factory):
+    """Check that the cache is rebuilt when the log file changes."""
+    load_cache(logfile, map_file(logfile))
+    logfile.write_text(http_line_factory(**{**DEFAULT_DATA, 'http_server_name': 'new'}).raw_line + '\n')
+    cache = load_cache(logfile, map_file(logfile))
+    assert cache.rows == 1
+    assert cache.dictionary('server_name') == ['new']
+    assert _cached_lines(logfile)[0].server_name == 'new'
+
+
+def test_cache_interrupted_update(logfile, http_line_factory):
+    """Check that columns written by an interrupted update are dropped."""
+    buffer = map_file(logfile)
+    cache = load_cache(logfile, buffer)
+    rows = cache.rows
+    # columns are written, but not the metadata
+    with open(logfile, 'a') as file_obj:
+        file_obj.write(http_line_factory().raw_line + '\n')
+    cache.update(map_file(logfile))
+
+    cache = load_cache(logfile, map_file(logfile))
+    assert cache.rows == rows + 1
+    assert len(cache.column('offset')) == rows + 1
+    assert os.path.getsize(f'{logfile}.cache/offset.col') == (rows + 1) * 8
+
+
+def test_build_in_parallel(logfile, monkeypatch):
+    """Check that caches built by multiple workers are the same."""
+    buffer = map_file(logfile)
+    expected = load_cache(logfile, buffer)
+    monkeypatch.setattr('haproxy.cache.BUILD_CHUNK_SIZE', 1000)
+    cache = ColumnCache(logfile)
+    cache.update(buffer, jobs=3)
+    assert cache.rows == expected.rows
+    for name in ('offset', 'valid', 'accept_date'):
+        assert list(cache.column(name)) == list(expected.column(name))
+    lines = list(cache.lines(buffer, (0, cache.rows), {'server_name', 'raw_line'}))
+    assert [line.server_name for line in lines] == [
+        line.server_name for line in _parsed_lines(logfile)
+    ]
+
+
+def test_row_range(logfile):
+    """Check that byte offsets are converted to rows."""
+    buffer = map_file(logfile)
+    cache = load_cache(logfile, buffer)
+    offsets = list(cache.column('offset'))
+    assert cache.row_range() == (0, cache.rows)
+    assert cache.row_range(offsets[3], offsets[7]) == (3, 7)
+    assert cache.row_range(offsets[3], len(buffer)) == (3, cache.rows)
+
+
+@pytest.mark.parametrize(
+    'plan, expected',
+    [
+        (None, None),
+        (FULL_PLAN, None),
+        (Plan(Strategy.PARTIAL, ('raw_http_request',), False), None),
+        (plan_query([commands.Counter()]), set()),
+        (plan_query([commands.Print()]), {'raw_line'}),
+        (
+            plan_query([commands.IpCounter()], [filters.filter_ssl()]),
+            {'captured_request_headers', 'client_ip', 'http_request_path'},
+        ),
+        (plan_query([commands.RequestsPerMinute()]), {'accept_date'}),
+    ],
+)
+def test_cached_fields(plan, expected):
+    """Check which attributes are read out of the cache."""
+    assert cached_fields(plan) == expected
+
+
+def test_number_columns(logfile):
+    """Check that numbers kept as strings are stored as numbers, unless they
+    would not be the same strings.
+    """
+    buffer = map_file(logfile)
+    cache = load_cache(logfile, buffer)
+    parsed = _parsed_lines(logfile)
+    values = cache.column('bytes_read')
+    assert values.format == 'q'
+    assert int(parsed[0].bytes_read) == values[0]
+    assert sorted(cache.dictionary('bytes_read')) == ['+18923', '+543']
+    assert cache.dictionary('connections_active') == []
+
+
+def test_cache_not_written(logfile, monkeypatch):
+    """Check that there is no cache if it can not be written."""
+
+    def read_only(*args, **kwargs):
+        raise PermissionError('read only')
+
+    monkeypatch.setattr('haproxy.cache.os.makedirs', read_only)
+    assert load_cache(logfile, map_file(logfile)) is None
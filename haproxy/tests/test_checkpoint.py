@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+from haproxy import commands
+from haproxy.checkpoint import Checkpoint
+from haproxy.checkpoint import load_checkpoint
+from haproxy.logfile import Log
+
+import gzip
+import os
+import pytest
+
+
+LINES = 9
+
+
+@pytest.fixture
+def lines(http_line_factory):
+    return [
+        f'{http_line_factory(http_server_name=f"instance{number}").raw_line}\n'.encode()
+        for number in range(LINES)
+    ]
+
+
+def _analyze(logfiles, state_file):
+    checkpoint = load_checkpoint(state_file, 'query')
+    cmd = checkpoint.commands[0] if checkpoint.commands else commands.Counter()
+    log_file = Log(logfiles, checkpoint=checkpoint)
+    log_file.process([cmd])
+    checkpoint.commands = [cmd]
+    checkpoint.save()
+    return log_file, cmd.raw_results()
+
+
+def test_resume_appended(tmp_path, lines):
+    """Check that only the lines appended since the last time are analyzed."""
+    logfile = tmp_path / 'haproxy.log'
+    state_file = tmp_path / 'haproxy.state'
+    # the last line is being written
+    logfile.write_bytes(b''.join(lines[:3]) + lines[3][:20])
+    log_file, counter = _analyze(logfile, state_file)
+    assert (log_file.total_lines, counter) == (3, 3)
+
+    with open(logfile, 'ab') as log:
+        log.write(lines[3][20:] + b''.join(lines[4:]))
+    log_file, counter = _analyze(logfile, state_file)
+    assert (log_file.total_lines, counter) == (6, 9)
+
+    log_file, counter = _analyze(logfile, state_file)
+    assert (log_file.total_lines, counter) == (0, 9)
+
+
+def test_resume_truncated(tmp_path, lines):
+    """Check that a truncated log file is analyzed from its start."""
+    logfile = tmp_path / 'haproxy.log'
+    state_file = tmp_path / 'haproxy.state'
+    logfile.write_bytes(b''.join(lines[:5]))
+    _analyze(logfile, state_file)
+
+    with open(logfile, 'r+b') as log:
+        log.truncate(0)
+        log.write(b''.join(lines[5:7]))
+    log_file, counter = _analyze(logfile, state_file)
+    assert (log_file.total_lines, counter) == (2, 7)
+
+
+def test_resume_replaced(tmp_path, lines):
+    """Check that a log file replaced by a new one is analyzed from its start,
+    even if it is bigger.
+    """
+    logfile = tmp_path / 'haproxy.log'
+    state_file = tmp_path / 'haproxy.state'
+    logfile.write_bytes(b''.join(lines[:2]))
+    _analyze(logfile, state_file)
+
+    new_logfile = tmp_path / 'haproxy.log.new'
+    new_logfile.write_bytes(b''.join(lines[2:]))
+    os.replace(new_logfile, logfile)
+    log_file, counter = _analyze(logfile, state_file)
+    assert (log_file.total_lines, counter) == (7, 9)
+
+
+@pytest.mark.parametrize('copy', [False, True])
+def test_resume_rotated(tmp_path, lines, copy):
+    """Check that the lines written right before a log rotation are analyzed,
+    both for rotations that rename the log file, and for those that copy and
+    truncate it.
+    """
+    logfile = tmp_path / 'haproxy.log'
+    rotated = tmp_path / 'haproxy.log.1'
+    state_file = tmp_path / 'haproxy.state'
+    logfile.write_bytes(b''.join(lines[:3]))
+    _analyze([logfile], state_file)
+
+    with open(logfile, 'ab') as log:
+        log.write(b''.join(lines[3:5]))
+    if copy:
+        rotated.write_bytes(logfile.read_bytes())
+        with open(logfile, 'r+b') as log:
+            log.truncate(0)
+    else:
+        os.rename(logfile, rotated)
+    logfile.write_bytes(b''.join(lines[5:]))
+    log_file, counter = _analyze([logfile, rotated], state_file)
+    assert (log_file.total_lines, counter) == (6, 9)
+
+
+def test_resume_compressed(tmp_path, lines):
+    """Check that compressed log files are only analyzed once."""
+    logfile = tmp_path / 'haproxy.log'
+    compressed = tmp_path / 'haproxy.log.1.gz'
+    state_file = tmp_path / 'haproxy.state'
+    compressed.write_bytes(gzip.compress(b''.join(lines[:4])))
+    logfile.write_bytes(b''.join(lines[4:6]))
+    log_file, counter = _analyze([compressed, logfile], state_file)
+    assert (log_file.total_lines, counter) == (6, 6)
+
+    with open(logfile, 'ab') as log:
+        log.write(b''.join(lines[6:]))
+    log_file, counter = _analyze([compressed, logfile], state_file)
+    assert (log_file.total_lines, counter) == (3, 9)
+
+
+def test_load_missing_or_broken(tmp_path):
+    """Check that state files that can not be read are ignored."""
+    state_file = tmp_path / 'haproxy.state'
+    assert Checkpoint.load(state_file) is None
+    state_file.write_bytes(b'not a pickle')
+    assert Checkpoint.load(state_file) is None
+    checkpoint = load_checkpoint(state_file, 'query')
+    assert checkpoint.commands is None
+    assert checkpoint.files == []
+
+
+def test_load_other_query(tmp_path):
+    """Check that a state file can not be resumed by another query."""
+    state_file = tmp_path / 'haproxy.state'
+    Checkpoint(state_file, 'query').save()
+    assert load_checkpoint(state_file, 'query').query == 'query'
+    with pytest.raises(ValueError) as exception_info:
+        load_checkpoint(state_file, 'other query')
+    assert 'remove it to start over' in str(exception_info)
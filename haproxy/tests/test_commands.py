@@ -708,6 +708,45 @@ def test_requests_per_minute_output(http_line_factory, capsys, output):
         assert ':00: 1\n- ' in output_text
 
 
+def test_requests_per_minute_report(http_line_factory, capsys):
+    """Check that only the minutes that are over are reported, and only once."""
+    cmd = commands.RequestsPerMinute()
+    cmd.report()
+    assert capsys.readouterr().out == ''
+
+    for date in ('12:00:10', '12:00:50', '12:01:20'):
+        cmd(http_line_factory(accept_date=f'09/Dec/2013:{date}.000'))
+    cmd.report()
+    output_text = capsys.readouterr().out
+    assert '2013-12-09T12:00:00: 2\n' in output_text
+    assert '12:01' not in output_text
+
+    cmd.report()
+    assert capsys.readouterr().out == ''
+
+    cmd(http_line_factory(accept_date='09/Dec/2013:12:02:00.000'))
+    cmd.report()
+    output_text = capsys.readouterr().out
+    assert '2013-12-09T12:01:00: 1\n' in output_text
+    assert '12:00' not in output_text
+    assert '12:02' not in output_text
+
+    # all windows are still given on the results
+    cmd.results()
+    output_text = capsys.readouterr().out
+    assert '12:00:00: 2\n' in output_text
+    assert '12:01:00: 1\n' in output_text
+    assert '12:02:00: 1\n' in output_text
+
+
+def test_report(capsys):
+    """Check that commands report all their results by default."""
+    cmd = commands.Counter()
+    cmd.counter = 3
+    cmd.report()
+    assert 'COUNTER\n=======\n3\n' in capsys.readouterr().out
+
+
 def test_requests_per_hour_results(http_line_factory):
     """Test the RequestsPerHour command.
 
@@ -782,3 +821,70 @@ def test_print_results_and_output(http_line_factory, capsys):
     assert '/first-thing-to-do' in lines[0]
     assert '/second/thing/to-do' in lines[1]
     assert lines[2] == ''
+
+
+@pytest.mark.parametrize(
+    'klass',
+    [
+        commands.Counter,
+        commands.HttpMethods,
+        commands.IpCounter,
+        commands.TopIps,
+        commands.StatusCodesCounter,
+        commands.RequestPathCounter,
+        commands.TopRequestPaths,
+        commands.SlowRequests,
+        commands.SlowRequestsCounter,
+        commands.AverageResponseTime,
+        commands.AverageWaitingTime,
+        commands.ServerLoad,
+        commands.QueuePeaks,
+        commands.ConnectionType,
+        commands.RequestsPerMinute,
+        commands.RequestsPerHour,
+    ],
+)
+def test_merge_partial_results(http_line_factory, klass):
+    """Check that merging partial commands gives the same results as a single one."""
+    lines = []
+    for index in range(12):
+        lines.append(
+            http_line_factory(
+                accept_date=f'09/Dec/2013:1{index % 3}:{index * 4:02d}:46.633',
+                http_request=f'{("GET", "POST")[index % 2]} /path/{index % 5} HTTP/1.1',
+                headers=f' {{1.2.3.{index % 4}}}',
+                http_status_code=f'{index % 3 + 2}00',
+                http_server_name=f'instance{index % 3}',
+                Tw=index * 10,
+                Tr=index * 300,
+                backend_queue=index % 4,
+            )
+        )
+
+    cmd = klass()
+    for line in lines:
+        cmd(line)
+
+    merged = klass()
+    for part in (lines[:5], lines[5:6], lines[6:]):
+        partial = merged.partial()
+        for line in part:
+            partial(line)
+        merged.merge(partial)
+
+    assert merged.raw_results() == cmd.raw_results()
+
+
+def test_merge_print(http_line_factory, capsys):
+    """Check that partial print commands keep the lines until merged."""
+    cmd = commands.Print()
+    partial = cmd.partial()
+    for path in ('/first-thing-to-do', '/second/thing/to-do'):
+        partial(http_line_factory(http_request=f'GET {path} HTTP/1.1'))
+    assert capsys.readouterr().out == ''
+
+    cmd.merge(partial)
+    lines = capsys.readouterr().out.split('\n')
+    assert len(lines) == 3
+    assert '/first-thing-to-do' in lines[0]
+    assert '/second/thing/to-do' in lines[1]
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+from haproxy import filters
+from haproxy.expressions import And
+from haproxy.expressions import Constant
+from haproxy.expressions import Expression
+from haproxy.expressions import Filter
+from haproxy.expressions import is_expression
+from haproxy.expressions import Not
+from haproxy.expressions import optimize
+from haproxy.expressions import Or
+from haproxy.expressions import parse_expression
+
+import itertools
+import pickle
+import pytest
+
+
+SSL = Filter('ssl')
+API = Filter('backend', 'api')
+WEB = Filter('backend', 'web')
+ERRORS = Filter('status_code_family', '5')
+
+
+def _value(node, values):
+    """Value of a tree, given the values of its filters."""
+    if isinstance(node, Constant):
+        return node.value
+    if isinstance(node, Filter):
+        return values[node]
+    if isinstance(node, Not):
+        return not _value(node.operand, values)
+    operands = [_value(operand, values) for operand in node.operands]
+    return all(operands) if isinstance(node, And) else any(operands)
+
+
+@pytest.mark.parametrize(
+    'text, expected',
+    [
+        ('ssl', SSL),
+        ('ssl and backend[api]', And([SSL, API])),
+        ('ssl,backend[api]', And([SSL, API])),
+        ('ssl or backend[api] and backend[web]', Or([SSL, And([API, WEB])])),
+        ('(ssl or backend[api]) and backend[web]', And([Or([SSL, API]), WEB])),
+        ('not ssl and backend[api]', And([Not(SSL), API])),
+        ('not (ssl and backend[api])', Not(And([SSL, API]))),
+        ('not not ssl', Not(Not(SSL))),
+        ('true or false', Or([Constant(True), Constant(False)])),
+        ('notable_filter_name_is_not_a_keyword[1]', None),
+        ('path[/and or not (x)]', Filter('path', '/and or not (x)')),
+        ('ip_range[10.0.0.0/8,192.168.1]', Filter('ip_range', '10.0.0.0/8,192.168.1')),
+    ],
+)
+def test_parse_expression(text, expected):
+    """Check precedence (not, and, or), parentheses and filter arguments."""
+    if expected is None:
+        with pytest.raises(ValueError) as exception_info:
+            parse_expression(text)
+        assert 'is not available' in str(exception_info)
+    else:
+        assert parse_expression(text) == expected
+
+
+@pytest.mark.parametrize(
+    'text, message',
+    [
+        ('ssl and', 'incomplete'),
+        ('(ssl', 'incomplete'),
+        ('', 'incomplete'),
+        ('ssl)', 'at ")"'),
+        ('ssl ssl', 'at "ssl"'),
+        ('ssl and ! ssl', 'at "! ssl"'),
+        ('potato or ssl', 'filter "potato" is not available'),
+    ],
+)
+def test_parse_expression_not_valid(text, message):
+    with pytest.raises(ValueError) as exception_info:
+        parse_expression(text)
+    assert message in str(exception_info)
+
+
+@pytest.mark.parametrize(
+    'text, expected',
+    [
+        ('ssl and true', SSL),
+        ('ssl and false', Constant(False)),
+        ('ssl or true', Constant(True)),
+        ('not true or ssl', SSL),
+        ('not not ssl', SSL),
+        ('ssl and ssl', SSL),
+        ('ssl and not ssl', Constant(False)),
+        ('ssl or not ssl', Constant(True)),
+        ('ssl and (backend[api] and ssl)', And([SSL, API])),
+        ('(backend[api] and ssl) or (backend[api] and backend[web])', None),
+        ('backend[api] or (backend[api] and ssl)', API),
+        ('(ssl or backend[api]) and (backend[web] or ssl)', None),
+    ],
+)
+def test_optimize(text, expected):
+    """Check that constants are folded, repeated subexpressions evaluated
+    once, and the expression still tells the same.
+    """
+    tree = parse_expression(text)
+    optimized = optimize(tree, lambda node: 0)
+    if expected is not None:
+        assert optimized == expected
+    leaves = [SSL, API, WEB]
+    for values in itertools.product([False, True], repeat=len(leaves)):
+        values = dict(zip(leaves, values))
+        assert _value(optimized, values) is _value(tree, values)
+
+
+def test_optimize_factor():
+    """Check that operands shared by all the operands of an or are taken out
+    of it.
+    """
+    tree = parse_expression('(backend[api] and ssl) or (backend[api] and backend[web])')
+    assert optimize(tree, lambda node: 0) == And([API, Or([SSL, WEB])])
+    tree = parse_expression('(ssl or backend[api]) and (backend[web] or ssl)')
+    assert optimize(tree, lambda node: 0) == Or([SSL, And([API, WEB])])
+
+
+def test_optimize_order():
+    """Check that operands are sorted by cost, cheap ones first."""
+    costs = {SSL: 3, API: 1, ERRORS: 2}
+    tree = parse_expression('ssl and status_code_family[5] and backend[api]')
+    optimized = optimize(tree, lambda node: costs.get(node, 0))
+    assert optimized == And([API, ERRORS, SSL])
+
+
+def test_expression():
+    """Check the fields, cost and raw text of an expression, and that every
+    filter is created once.
+    """
+    expression = Expression(
+        'status_code[200] and (backend[api] or backend[web]) and backend[api]'
+        ' or status_code[200] and path[/images]'
+    )
+    assert expression.fields == ('backend_name', 'http_request_path', 'status_code')
+    assert len(expression.filters) == 4
+    # status_code[200] and (backend[api] or path[/images])
+    assert expression.tree == And(
+        [
+            Filter('status_code', '200'),
+            Or([API, Filter('path', '/images')]),
+        ]
+    )
+    assert expression.raw_text == b'200'
+    assert expression.cost == 1 + 1 + 5
+
+
+@pytest.mark.parametrize(
+    'status, backend, path, result',
+    [
+        ('500', 'api', '/', True),
+        ('500', 'web', '/', True),
+        ('500', 'web', '/internal', False),
+        ('502', 'other', '/', False),
+        ('200', 'api', '/', False),
+    ],
+)
+def test_filter_expression(http_line_factory, status, backend, path, result):
+    """Check that lines are filtered by an expression, on its own and
+    compiled with other filters.
+    """
+    current_filter = filters.filter_expression(
+        'status_code_family[5] and (backend[api] or backend[web])'
+        ' and not path[/internal]'
+    )
+    line = http_line_factory(
+        http_status_code=status,
+        http_backend_name=backend,
+        http_request=f'GET {path} HTTP/1.1',
+    )
+    assert current_filter(line) is result
+    predicate = filters.compile_filters((filters.filter_ssl(), current_filter), True)
+    assert predicate(line) is True
+    predicate = filters.compile_filters((current_filter,))
+    assert predicate(line) is result
+    assert pickle.loads(pickle.dumps(current_filter))(line) is result
+
+
+@pytest.mark.parametrize(
+    'text, expected',
+    [
+        ('ssl', False),
+        ('ssl,path[/brand/notes]', False),
+        ('ip_range[@/or/and.txt]', False),
+        ('ssl or backend[api]', True),
+        ('not ssl', True),
+        ('(ssl)', True),
+        ('ssl,true', True),
+    ],
+)
+def test_is_expression(text, expected):
+    """Check that expressions are told apart from lists of filters."""
+    assert is_expression(text) is expected
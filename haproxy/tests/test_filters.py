@@ -30,6 +30,16 @@ def test_filter_ip(http_line_factory, to_filter, to_check, result):
         ('2001:db8', '2001:db8::8a2e:370:7334', True),
         ('2001:db8', '2001:db8::8a2e:456:7321', True),
         ('2134:db8', '2001:db8::8a2e:456:7321', False),
+        ('10.1', '10.100.1.1', False),
+        ('10.1', '10.1.100.1', True),
+        ('10.0.0.0/8', '10.100.1.1', True),
+        ('10.0.0.0/8', '110.1.1.1', False),
+        ('172.16.0.0/12', '172.31.255.255', True),
+        ('172.16.0.0/12', '172.32.0.0', False),
+        ('2001:db8::/32', '2001:db8::8a2e:370:7334', True),
+        ('192.168.0.0/16,10.0.0.0/8', '10.2.3.4', True),
+        ('192.168.0.0/16, 2001:db8::/32', '2001:db8::1', True),
+        ('192.168.0.0/16,10.0.0.0/8', '11.2.3.4', False),
     ],
 )
 def test_filter_ip_range(http_line_factory, to_filter, to_check, result):
@@ -210,3 +220,267 @@ def test_filter_response_size(http_line_factory, to_filter, to_check, result):
     current_filter = filters.filter_response_size(to_filter)
     line = http_line_factory(http_bytes_read=to_check)
     assert current_filter(line) is result
+
+
+def test_filters_arguments_converted():
+    """Check that numeric arguments are converted once, when filters are
+    created.
+    """
+    assert filters.filter_slow_requests('10000').args == (10000,)
+    assert filters.filter_wait_on_queues('50').args == (50,)
+
+
+def test_compile_filters_order():
+    """Check that cheap and selective filters are evaluated first, and that
+    filters of the same rank keep their order.
+    """
+    to_compile = (
+        filters.filter_path('/image'),
+        filters.filter_ssl(),
+        filters.filter_slow_requests('100'),
+        filters.filter_backend('api'),
+        filters.filter_status_code('200'),
+    )
+    predicate = filters.compile_filters(to_compile)
+    assert predicate.order == (3, 4, 2, 1, 0)
+    assert predicate.fields == (
+        'backend_name',
+        'http_request_path',
+        'is_https',
+        'status_code',
+        'time_wait_response',
+    )
+
+
+@pytest.mark.parametrize('negate', [False, True])
+@pytest.mark.parametrize(
+    'status, path, tr',
+    [
+        ('200', '/image:443/big', 13000),
+        ('200', '/image/big', 13000),
+        ('404', '/image:443/big', 13000),
+        ('200', '/image:443/big', 45),
+        ('200', '/other:443', 13000),
+    ],
+)
+def test_compile_filters(http_line_factory, negate, status, path, tr):
+    """Check that a compiled predicate tells the same as all of its
+    filters.
+    """
+    line = http_line_factory(
+        http_status_code=status, http_request=f'GET {path} HTTP/1.1', Tr=tr
+    )
+    to_compile = (
+        filters.filter_path('/image'),
+        filters.filter_ssl(),
+        filters.filter_slow_requests('10000'),
+        filters.filter_status_code('200'),
+    )
+    predicate = filters.compile_filters(to_compile, negate)
+    expected = all(f(line) for f in to_compile) is not negate
+    assert predicate(line) is expected
+
+
+@pytest.mark.parametrize('negate, result', [(False, True), (True, False)])
+def test_compile_no_filters(http_line_factory, negate, result):
+    """Check that without filters all lines pass, or none if negated."""
+    predicate = filters.compile_filters((), negate)
+    assert predicate(http_line_factory()) is result
+
+
+def test_compile_unknown_filters(http_line_factory):
+    """Check that filters that can not be inlined are called, last."""
+    seen = []
+
+    def custom(line):
+        seen.append(line)
+        return True
+
+    predicate = filters.compile_filters((custom, filters.filter_ip('1.2.3.4')))
+    assert predicate.order == (1, 0)
+    assert predicate(http_line_factory(headers=' {1.2.3.4}')) is True
+    assert predicate(http_line_factory(headers=' {4.3.2.1}')) is False
+    assert len(seen) == 1
+
+
+@pytest.mark.parametrize(
+    'to_compile, expected',
+    [
+        ((filters.filter_backend('api'),), (b'api/',)),
+        ((filters.filter_server('web1'),), (b'/web1',)),
+        (
+            (filters.filter_status_code('503'), filters.filter_path('/images')),
+            (b'/images', b'503'),
+        ),
+        ((filters.filter_path('val'),), ()),
+        ((filters.filter_http_method('invalid'),), ()),
+        ((filters.filter_slow_requests('100'), filters.filter_ssl()), (b':443',)),
+        ((filters.filter_ip_range('10.0.0.0/8'),), (b'10.',)),
+        ((filters.filter_ip_range('10.1.2.3'),), (b'10.1.2.3',)),
+        ((filters.filter_ip_range('10.0.0.0/9'),), ()),
+        ((filters.filter_ip_range('10.0.0.0/8,11.0.0.0/8'),), ()),
+        ((filters.filter_ips('10.1.2.3'),), (b'10.1.2.3',)),
+        ((filters.filter_ips('10.1.2.3,10.1.2.4'),), ()),
+        ((filters.filter_status_codes('503'),), (b'503',)),
+        ((filters.filter_http_methods('GET,POST'),), ()),
+    ],
+)
+def test_raw_texts(to_compile, expected):
+    """Check the raw texts that lines need to pass the filters: none for
+    the values lines with bad HTTP requests get.
+    """
+    assert filters.raw_texts(to_compile) == expected
+
+
+@pytest.mark.parametrize(
+    'to_filter, arguments',
+    [
+        (filters.filter_ip, ('1.2.3.4', '4.3.2.1')),
+        (filters.filter_ip_range, ('1.2', '4.3')),
+        (filters.filter_ips, ('1.2.3.4', '4.3.2.1')),
+        (filters.filter_status_codes, ('200', '404')),
+        (filters.filter_http_methods, ('GET', 'POST')),
+        (filters.filter_path, ('/image', '/other')),
+        (filters.filter_status_code, ('200', '404')),
+        (filters.filter_http_method, ('GET', 'POST')),
+        (filters.filter_backend, ('default', 'other')),
+        (filters.filter_frontend, ('loadbalancer', 'other')),
+        (filters.filter_server, ('instance1', 'other')),
+    ],
+)
+def test_raw_text_necessary(http_line_factory, to_filter, arguments):
+    """Check that every line that passes a filter contains its raw text."""
+    line = http_line_factory(
+        headers=' {1.2.3.4}',
+        http_request='GET /image HTTP/1.1',
+        http_server_names='loadbalancer default/instance1',
+    )
+    for argument in arguments:
+        current_filter = to_filter(argument)
+        if current_filter(line):
+            assert current_filter.raw_text in line.raw_line.encode('utf-8')
+
+
+def test_filter_ip_range_file(tmp_path, http_line_factory):
+    """Check that IP ranges are read from a file, one per line."""
+    ranges_file = tmp_path / 'ranges.txt'
+    ranges_file.write_text('# offices\n192.168.0.0/16\n\n10.1\n')
+    current_filter = filters.filter_ip_range(f'@{ranges_file}')
+    for ip, result in (('10.1.2.3', True), ('192.168.9.9', True), ('1.1.1.1', False)):
+        line = http_line_factory(headers=f' {{{ip}}}')
+        assert current_filter(line) is result
+
+
+def test_filter_ip_range_not_valid():
+    """Check that IP ranges that are not networks are reported."""
+    with pytest.raises(ValueError) as exception_info:
+        filters.filter_ip_range('10.0.0.0/8,lala')
+    assert '"lala" is not an IP network' in str(exception_info)
+
+
+@pytest.mark.parametrize(
+    'to_filter, to_check, result',
+    [
+        ('1.2.3.4', '1.2.3.4', True),
+        ('1.2.3.4,5.6.7.8', '5.6.7.8', True),
+        ('1.2.3.4, 2001:db8::1', '2001:db8::1', True),
+        ('1.2.3.4,5.6.7.8', '1.2.3.5', False),
+        ('1.2.3.4,5.6.7.8', '2001:db8::1', False),
+    ],
+)
+def test_filter_ips(http_line_factory, to_filter, to_check, result):
+    """Check that lines with any of the IPs pass filter_ips."""
+    current_filter = filters.filter_ips(to_filter)
+    line = http_line_factory(headers=f' {{{to_check}}}')
+    assert current_filter(line) is result
+    predicate = filters.compile_filters((current_filter,))
+    assert predicate(line) is result
+
+
+def test_filter_ips_file(tmp_path, http_line_factory):
+    """Check that IPs are read from a file, one per line."""
+    ips_file = tmp_path / 'ips.txt'
+    ips_file.write_text(
+        '# blocklist\n' + ''.join(f'10.0.{n // 256}.{n % 256}\n' for n in range(5000))
+    )
+    current_filter = filters.filter_ips(f'@{ips_file}')
+    assert current_filter.raw_text is None
+    for ip, result in (
+        ('10.0.0.0', True),
+        ('10.0.19.135', True),
+        ('10.0.19.136', False),
+    ):
+        line = http_line_factory(headers=f' {{{ip}}}')
+        assert current_filter(line) is result
+
+
+def test_filter_ips_not_valid():
+    """Check that values that are not IPs are reported."""
+    with pytest.raises(ValueError) as exception_info:
+        filters.filter_ips('1.2.3.4,10.0.0')
+    assert '"10.0.0" is not an IP' in str(exception_info)
+
+
+@pytest.mark.parametrize(
+    'to_filter, to_check, result',
+    [
+        ('200', '200', True),
+        ('404,500,502', '502', True),
+        ('404, 500, 502', '500', True),
+        ('404,500,502', '200', False),
+    ],
+)
+def test_filter_status_codes(http_line_factory, to_filter, to_check, result):
+    """Check that lines with any of the status codes pass filter_status_codes."""
+    current_filter = filters.filter_status_codes(to_filter)
+    line = http_line_factory(http_status_code=to_check)
+    assert current_filter(line) is result
+    predicate = filters.compile_filters((current_filter,))
+    assert predicate(line) is result
+
+
+@pytest.mark.parametrize(
+    'to_filter, to_check, result',
+    [
+        ('GET', 'GET', True),
+        ('PUT,PATCH,DELETE', 'PATCH', True),
+        ('PUT,PATCH,DELETE', 'GET', False),
+    ],
+)
+def test_filter_http_methods(http_line_factory, to_filter, to_check, result):
+    """Check that lines with any of the HTTP methods pass filter_http_methods."""
+    current_filter = filters.filter_http_methods(to_filter)
+    line = http_line_factory(http_request=f'{to_check} /path HTTP/1.1')
+    assert current_filter(line) is result
+    predicate = filters.compile_filters((current_filter,))
+    assert predicate(line) is result
+
+
+def test_filter_status_codes_file(tmp_path, http_line_factory):
+    """Check that status codes are read from a file, one per line."""
+    codes_file = tmp_path / 'codes.txt'
+    codes_file.write_text('# errors\n500\n\n502\n503\n')
+    current_filter = filters.filter_status_codes(f'@{codes_file}')
+    assert current_filter.args[0] == frozenset(('500', '502', '503'))
+    assert current_filter(http_line_factory(http_status_code='503')) is True
+    assert current_filter(http_line_factory(http_status_code='504')) is False
+
+
+@pytest.mark.parametrize(
+    'path, result',
+    [
+        ('/api/v1/users/3', True),
+        ('/static/.env', True),
+        ('/api/v2/users', False),
+        ('/wp-admin/index.php', True),
+    ],
+)
+def test_filter_paths(tmp_path, http_line_factory, path, result):
+    """Check that paths with any of the parts of paths of a file pass."""
+    paths_file = tmp_path / 'paths.txt'
+    paths_file.write_text('/api/v1/\n/.env\n# scanners\n/wp-admin\n')
+    current_filter = filters.filter_paths(f'@{paths_file}')
+    line = http_line_factory(http_request=f'GET {path} HTTP/1.1')
+    assert current_filter(line) is result
+    predicate = filters.compile_filters((current_filter,))
+    assert predicate(line) is result
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+from haproxy import commands
+from haproxy.follow import FollowedFile
+from haproxy.follow import InotifyWatcher
+from haproxy.follow import PollingWatcher
+from haproxy.follow import watch
+from haproxy.logfile import Log
+
+import os
+import pytest
+import sys
+import time
+
+
+@pytest.fixture
+def logfile(tmp_path):
+    file_path = tmp_path / 'haproxy.log'
+    file_path.write_bytes(b'old line\n')
+    return file_path
+
+
+def _append(file_path, data):
+    with open(file_path, 'ab') as file_obj:
+        file_obj.write(data)
+
+
+def test_followed_file(logfile):
+    """Check that only new and whole lines are read."""
+    followed = FollowedFile(logfile)
+    assert followed.read() == b''
+    _append(logfile, b'line 1\nline 2\nline')
+    assert followed.read() == b'line 1\nline 2\n'
+    assert followed.read() == b''
+    _append(logfile, b' 3\n')
+    assert followed.read() == b'line 3\n'
+    followed.close()
+
+
+def test_followed_file_from_start(logfile):
+    followed = FollowedFile(logfile, from_start=True)
+    assert followed.read() == b'old line\n'
+    followed.close()
+
+
+@pytest.mark.parametrize('remove', [False, True])
+def test_followed_file_rotated(logfile, remove):
+    """Check that the rest of a rotated log file is read, and then the new one."""
+    followed = FollowedFile(logfile)
+    _append(logfile, b'line 1\nline')
+    assert followed.read() == b'line 1\n'
+    _append(logfile, b' 2\nlast')
+    if remove:
+        os.remove(logfile)
+    else:
+        os.rename(logfile, f'{logfile}.1')
+    # the new log file is not there yet: only whole lines are read
+    assert followed.read() == b'line 2\n'
+    logfile.write_bytes(b'new 1\n')
+    # the rest of the old log file, its last line even if not finished
+    assert followed.read() == b'last'
+    assert followed.read() == b'new 1\n'
+    followed.close()
+
+
+def test_followed_file_truncated(logfile):
+    """Check that a truncated log file is read from its start."""
+    followed = FollowedFile(logfile)
+    _append(logfile, b'line 1\n')
+    assert followed.read() == b'line 1\n'
+    with open(logfile, 'r+b') as file_obj:
+        file_obj.truncate(0)
+    _append(logfile, b'new\n')
+    assert followed.read() == b'new\n'
+    followed.close()
+
+
+def test_followed_file_read_size(logfile):
+    """Check that it can be read in blocks, even with longer lines."""
+    followed = FollowedFile(logfile)
+    _append(logfile, b'line 1\nline 2\na much longer line\nline 4\n')
+    assert followed.read(10) == b'line 1\n'
+    assert followed.read(10) == b'line 2\n'
+    assert followed.read(10) == b'a much longer line\n'
+    assert followed.read(10) == b'line 4\n'
+    followed.close()
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason='only on Linux')
+def test_inotify_watcher(logfile):
+    """Check that inotify tells when log files change."""
+    watcher = watch([logfile])
+    assert isinstance(watcher, InotifyWatcher)
+    begin = time.monotonic()
+    watcher.wait(0.05)
+    assert time.monotonic() - begin >= 0.04
+
+    _append(logfile, b'line\n')
+    begin = time.monotonic()
+    watcher.wait(10)
+    assert time.monotonic() - begin < 5
+    watcher.close()
+
+
+def test_polling_watcher(monkeypatch):
+    """Check that polling waits at most the polling interval."""
+    monkeypatch.setattr('haproxy.follow.POLL_INTERVAL', 0.01)
+    begin = time.monotonic()
+    PollingWatcher().wait(10)
+    assert time.monotonic() - begin < 5
+
+
+def test_watch_without_inotify(logfile, monkeypatch):
+    """Check that it falls back to polling if inotify is not available."""
+
+    def no_inotify(paths):
+        raise OSError('inotify is not available')
+
+    monkeypatch.setattr('haproxy.follow.InotifyWatcher', no_inotify)
+    assert isinstance(watch([logfile]), PollingWatcher)
+
+
+def test_log_follow_lines(logfile, http_line_factory):
+    """Check that a report is due every time enough lines are written."""
+    line = f'{http_line_factory().raw_line}\n'.encode()
+    cmd = commands.Counter()
+    log_file = Log(logfile)
+    reports = log_file.follow([cmd], lines=3)
+
+    _append(logfile, line * 2)
+    _append(logfile, b'invalid\n')
+    next(reports)
+    assert cmd.raw_results() == 2
+    assert (log_file.valid_lines, log_file.invalid_lines) == (2, 1)
+
+    _append(logfile, line * 4)
+    next(reports)
+    assert cmd.raw_results() == 6
+    reports.close()
+
+
+def test_log_follow_interval(logfile, http_line_factory):
+    """Check that a report is due every interval, even without new lines."""
+    cmd = commands.ServerLoad()
+    log_file = Log(logfile)
+    reports = log_file.follow([cmd], [lambda line: True], interval=0.05)
+    begin = time.monotonic()
+    next(reports)
+    assert time.monotonic() - begin >= 0.04
+    assert cmd.raw_results() == {}
+
+    _append(logfile, f'{http_line_factory().raw_line}\n'.encode())
+    next(reports)
+    assert cmd.raw_results() == {'instance8': 1}
+    reports.close()
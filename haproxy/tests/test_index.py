@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime
+from datetime import timedelta
+from haproxy.index import build_index
+from haproxy.index import date_to_minute
+from haproxy.index import load_index
+from haproxy.index import minute_to_date
+from haproxy.index import TimeIndex
+from haproxy.readers import map_file
+
+import os
+import pytest
+
+
+def _write_lines(file_path, http_line_factory, minutes, mode='w'):
+    """Write log lines, one for every given (hour, minute)."""
+    lines = [
+        http_line_factory(accept_date=f'09/Dec/2013:{hour:02}:{minute:02}:30.000')
+        .raw_line
+        for hour, minute in minutes
+    ]
+    with open(file_path, mode) as file_obj:
+        file_obj.write(''.join(f'{line}\n' for line in lines))
+    return lines
+
+
+def _offsets(file_path):
+    with open(file_path, 'rb') as file_obj:
+        data = file_obj.read()
+    return [0] + [index + 1 for index, byte in enumerate(data) if byte == 10]
+
+
+@pytest.fixture
+def logfile(tmp_path, http_line_factory):
+    file_path = tmp_path / 'haproxy.log'
+    _write_lines(
+        file_path,
+        http_line_factory,
+        [(12, 0), (12, 0), (12, 1), (12, 3), (12, 3), (12, 3), (14, 0), (14, 1)],
+    )
+    return file_path
+
+
+def test_minutes():
+    """Check that dates are converted to minutes and back."""
+    date = datetime(2013, 12, 9, 12, 59, 46, 633)
+    minute = date_to_minute(date)
+    assert minute_to_date(minute) == datetime(2013, 12, 9, 12, 59)
+    assert date_to_minute(date + timedelta(seconds=14)) == minute + 1
+
+
+def test_build_index(logfile):
+    """Check that the first line of every minute is indexed."""
+    index = build_index(logfile)
+    offsets = _offsets(logfile)
+    assert [minute_to_date(minute) for minute in index.minutes] == [
+        datetime(2013, 12, 9, 12, 0),
+        datetime(2013, 12, 9, 12, 1),
+        datetime(2013, 12, 9, 12, 3),
+        datetime(2013, 12, 9, 14, 0),
+        datetime(2013, 12, 9, 14, 1),
+    ]
+    assert index.offsets == [offsets[0], offsets[2], offsets[3], offsets[6], offsets[7]]
+    assert index.indexed == os.path.getsize(logfile)
+
+    saved = TimeIndex.load(logfile)
+    assert saved.minutes == index.minutes
+    assert saved.offsets == index.offsets
+    assert saved.identity == index.identity
+
+
+@pytest.mark.parametrize(
+    'start, end, expected',
+    [
+        ((12, 0), (12, 1), (0, 3)),
+        ((12, 2), (12, 3), (2, 6)),
+        ((12, 3), None, (3, None)),
+        ((13, 0), (13, 30), (3, 6)),
+        ((11, 0), (11, 30), (0, 0)),
+        ((15, 0), None, (7, None)),
+    ],
+)
+def test_window(logfile, start, end, expected):
+    """Check that the byte range covers the whole minutes of the time frame."""
+    index = build_index(logfile)
+    offsets = _offsets(logfile)
+    start = datetime(2013, 12, 9, *start)
+    if end is not None:
+        end = datetime(2013, 12, 9, *end)
+    expected_start, expected_end = expected
+    if expected_end is not None:
+        expected_end = offsets[expected_end]
+    assert index.window(start, end) == (offsets[expected_start], expected_end)
+
+
+def test_window_tolerance(logfile):
+    """Check that the tolerance widens the byte range."""
+    index = build_index(logfile)
+    offsets = _offsets(logfile)
+    start = datetime(2013, 12, 9, 12, 3)
+    end = datetime(2013, 12, 9, 12, 3, 30)
+    assert index.window(start, end) == (offsets[3], offsets[6])
+    tolerance = timedelta(minutes=2)
+    assert index.window(start, end, tolerance) == (offsets[2], offsets[6])
+
+
+def test_update_appended(logfile, http_line_factory):
+    """Check that the index is extended when lines are appended."""
+    index = build_index(logfile)
+    indexed = index.indexed
+    _write_lines(logfile, http_line_factory, [(14, 1), (14, 5)], mode='a')
+    # a half written line is not indexed
+    with open(logfile, 'a') as file_obj:
+        file_obj.write('Dec  9 13:01:26 localhost haproxy[28029]: 127.0')
+
+    updated = load_index(logfile, map_file(logfile))
+    offsets = _offsets(logfile)
+    assert updated.minutes[:5] == index.minutes
+    assert updated.offsets == index.offsets + [offsets[9]]
+    assert updated.indexed == offsets[10]
+    assert updated.indexed > indexed
+    assert TimeIndex.load(logfile).offsets == updated.offsets
+
+    # nothing changed since
+    assert updated.update(map_file(logfile)) is False
+
+
+def test_update_replaced(logfile, http_line_factory, tmp_path):
+    """Check that the index is rebuilt when the log file is replaced."""
+    build_index(logfile)
+    new_logfile = tmp_path / 'new.log'
+    _write_lines(new_logfile, http_line_factory, [(18, 0), (18, 2)])
+    os.replace(new_logfile, logfile)
+
+    index = build_index(logfile)
+    assert [minute_to_date(minute).hour for minute in index.minutes] == [18, 18]
+    assert index.offsets == _offsets(logfile)[:2]
+
+
+def test_update_truncated(logfile, http_line_factory):
+    """Check that the index is rebuilt when the log file is truncated."""
+    build_index(logfile)
+    _write_lines(logfile, http_line_factory, [(18, 0)])
+    index = build_index(logfile)
+    assert [minute_to_date(minute).hour for minute in index.minutes] == [18]
+
+
+def test_update_rewritten(logfile, http_line_factory):
+    """Check that the index is rebuilt when the log file is rewritten in place."""
+    build_index(logfile)
+    _write_lines(logfile, http_line_factory, [(18, minute) for minute in range(20)])
+    index = build_index(logfile)
+    assert len(index.minutes) == 20
+
+
+def test_load_invalid_index(logfile):
+    """Check that unreadable indexes are ignored."""
+    assert TimeIndex.load(logfile) is None
+    with open(f'{logfile}.idx', 'w') as index_file:
+        index_file.write('{not json')
+    assert TimeIndex.load(logfile) is None
+    with open(f'{logfile}.idx', 'w') as index_file:
+        index_file.write('{"version": 0}')
+    assert TimeIndex.load(logfile) is None
+
+
+def test_save_interrupted(logfile, monkeypatch):
+    """Check that an index interrupted while being saved leaves the previous
+    one in place.
+    """
+    index = build_index(logfile)
+
+    def dump(data, index_file):
+        index_file.write('{"version": ')
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr('haproxy.index.json.dump', dump)
+    index.minutes = []
+    with pytest.raises(KeyboardInterrupt):
+        index.save()
+    assert len(TimeIndex.load(logfile).minutes) == 5
+
+
+def test_read_only_folder(logfile, monkeypatch):
+    """Check that indexes that can not be saved are still used."""
+
+    def save(self):
+        raise PermissionError
+
+    monkeypatch.setattr(TimeIndex, 'save', save)
+    index = load_index(logfile, map_file(logfile))
+    assert len(index.minutes) == 5
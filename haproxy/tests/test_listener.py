@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+from haproxy import commands
+from haproxy.listener import SyslogListener
+from haproxy.logfile import Log
+
+import pytest
+import socket
+import time
+
+
+def _wait_for(listener, lines):
+    """Read the batches of the listener until it got this many lines."""
+    data = b''
+    deadline = time.monotonic() + 10
+    while data.count(b'\n') < lines and time.monotonic() < deadline:
+        listener.wait(0.1)
+        data += listener.read()
+    return data
+
+
+@pytest.fixture
+def listener():
+    listener = SyslogListener(udp=('127.0.0.1', 0), tcp=('127.0.0.1', 0))
+    listener.start()
+    yield listener
+    listener.close()
+
+
+def test_listener_udp(listener):
+    """Check that datagrams are received, without their syslog priority."""
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sender:
+        sender.sendto(b'<134>line 1', listener.udp_address)
+        sender.sendto(b'<134>line 2\n<134>line 3\n', listener.udp_address)
+    assert _wait_for(listener, 3) == b'line 1\nline 2\nline 3\n'
+    assert listener.received == 3
+
+
+def test_listener_tcp(listener):
+    """Check that lines separated by new lines, or octet counted, are
+    received, even when split on several packets.
+    """
+    with socket.create_connection(listener.tcp_address) as sender:
+        sender.sendall(b'<134>line 1\r\n<134>li')
+        time.sleep(0.05)
+        sender.sendall(b'ne 2\n11 <134>line 3')
+        time.sleep(0.05)
+        sender.sendall(b'12 <134>line 4\nlast')
+    assert _wait_for(listener, 5) == b'line 1\nline 2\nline 3\nline 4\nlast\n'
+
+
+def test_listener_drops():
+    """Check that batches are dropped, and counted, once the queue is full."""
+    listener = SyslogListener(udp=('127.0.0.1', 0), batch_lines=1, queue_size=2)
+    listener.start()
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sender:
+        for number in range(5):
+            sender.sendto(f'line {number}'.encode(), listener.udp_address)
+    deadline = time.monotonic() + 10
+    while listener.received < 5 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert (listener.received, listener.dropped) == (5, 3)
+    assert listener.read() == b'line 0\n'
+    assert listener.read() == b'line 1\n'
+    assert listener.read() == b''
+    listener.close()
+
+
+def test_listener_udp_blank(listener):
+    """Check that empty or blank datagrams are not taken as lines."""
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sender:
+        sender.sendto(b'', listener.udp_address)
+        sender.sendto(b' \r\n', listener.udp_address)
+        sender.sendto(b'\t', listener.udp_address)
+        sender.sendto(b'<134>line 1', listener.udp_address)
+    assert _wait_for(listener, 1) == b'line 1\n'
+    assert listener.received == 1
+
+
+def test_listener_tcp_too_long(listener, monkeypatch):
+    """Check that all the lines buffered when a client sends a too long line
+    are counted as dropped.
+    """
+    monkeypatch.setattr('haproxy.listener.MAX_LINE', 20)
+    with socket.create_connection(listener.tcp_address) as sender:
+        sender.sendall(b'<134>line 1\n')
+        sender.sendall(b'40 line 2\nline 3\nline 4')
+        assert sender.recv(10) == b''
+    assert _wait_for(listener, 1) == b'line 1\n'
+    assert (listener.received, listener.dropped) == (4, 3)
+
+
+def test_listener_address_in_use(listener):
+    other = SyslogListener(tcp=listener.tcp_address)
+    with pytest.raises(OSError):
+        other.start()
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_log_listen(listener, http_line_factory, jobs):
+    """Check that the lines received are processed, on worker processes too."""
+    line = f'<134>{http_line_factory().raw_line}'.encode()
+    cmd = commands.Counter()
+    log_file = Log(jobs=jobs)
+    reports = log_file.listen(listener, [cmd], lines=4)
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sender:
+        for _ in range(3):
+            sender.sendto(line, listener.udp_address)
+        sender.sendto(b'invalid', listener.udp_address)
+        next(reports)
+    assert cmd.raw_results() == 3
+    assert (log_file.valid_lines, log_file.invalid_lines) == (3, 1)
+    reports.close()
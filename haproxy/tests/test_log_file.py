@@ -1,10 +1,30 @@
 # -*- coding: utf-8 -*-
 from datetime import datetime
+from haproxy import commands
+from haproxy import filters
 from haproxy.logfile import Log
+from haproxy.logfile import Results
+from haproxy.planner import plan_query
+from haproxy.readers import split_buffer
+from haproxy.utils import VALID_COMMANDS
 
+import bz2
+import gc
+import gzip
+import lzma
+import multiprocessing
 import pytest
 
 
+@pytest.fixture(autouse=True)
+def parallel(monkeypatch):
+    """Process even the tiny log files of the tests on worker processes, if
+    more than one job is asked for.
+    """
+    monkeypatch.setattr('haproxy.logfile.SERIAL_SIZE', 0)
+    monkeypatch.setattr('haproxy.logfile.JOB_SIZE', 1)
+
+
 def test_logfile_default_values():
     """Check that the default values are set."""
     log_file = Log('something')
@@ -115,3 +135,494 @@ def test_print_invalid_lines(tmp_path, http_line_factory, client_port, capsys):
         assert ":"+client_port not in output
     else:
         assert ":"+client_port in output
+
+
+def test_process_lines(http_line_factory):
+    """Check that lines are counted, filtered and given to the commands."""
+    raw_lines = [
+        http_line_factory(http_server_name='instance1').raw_line.encode(),
+        http_line_factory(http_server_name='instance2').raw_line.encode(),
+        b'invalid\n',
+    ]
+    log_file = Log('something', show_invalid=True)
+    results = Results([commands.Counter()])
+    log_file.process_lines(raw_lines, results, [filters.filter_server('instance1')])
+    assert results.valid_lines == 2
+    assert results.invalid_lines == 1
+    assert results.invalid == ['invalid']
+    assert results.commands[0].raw_results() == 1
+
+    results = Results([commands.Counter()])
+    log_file.process_lines(
+        raw_lines, results, [filters.filter_server('instance1')], negate=True
+    )
+    assert results.commands[0].raw_results() == 1
+
+
+@pytest.mark.parametrize('jobs', [1, 2, 4])
+def test_jobs(jobs):
+    """Check that lines are returned in order whatever the amount of processes."""
+    log_file = Log(logfile='haproxy/tests/files/small.log', jobs=jobs)
+    log_file.chunks = lambda buffer, logfile: split_buffer(buffer, 5)
+    lines = [line.raw_line for line in log_file]
+    with open(log_file.logfile) as file_obj:
+        assert lines == [raw_line.strip() for raw_line in file_obj]
+    assert log_file.valid_lines == 9
+
+
+@pytest.mark.parametrize('jobs', [1, 2, 4])
+@pytest.mark.parametrize(
+    'command_name, expected',
+    [
+        ('counter', 9),
+        ('server_load', {'instance1': 4, 'instance2': 3, 'instance3': 2}),
+        ('requests_per_hour', 9),
+    ],
+)
+def test_process(jobs, command_name, expected):
+    """Check that merging the partial results of each chunk gives the same results."""
+    log_file = Log(logfile='haproxy/tests/files/small.log', jobs=jobs)
+    log_file.chunks = lambda buffer, logfile: split_buffer(buffer, 5)
+    cmd = VALID_COMMANDS[command_name]['klass']()
+    log_file.process([cmd])
+    results = cmd.raw_results()
+    if command_name == 'requests_per_hour':
+        results = sum(count for _, count in results)
+    assert results == expected
+    assert log_file.valid_lines == 9
+
+
+@pytest.mark.parametrize('jobs', [1, 2, 4])
+def test_process_ips(tmp_path, jobs):
+    """Check that worker processes filter by the IPs of a file, and that
+    objects are no longer frozen once they are forked.
+    """
+    ips_file = tmp_path / 'ips.txt'
+    blocklist = ''.join(f'10.0.{n // 256}.{n % 256}\n' for n in range(1000))
+    ips_file.write_text(f'123.123.124.124\n{blocklist}')
+    log_file = Log(logfile='haproxy/tests/files/small.log', jobs=jobs)
+    log_file.chunks = lambda buffer, logfile: split_buffer(buffer, 5)
+    cmd = commands.Counter()
+    log_file.process([cmd], [filters.filter_ips(f'@{ips_file}')])
+    assert cmd.raw_results() == 2
+    if hasattr(gc, 'get_freeze_count'):
+        assert gc.get_freeze_count() == 0
+
+
+def test_process_print(capsys):
+    """Check that the print command outputs the lines in order."""
+    log_file = Log(logfile='haproxy/tests/files/small.log', jobs=3)
+    log_file.chunks = lambda buffer, logfile: split_buffer(buffer, 5)
+    log_file.process([commands.Print()], [filters.filter_server('instance1')])
+    output = capsys.readouterr().out
+    assert output.count('default/instance1') == 4
+    with open(log_file.logfile) as file_obj:
+        expected = [line.strip() for line in file_obj if 'instance1' in line]
+    # progress dots are printed without new lines
+    output_lines = [line.lstrip('.') for line in output.split('\n')]
+    assert [line for line in output_lines if 'instance1' in line] == expected
+
+
+SMALL_LOG = 'haproxy/tests/files/small.log'
+
+
+def _compress_members(data, parts, compresslevel=9):
+    """Gzip data as a multi-member gzip file, members split lines."""
+    size = -(-len(data) // parts)
+    return b''.join(
+        gzip.compress(data[index : index + size], compresslevel)
+        for index in range(0, len(data), size)
+    )
+
+
+@pytest.mark.parametrize(
+    'compress',
+    [
+        gzip.compress,
+        bz2.compress,
+        lzma.compress,
+        lambda data: _compress_members(data, 4),
+        lambda data: _compress_members(data, 50),
+        lambda data: _compress_members(data, 3, compresslevel=0),
+    ],
+)
+@pytest.mark.parametrize('jobs', [1, 3])
+def test_compressed_log_files(tmp_path, compress, jobs):
+    """Check that compressed log files give the same lines and results."""
+    with open(SMALL_LOG, 'rb') as file_obj:
+        data = file_obj.read()
+    file_path = tmp_path / 'haproxy.log.1.gz'
+    file_path.write_bytes(compress(data))
+
+    log_file = Log(logfile=file_path, jobs=jobs)
+    lines = [line.raw_line for line in log_file]
+    assert lines == data.decode().splitlines()
+    assert log_file.valid_lines == 9
+
+    log_file = Log(logfile=file_path, jobs=jobs)
+    cmd = commands.ServerLoad()
+    log_file.process([cmd])
+    assert cmd.raw_results() == {'instance1': 4, 'instance2': 3, 'instance3': 2}
+
+
+def test_gzip_magic_within_lines(tmp_path, http_line_factory):
+    """Check that gzip magic bytes on log lines do not split gzip members."""
+    raw_line = http_line_factory(http_request='GET /\x1f\x8b\x08 HTTP/1.1').raw_line
+    data = f'{raw_line}\n'.encode() * 20
+    file_path = tmp_path / 'haproxy.log.gz'
+    # without compression the data is stored as is, magic bytes included
+    file_path.write_bytes(_compress_members(data, 2, compresslevel=0))
+
+    log_file = Log(logfile=file_path, jobs=2)
+    lines = [line.raw_line for line in log_file]
+    assert lines == [raw_line] * 20
+
+
+def _write_log_files(tmp_path, http_line_factory):
+    """Two log files, their lines interleaved in time."""
+    lines = [
+        http_line_factory(
+            accept_date=f'09/Dec/2013:12:{minute:02}:46.633',
+            backend_queue=str(minute % 3),
+        ).raw_line
+        for minute in range(10)
+    ]
+    first = tmp_path / 'haproxy.log.1'
+    first.write_text(''.join(f'{line}\n' for line in lines[::2]))
+    second = tmp_path / 'haproxy.log.2.gz'
+    second.write_bytes(gzip.compress(''.join(f'{line}\n' for line in lines[1::2]).encode()))
+    return lines
+
+
+@pytest.mark.parametrize('jobs', [1, 3])
+def test_multiple_log_files(tmp_path, http_line_factory, jobs):
+    """Check that all lines of all log files are processed."""
+    lines = _write_log_files(tmp_path, http_line_factory)
+    log_file = Log(logfile=[tmp_path / 'haproxy.log.*', SMALL_LOG], jobs=jobs)
+    assert log_file.logfiles == [
+        f'{tmp_path}/haproxy.log.1',
+        f'{tmp_path}/haproxy.log.2.gz',
+        SMALL_LOG,
+    ]
+    cmd = commands.Counter()
+    log_file.process([cmd])
+    assert cmd.raw_results() == 19
+    assert log_file.valid_lines == 19
+
+    log_file = Log(logfile=[tmp_path / 'haproxy.log.*'], jobs=jobs)
+    assert [line.raw_line for line in log_file] == lines[::2] + lines[1::2]
+
+
+def test_merge_by_date(tmp_path, http_line_factory):
+    """Check that lines of multiple log files are merged by their date."""
+    lines = _write_log_files(tmp_path, http_line_factory)
+    log_file = Log(logfile=tmp_path / 'haproxy.log.*', jobs=2, merge_by_date=True)
+    assert [line.raw_line for line in log_file] == lines
+
+
+def test_merge_by_date_ordered_commands(tmp_path, http_line_factory, capsys):
+    """Check that only commands that need it get the merged lines."""
+    lines = _write_log_files(tmp_path, http_line_factory)
+    log_file = Log(logfile=tmp_path / 'haproxy.log.*', jobs=2, merge_by_date=True)
+    counter = commands.Counter()
+    log_file.process([counter, commands.Print()])
+    assert counter.raw_results() == 10
+    output = capsys.readouterr().out
+    assert [line for line in output.split('\n') if 'instance' in line] == lines
+
+
+def _write_dated_log_file(tmp_path, http_line_factory, minutes):
+    lines = [
+        http_line_factory(accept_date=f'09/Dec/2013:12:{minute:02}:00.000').raw_line
+        for minute in minutes
+    ]
+    file_path = tmp_path / 'haproxy.log'
+    file_path.write_text(''.join(f'{line}\n' for line in lines))
+    return file_path, lines
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_seek(tmp_path, http_line_factory, jobs):
+    """Check that only the lines of the time frame are read."""
+    file_path, lines = _write_dated_log_file(
+        tmp_path, http_line_factory, range(0, 60, 2)
+    )
+    log_file = Log(file_path, start='09/Dec/2013:12:10', delta='10m', seek=True)
+    log_file.jobs = jobs
+    assert [line.raw_line for line in log_file] == lines[5:11]
+    # lines out of the time frame are not even read
+    assert log_file.total_lines == 6
+
+
+def test_seek_tolerance(tmp_path, http_line_factory):
+    """Check that lines slightly out of order are not missed."""
+    minutes = (0, 5, 10, 15, 13, 20, 25, 30)
+    file_path, lines = _write_dated_log_file(tmp_path, http_line_factory, minutes)
+    start, delta = '09/Dec/2013:12:10', '4m'
+    log_file = Log(file_path, start=start, delta=delta, seek=True)
+    assert [line.raw_line for line in log_file] == [lines[2]]
+
+    log_file = Log(
+        file_path, start=start, delta=delta, seek=True, seek_tolerance='2m'
+    )
+    assert [line.raw_line for line in log_file] == [lines[2], lines[4]]
+
+    log_file = Log(file_path, start=start, delta=delta)
+    assert [line.raw_line for line in log_file] == [lines[2], lines[4]]
+
+
+def test_index(tmp_path, http_line_factory):
+    """Check that the time index is built and used to read the time frame."""
+    file_path, lines = _write_dated_log_file(
+        tmp_path, http_line_factory, range(0, 60, 2)
+    )
+    log_file = Log(file_path, index=True)
+    assert len(list(log_file)) == 30
+    assert (tmp_path / 'haproxy.log.idx').exists()
+
+    log_file = Log(file_path, start='09/Dec/2013:12:10', delta='10m', index=True)
+    assert [line.raw_line for line in log_file] == lines[5:11]
+    assert log_file.total_lines == 6
+
+
+def test_index_before_first_line(tmp_path, http_line_factory):
+    """Check that a time frame that ends before the first line reads nothing."""
+    file_path, lines = _write_dated_log_file(
+        tmp_path, http_line_factory, range(30, 60, 2)
+    )
+    log_file = Log(file_path, start='09/Dec/2013:12:10', delta='10m', index=True)
+    assert list(log_file) == []
+    assert log_file.total_lines == 0
+
+
+@pytest.mark.parametrize('jobs', [1, 3])
+@pytest.mark.parametrize('command_name', sorted(VALID_COMMANDS))
+def test_cache(tmp_path, jobs, command_name):
+    """Check that commands get the same results out of the cache."""
+    file_path = tmp_path / 'haproxy.log'
+    with open(SMALL_LOG, 'rb') as file_obj:
+        file_path.write_bytes(file_obj.read() + b'invalid\n')
+    cmd_filters = [filters.filter_server('instance1')]
+
+    expected = VALID_COMMANDS[command_name]['klass']()
+    plan = plan_query([expected], cmd_filters)
+    log_file = Log(file_path, plan=plan, jobs=jobs)
+    log_file.process([expected], cmd_filters)
+
+    for _ in range(2):
+        cmd = VALID_COMMANDS[command_name]['klass']()
+        log_file = Log(file_path, plan=plan, jobs=jobs, cache=True)
+        log_file.process([cmd], cmd_filters)
+        assert 0 in log_file.caches
+        assert cmd.raw_results() == expected.raw_results()
+        assert log_file.valid_lines == 9
+        assert log_file.invalid_lines == 1
+
+
+def test_cache_not_usable(tmp_path):
+    """Check that lines are parsed when not all their attributes are cached."""
+    file_path = tmp_path / 'haproxy.log'
+    with open(SMALL_LOG, 'rb') as file_obj:
+        file_path.write_bytes(file_obj.read())
+    log_file = Log(file_path, cache=True)
+    assert len(list(log_file)) == 9
+    assert log_file.caches == {}
+    assert not (tmp_path / 'haproxy.log.cache').exists()
+
+
+def test_cache_time_frame(tmp_path, http_line_factory):
+    """Check that the time index selects the rows of the cache."""
+    file_path, lines = _write_dated_log_file(
+        tmp_path, http_line_factory, range(0, 60, 2)
+    )
+    cmd = commands.Counter()
+    log_file = Log(
+        file_path,
+        start='09/Dec/2013:12:10',
+        delta='10m',
+        index=True,
+        cache=True,
+        plan=plan_query([cmd], time_frame=True),
+    )
+    log_file.process([cmd])
+    assert cmd.raw_results() == 6
+    assert log_file.total_lines == 6
+
+
+def test_without_fork(monkeypatch):
+    """Check that log files are processed where processes can not be forked."""
+    spawn = multiprocessing.get_context('spawn')
+    monkeypatch.setattr(
+        'haproxy.logfile.multiprocessing.get_all_start_methods', lambda: ['spawn']
+    )
+    monkeypatch.setattr(
+        'haproxy.logfile.multiprocessing.get_context',
+        lambda method=None: spawn,
+    )
+    cmd = commands.Counter()
+    log_file = Log(SMALL_LOG, jobs=2)
+    log_file.process([cmd], [filters.filter_server('instance1')])
+    assert cmd.raw_results() == 4
+    assert log_file.valid_lines == 9
+
+
+def test_cache_not_written(tmp_path, monkeypatch):
+    """Check that lines are parsed when the cache can not be written."""
+
+    def read_only(*args, **kwargs):
+        raise PermissionError('read only')
+
+    monkeypatch.setattr('haproxy.cache.os.makedirs', read_only)
+    file_path = tmp_path / 'haproxy.log'
+    with open(SMALL_LOG, 'rb') as file_obj:
+        file_path.write_bytes(file_obj.read())
+    cmd = commands.StatusCodesCounter()
+    log_file = Log(file_path, plan=plan_query([cmd]), cache=True)
+    log_file.process([cmd])
+    assert log_file.caches == {}
+    assert cmd.raw_results()['200'] == 2
+
+
+def test_cache_without_fork(tmp_path, monkeypatch):
+    """Check that caches are sent to the workers when they are not forked."""
+    file_path = tmp_path / 'haproxy.log'
+    with open(SMALL_LOG, 'rb') as file_obj:
+        file_path.write_bytes(file_obj.read())
+    spawn = multiprocessing.get_context('spawn')
+    monkeypatch.setattr(
+        'haproxy.logfile.multiprocessing.get_all_start_methods', lambda: ['spawn']
+    )
+    monkeypatch.setattr(
+        'haproxy.logfile.multiprocessing.get_context', lambda method=None: spawn
+    )
+    monkeypatch.setattr('haproxy.cache.BUILD_CHUNK_SIZE', 500)
+    cmd = commands.ServerLoad()
+    log_file = Log(file_path, plan=plan_query([cmd]), jobs=2, cache=True)
+    log_file.process([cmd])
+    assert 0 in log_file.caches
+    assert cmd.raw_results()['instance1'] == 4
+
+
+def test_serial_small_log_files(monkeypatch, capsys):
+    """Check that small log files are processed on the main process."""
+    monkeypatch.setattr('haproxy.logfile.SERIAL_SIZE', 1024 * 1024)
+    cmd = commands.Counter()
+    log_file = Log(SMALL_LOG, jobs=4)
+    log_file.process([cmd])
+    assert cmd.raw_results() == 9
+    assert log_file.mode == 'serial'
+    assert log_file._pool is None
+    assert '(serial)' in capsys.readouterr().out
+
+
+@pytest.mark.parametrize(
+    'jobs, job_size, expected',
+    [(1, 1, 'serial'), (4, 1000, '2 processes'), (4, 1, '4 processes')],
+)
+def test_processes(monkeypatch, jobs, job_size, expected):
+    """Check that only one worker process is started per JOB_SIZE bytes."""
+    monkeypatch.setattr('haproxy.logfile.JOB_SIZE', job_size)
+    log_file = Log(SMALL_LOG, jobs=jobs)
+    log_file.chunks = lambda buffer, logfile: split_buffer(buffer, 5)
+    assert len([line for line in log_file]) == 9
+    assert log_file.mode == expected
+
+
+def test_pool_kept(tmp_path):
+    """Check that the worker processes are kept for the next runs, as long as
+    they have the same log files, commands and filters.
+    """
+    file_path = tmp_path / 'haproxy.log'
+    with open(SMALL_LOG, 'rb') as file_obj:
+        file_path.write_bytes(file_obj.read())
+    cmd = commands.Counter()
+    with Log(file_path, jobs=2) as log_file:
+        log_file.process([cmd])
+        pool = log_file._pool[0]
+        log_file.process([cmd])
+        assert log_file._pool[0] is pool
+        assert cmd.raw_results() == 18
+
+        log_file.process([commands.Counter()])
+        assert log_file._pool[0] is not pool
+        pool = log_file._pool[0]
+
+        with open(file_path, 'ab') as file_obj:
+            file_obj.write(b'invalid\n')
+        log_file.process([cmd])
+        assert log_file._pool[0] is not pool
+        assert cmd.raw_results() == 27
+        assert log_file.invalid_lines == 1
+    assert log_file._pool is None
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+@pytest.mark.parametrize('cache', [False, True])
+def test_stats(tmp_path, jobs, cache):
+    """Check that the time spent on each stage is measured, on every worker."""
+    file_path = tmp_path / 'haproxy.log'
+    with open(SMALL_LOG, 'rb') as file_obj:
+        data = file_obj.read()
+    file_path.write_bytes(data + b'invalid\n')
+    cmd = commands.StatusCodesCounter()
+    server = [filters.filter_server('instance1')]
+    plan = plan_query([cmd], server)
+    log_file = Log(file_path, plan=plan, jobs=jobs, cache=cache, stats=True)
+    log_file.process([cmd], server)
+    assert cmd.raw_results() == {'200': 1, '300': 2, '404': 1}
+    stats = log_file.stats
+    assert stats.wall > 0
+    for stage in ('read', 'filter', 'command', 'merge'):
+        assert stats.stages[stage] > 0
+    if cache:
+        # lines are loaded, neither decoded nor parsed
+        assert stats.stages['decode'] == stats.stages['parse'] == stats.bytes == 0
+    else:
+        assert stats.stages['decode'] > 0
+        assert stats.stages['parse'] > 0
+        assert stats.bytes == len(data) + 8
+    # a worker can get all tasks done before the others start
+    assert 1 <= len(stats.workers) <= jobs
+    assert sum(worker[1] for worker in stats.workers.values()) == 10
+    log_file.close()
+
+
+@pytest.mark.parametrize('negate', [False, True])
+def test_stats_profiles(negate):
+    """Check that every filter and command is measured, ordered commands on
+    the main process too.
+    """
+    server = filters.filter_server('instance1')
+    status = filters.filter_status_code('200')
+    counter, peaks = commands.Counter(), commands.QueuePeaks()
+    log_file = Log([SMALL_LOG, SMALL_LOG], jobs=2, merge_by_date=True, stats=True)
+    log_file.process([counter, peaks], [server, status], negate=negate)
+    stats = log_file.stats
+    # without negating them, lines that lack their raw text are skipped
+    calls = [(18, 8), (8, 2)] if negate else [(2, 2), (2, 2)]
+    assert [(data[0], data[1]) for data in stats.filters] == calls
+    expected = 16 if negate else 2
+    assert counter.raw_results() == expected
+    assert stats.commands['counter'][0] == expected
+    assert stats.commands['queue_peaks'][0] == expected
+    assert stats.commands['queue_peaks'][1] > 0
+    log_file.close()
+
+
+@pytest.mark.parametrize(
+    'negate, show_invalid, skipped',
+    [(False, False, 16), (True, False, 0), (False, True, 0)],
+)
+def test_skip_lines_before_parsing(negate, show_invalid, skipped):
+    """Check that lines that can not pass the filters are skipped before
+    being parsed, unless the filters are negated or invalid lines shown.
+    """
+    server = filters.filter_server('instance1')
+    status = filters.filter_status_code('200')
+    counter = commands.Counter()
+    log_file = Log([SMALL_LOG, SMALL_LOG], show_invalid=show_invalid)
+    log_file.process([counter], [server, status], negate=negate)
+    assert counter.raw_results() == (16 if negate else 2)
+    assert log_file.skipped_lines == skipped
+    assert log_file.total_lines == 18
+    log_file.close()
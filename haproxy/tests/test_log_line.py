@@ -1,7 +1,12 @@
 # -*- coding: utf-8 -*-
 from datetime import datetime
 from datetime import timedelta
+from haproxy.line import _parse_accept_date_seconds
+from haproxy.line import ACCEPT_DATE_FORMAT
+from haproxy.line import Line
+from haproxy.line import parse_accept_date
 
+import pickle
 import pytest
 
 
@@ -219,3 +224,140 @@ def test_not_syslog_line(plain_line_factory):
     line = plain_line_factory()
 
     assert line.is_valid
+
+
+@pytest.mark.parametrize(
+    'accept_date',
+    [
+        '09/Dec/2013:12:59:46.633',
+        '09/Dec/2013:12:59:46.6',
+        '09/Dec/2013:12:59:46.000001',
+        '9/Dec/2013:12:59:46.010',
+        '29/Feb/2020:00:00:00.999',
+    ],
+)
+def test_parse_accept_date(accept_date):
+    """Check that the cached date parsing is equivalent to strptime."""
+    expected = datetime.strptime(accept_date, ACCEPT_DATE_FORMAT)
+    assert parse_accept_date(accept_date) == expected
+
+
+@pytest.mark.parametrize(
+    'accept_date',
+    [
+        '09/Dec/2013:12:59:46',
+        '09/Dec/2013:12:59:46.',
+        '09/Dec/2013:12:59:46.1234567',
+        '09/Dec/2013:12:59:46.63a',
+        '09/Foo/2013:12:59:46.633',
+        '30/Feb/2020:00:00:00.999',
+    ],
+)
+def test_parse_accept_date_invalid(accept_date):
+    """Check that invalid dates are still reported as such."""
+    with pytest.raises(ValueError):
+        parse_accept_date(accept_date)
+
+
+def test_parse_accept_date_cache():
+    """Check that lines within the same second reuse the parsed date."""
+    _parse_accept_date_seconds.cache_clear()
+    first = parse_accept_date('09/Dec/2013:12:59:46.633')
+    second = parse_accept_date('09/Dec/2013:12:59:46.950')
+    assert _parse_accept_date_seconds.cache_info().hits == 1
+    assert second - first == timedelta(milliseconds=317)
+
+
+def test_line_has_no_instance_dict(http_line_factory):
+    """Check that lines store their attributes on slots."""
+    line = http_line_factory()
+    assert not hasattr(line, '__dict__')
+    assert line.request_date == line.accept_date
+    with pytest.raises(AttributeError):
+        line.not_an_attribute
+
+
+def test_missing_attributes_are_none(tcp_line_factory):
+    """Check that attributes not found on the log line are None."""
+    line = tcp_line_factory()
+    assert line.status_code is None
+    assert line.time_wait_request is None
+    assert line.http_request_path is None
+
+
+@pytest.mark.parametrize('factory', ['http_line_factory', 'tcp_line_factory'])
+def test_pickle_line(request, factory):
+    """Check that lines are pickled with all their attributes."""
+    line = request.getfixturevalue(factory)()
+    unpickled = pickle.loads(pickle.dumps(line))
+    for name in Line.__slots__:
+        assert getattr(unpickled, name) == getattr(line, name)
+    assert unpickled.server_name is line.server_name
+
+
+def _is_set(line, name):
+    try:
+        Line.__dict__[name].__get__(line)
+    except AttributeError:
+        return False
+    return True
+
+
+@pytest.mark.parametrize('factory', ['http_line_factory', 'tcp_line_factory'])
+def test_lazy_line_values(request, factory):
+    """Check that lazy lines have the same values as regular ones."""
+    line = request.getfixturevalue(factory)()
+    lazy_line = Line(line.raw_line, lazy=True)
+    assert lazy_line.is_valid is line.is_valid
+    assert lazy_line.log_type is line.log_type
+    for name in Line.__slots__:
+        if not name.startswith('_'):
+            assert getattr(lazy_line, name) == getattr(line, name)
+    assert lazy_line.ip == line.ip
+
+
+def test_lazy_line_decodes_on_access(http_line_factory):
+    """Check that lazy lines only convert the attributes that are used."""
+    raw_line = http_line_factory().raw_line
+    line = Line(raw_line, lazy=True)
+    assert not _is_set(line, 'accept_date')
+    assert not _is_set(line, 'http_request_path')
+
+    assert line.status_code == '200'
+    assert _is_set(line, 'status_code')
+    assert not _is_set(line, 'accept_date')
+    assert not _is_set(line, 'http_request_path')
+
+    assert line.http_request_path == '/path/to/image'
+    assert _is_set(line, 'http_request_method')
+    assert not _is_set(line, 'accept_date')
+
+
+def test_lazy_line_decode(http_line_factory):
+    """Check that decoding some attributes drops all the others."""
+    line = Line(http_line_factory().raw_line, lazy=True)
+    line.decode(['server_name'])
+    assert line.server_name == 'instance8'
+    assert line.status_code is None
+
+    line = Line(http_line_factory().raw_line, lazy=True)
+    line.decode()
+    assert line.status_code == '200'
+    assert line.http_request_method == 'GET'
+
+
+def test_lazy_invalid_line():
+    """Check that lazy lines are validated right away."""
+    line = Line('something else', lazy=True)
+    assert line.is_valid is False
+    assert line.status_code is None
+
+
+def test_pickle_lazy_line(http_line_factory):
+    """Check that lazy lines are pickled without decoding them."""
+    line = Line(http_line_factory().raw_line, lazy=True)
+    assert line.status_code == '200'
+    unpickled = pickle.loads(pickle.dumps(line))
+    assert not _is_set(line, 'accept_date')
+    assert unpickled.status_code == '200'
+    assert unpickled.accept_date == datetime(2013, 12, 9, 12, 59, 46, 633000)
@@ -4,6 +4,8 @@ from haproxy.main import parse_arguments
 from haproxy.utils import VALID_COMMANDS
 from haproxy.utils import VALID_FILTERS
 
+import gzip
+import json
 import pytest
 
 
@@ -21,6 +23,21 @@ def default_arguments():
         'list_filters': False,
         'json': False,
         'invalid_lines': False,
+        'jobs': None,
+        'merge_by_date': None,
+        'seek': None,
+        'seek_tolerance': None,
+        'index': None,
+        'build_index': None,
+        'cache': None,
+        'state': None,
+        'follow': None,
+        'report_interval': None,
+        'report_lines': None,
+        'listen_udp': None,
+        'listen_tcp': None,
+        'stats': None,
+        'profile': None,
     }
 
 
@@ -98,3 +115,176 @@ def test_json_output(capsys, default_arguments):
     output_text = capsys.readouterr().out
     assert 'COUNTER\n=======\n9' not in output_text
     assert '{"COUNTER": 9}' in output_text
+
+
+def test_build_index(capsys, default_arguments, tmp_path):
+    """Check that only the time index is built."""
+    logfile = tmp_path / 'haproxy.log'
+    with open(default_arguments['log'], 'rb') as source:
+        logfile.write_bytes(source.read())
+    compressed = tmp_path / 'haproxy.log.1.gz'
+    compressed.write_bytes(gzip.compress(logfile.read_bytes()))
+    default_arguments['log'] = [logfile, compressed]
+    default_arguments['build_index'] = True
+    main(default_arguments)
+    output_text = capsys.readouterr().out
+    assert 'COUNTER' not in output_text
+    assert f'{logfile}: ' in output_text
+    assert 'compressed log files can not be indexed' in output_text
+    assert (tmp_path / 'haproxy.log.idx').exists()
+
+
+def test_state(capsys, default_arguments, tmp_path):
+    """Check that the analysis resumes where the last run left it."""
+    logfile = tmp_path / 'haproxy.log'
+    with open(default_arguments['log'], 'rb') as source:
+        lines = source.read().splitlines(keepends=True)
+    logfile.write_bytes(b''.join(lines[:5]))
+    default_arguments['log'] = [logfile]
+    default_arguments['state'] = tmp_path / 'haproxy.state'
+    default_arguments['commands'] = ['counter', 'server_load']
+
+    main(default_arguments)
+    assert 'COUNTER\n=======\n5' in capsys.readouterr().out
+
+    with open(logfile, 'ab') as log:
+        log.write(b''.join(lines[5:]))
+    main(default_arguments)
+    output_text = capsys.readouterr().out
+    assert 'COUNTER\n=======\n9' in output_text
+    assert '- instance1: 4' in output_text
+
+    # nothing new
+    main(default_arguments)
+    assert 'COUNTER\n=======\n9' in capsys.readouterr().out
+
+
+@pytest.mark.parametrize(
+    'argument, value', [('commands', ['server_load']), ('merge_by_date', True)]
+)
+def test_state_other_query(default_arguments, tmp_path, argument, value):
+    """Check that a state file is only resumed with the same query."""
+    default_arguments['state'] = tmp_path / 'haproxy.state'
+    main(default_arguments)
+    default_arguments[argument] = value
+    with pytest.raises(ValueError) as exception_info:
+        main(default_arguments)
+    assert 'written with other commands or filters' in str(exception_info)
+
+
+def test_follow(capsys, default_arguments, monkeypatch):
+    """Check that results are reported while following the log files, and
+    once more when interrupted.
+    """
+    calls = []
+
+    def follow(log_file, commands, filters, negate, interval, lines):
+        calls.append((interval, lines))
+        commands[0].counter = 2
+        yield
+        commands[0].counter = 5
+        yield
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr('haproxy.logfile.Log.follow', follow)
+    default_arguments['follow'] = True
+    main(default_arguments)
+    output_text = capsys.readouterr().out
+    assert calls == [(10, None)]
+    assert 'COUNTER\n=======\n2\n' in output_text
+    assert output_text.count('COUNTER\n=======\n5\n') == 2
+    assert output_text.index('RESULTS') > output_text.index('=\n2\n')
+
+
+def test_listen(capsys, default_arguments, monkeypatch):
+    """Check that results are reported while listening, with the amount of
+    lines received and dropped.
+    """
+
+    def listen(log_file, listener, commands, filters, negate, interval, lines):
+        # started right away
+        listener.udp_address = ('localhost', 5140)
+        return reports(listener, commands)
+
+    def reports(listener, commands):
+        listener.received, listener.dropped = 7, 2
+        commands[0].counter = 5
+        yield
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr('haproxy.logfile.Log.listen', listen)
+    default_arguments['log'] = None
+    default_arguments['listen_udp'] = ('localhost', 0)
+    main(default_arguments)
+    output_text = capsys.readouterr().out
+    assert 'Listening on UDP localhost:5140' in output_text
+    assert '7 lines received, 2 dropped' in output_text
+    assert output_text.count('COUNTER\n=======\n5\n') == 2
+
+
+def test_stats(capsys, default_arguments):
+    """Check that the stats are printed as JSON on stderr, apart from the
+    results.
+    """
+    default_arguments['stats'] = True
+    default_arguments['json'] = True
+    main(default_arguments)
+    captured = capsys.readouterr()
+    stats = json.loads(captured.err)
+    assert stats['lines'] == 9
+    assert stats['mode'] == 'serial'
+    assert '"stages"' not in captured.out
+
+
+@pytest.mark.parametrize(
+    'filters, invalid_lines, invalid_rate',
+    [(None, 1, 0.333333), ([('server', 'instance1')], 0, None)],
+)
+def test_stats_invalid_lines(
+    capsys, default_arguments, filters, invalid_lines, invalid_rate
+):
+    """Check that lines skipped before being parsed leave the rate of invalid
+    lines unknown, as they might be invalid.
+    """
+    default_arguments['log'] = 'haproxy/tests/files/2_ok_1_invalid.log'
+    default_arguments['stats'] = True
+    default_arguments['filters'] = filters
+    main(default_arguments)
+    stats = json.loads(capsys.readouterr().err)
+    assert stats['lines'] == 3
+    assert stats['invalid_lines'] == invalid_lines
+    assert stats['invalid_rate'] == invalid_rate
+
+
+@pytest.mark.parametrize('output', [False, True])
+def test_profile(capsys, default_arguments, output):
+    """Check that the profile of filters and commands is printed with the
+    results.
+    """
+    default_arguments['profile'] = True
+    default_arguments['json'] = output
+    default_arguments['filters'] = [('server', 'instance1'), ('slow_requests', '1000')]
+    main(default_arguments)
+    output_text = capsys.readouterr().out
+    if output:
+        profile = json.loads(output_text.strip().split('\n')[-1])['PROFILE']
+        assert [data['filter'] for data in profile['filters']] == [
+            'server[instance1]',
+            'slow_requests[1000]',
+        ]
+        assert profile['commands'][0]['command'] == 'counter'
+    else:
+        # lines without the server name are skipped before being parsed
+        assert '- filter server[instance1]: 4 lines, 4 passed' in output_text
+        assert '- filter slow_requests[1000]: 4 lines, 1 passed' in output_text
+        assert '- command counter: 1 lines' in output_text
+
+
+def test_filter_expression(capsys, default_arguments):
+    """Check that lines are filtered with an expression of filters."""
+    default_arguments['filters'] = [
+        ('expression', 'server[instance1] or server[instance2] and not ssl')
+    ]
+    main(default_arguments)
+    output_text = capsys.readouterr().out
+    assert 'COUNTER\n=======\n7\n' in output_text
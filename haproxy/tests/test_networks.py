@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+from haproxy.networks import ip_to_int
+from haproxy.networks import IPSet
+from haproxy.networks import Networks
+from haproxy.networks import parse_network
+
+import ipaddress
+import pytest
+
+
+@pytest.mark.parametrize(
+    'ip, expected',
+    [
+        ('0.0.0.1', 1),
+        ('10.0.0.1', 0x0A000001),
+        ('::1', 1),
+        ('2001:db8::', 0x20010DB8 << 96),
+        ('10.0.0', None),
+        ('010.0.0.1', None),
+        ('lala', None),
+        ('', None),
+    ],
+)
+def test_ip_to_int(ip, expected):
+    """Check that IPs are converted to integers, and anything else is not."""
+    assert ip_to_int(ip) == expected
+
+
+@pytest.mark.parametrize(
+    'text, expected',
+    [
+        ('10.0.0.0/8', '10.0.0.0/8'),
+        ('10.1.2.3/8', '10.0.0.0/8'),
+        ('1.2.3.4', '1.2.3.4/32'),
+        ('10.1', '10.1.0.0/16'),
+        ('192.168.1.', '192.168.1.0/24'),
+        ('2001:db8::/32', '2001:db8::/32'),
+        ('2001:db8', '2001:db8::/32'),
+        ('fe80:', 'fe80::/16'),
+        ('fe80::', 'fe80::/16'),
+        ('2001:db8::', '2001:db8::/32'),
+        ('fe80::1', 'fe80::1/128'),
+        ('::1', '::1/128'),
+        ('::', '::/128'),
+    ],
+)
+def test_parse_network(text, expected):
+    """Check the ways networks can be written."""
+    assert parse_network(text) == ipaddress.ip_network(expected)
+
+
+@pytest.mark.parametrize(
+    'text', ['', 'lala', 'abc', 'fe80', '10.1.300', '1.2.3.4.5', 'fe80:::']
+)
+def test_parse_network_not_valid(text):
+    with pytest.raises(ValueError):
+        parse_network(text)
+
+
+def test_networks():
+    """Check that overlapping and adjacent networks are merged, and IPs
+    looked up on the networks of their version.
+    """
+    networks = Networks(
+        ['10.0.0.0/9', '10.128.0.0/9', '10.1.2.0/24', '192.168.1', '2001:db8']
+    )
+    assert len(networks) == 5
+    assert networks._ipv4 == (
+        (0x0A000000, 0xC0A80100),
+        (0x0AFFFFFF, 0xC0A801FF),
+    )
+    for ip in ('10.0.0.0', '10.255.255.255', '192.168.1.7', '2001:db8::1'):
+        assert ip in networks
+    for ip in ('9.255.255.255', '11.0.0.0', '192.168.2.1', '2001:db9::', '::1'):
+        assert ip not in networks
+    for not_ip in (None, '', 'lala', '1.2.3'):
+        assert not_ip not in networks
+
+
+def test_networks_many():
+    """Check that membership holds on many networks."""
+    networks = Networks(
+        f'{first}.{second}.0.0/16' for first in (10, 20) for second in range(0, 256, 2)
+    )
+    assert '10.4.1.1' in networks
+    assert '10.5.1.1' not in networks
+    assert '20.254.255.255' in networks
+    assert '30.0.0.0' not in networks
+
+
+def test_ip_set():
+    """Check that IPs are looked up on the IPs of their version, on the group
+    of their high bits.
+    """
+    ips = IPSet(['10.0.0.1', '10.0.255.255', '10.1.0.0', '10.0.0.1', '2001:db8::1'])
+    assert len(ips) == 4
+    assert list(ips._lows) == [0x0001, 0xFFFF, 0x0000]
+    assert ips._starts[0x0A00:0x0A03].tolist() == [0, 2, 3]
+    for ip in ('10.0.0.1', '10.0.255.255', '10.1.0.0', '2001:db8::1'):
+        assert ip in ips
+    for ip in ('10.0.0.2', '10.0.0.0', '10.1.0.1', '0.0.0.0', '::1', '2001:db8::'):
+        assert ip not in ips
+    for not_ip in (None, '', 'lala', '1.2.3'):
+        assert not_ip not in ips
+
+
+def test_ip_set_many():
+    """Check that membership holds on many IPs, and the edges of the IPv4
+    space.
+    """
+    ips = IPSet(
+        ['0.0.0.0', '255.255.255.255']
+        + [f'172.{second}.{n}.{n}' for second in range(16) for n in range(256)]
+    )
+    assert len(ips) == 16 * 256 + 2
+    assert '0.0.0.0' in ips
+    assert '255.255.255.255' in ips
+    assert '172.15.200.200' in ips
+    assert '172.15.200.201' not in ips
+    assert '172.16.0.0' not in ips
+
+
+def test_ip_set_not_valid():
+    """Check that values that are not IPs are reported."""
+    with pytest.raises(ValueError) as exception_info:
+        IPSet(['10.0.0.1', '10.0.0.0/8'])
+    assert '"10.0.0.0/8" is not an IP' in str(exception_info)
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+from haproxy.patterns import Patterns
+
+import pickle
+import pytest
+
+
+@pytest.mark.parametrize(
+    'text, expected',
+    [
+        ('ushers', True),
+        ('ahis', True),
+        ('she', True),
+        ('sh', False),
+        ('hi', False),
+        ('', False),
+        (None, False),
+    ],
+)
+def test_search(text, expected):
+    """Check that patterns are found, also when they end within others."""
+    patterns = Patterns(['he', 'she', 'his', 'hers'])
+    assert patterns.search(text) is expected
+
+
+def test_search_empty_pattern():
+    """Check that an empty pattern is on every text."""
+    patterns = Patterns(['/api', ''])
+    assert patterns.search('') is True
+    assert patterns.search('/static') is True
+    assert patterns.search(None) is False
+
+
+def test_search_many():
+    """Check that searching many patterns tells the same as looking for each
+    one of them.
+    """
+    paths = [f'/api/v{version}/{name}' for version in range(3) for name in 'abc']
+    paths += ['/wp-admin', '/.env', '/admin/config.php']
+    patterns = Patterns(paths)
+    assert len(patterns) == 12
+    for text in (
+        '/api/v1/b/items',
+        '/api/v3/a',
+        '/old/api/v2/c',
+        '/.envy',
+        '/admin/config.phtml',
+        '/api/v',
+    ):
+        assert patterns.search(text) is any(path in text for path in paths)
+
+
+def test_pickle():
+    """Check that patterns can be sent to worker processes."""
+    patterns = pickle.loads(pickle.dumps(Patterns(['/api', '/.env'])))
+    assert patterns.search('/x/.env') is True
+    assert patterns.search('/x/env') is False
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+from haproxy import commands
+from haproxy import filters
+from haproxy.line import parse_line
+from haproxy.planner import plan_query
+from haproxy.planner import Strategy
+from haproxy.utils import VALID_COMMANDS
+from haproxy.utils import VALID_FILTERS
+
+import pytest
+
+
+@pytest.mark.parametrize('name', sorted(VALID_COMMANDS))
+def test_commands_declare_fields(name):
+    """Check that all commands declare which attributes they read."""
+    cmd = VALID_COMMANDS[name]['klass']()
+    assert cmd.fields is not None
+
+
+@pytest.mark.parametrize('name', sorted(VALID_FILTERS))
+def test_filters_declare_fields(name):
+    """Check that all filters declare which attributes they read."""
+    arguments = {'expression': 'ssl or path[1]', 'ips': '1.2.3.4'}
+    argument = arguments.get(name, '1')
+    filter_func = VALID_FILTERS[name]['obj'](argument)
+    assert filter_func.fields is not None
+
+
+@pytest.mark.parametrize(
+    'cmds, filters_list, time_frame, strategy, fields',
+    [
+        ([commands.Counter()], [], False, Strategy.COUNT, ()),
+        ([commands.Print()], [], False, Strategy.COUNT, ()),
+        ([commands.Counter()], [], True, Strategy.PARTIAL, ('accept_date',)),
+        (
+            [commands.StatusCodesCounter()],
+            [],
+            False,
+            Strategy.PARTIAL,
+            ('status_code',),
+        ),
+        (
+            [commands.Counter(), commands.ServerLoad()],
+            [filters.filter_backend('default')],
+            False,
+            Strategy.PARTIAL,
+            ('backend_name', 'server_name'),
+        ),
+        (
+            [commands.QueuePeaks()],
+            [filters.filter_ip('1.2.3.4')],
+            True,
+            Strategy.PARTIAL,
+            ('accept_date', 'ip', 'queue_backend'),
+        ),
+        ([commands.Counter()], [lambda line: True], False, Strategy.FULL, None),
+    ],
+)
+def test_plan_query(cmds, filters_list, time_frame, strategy, fields):
+    """Check that the cheapest strategy is chosen."""
+    plan = plan_query(cmds, filters_list, time_frame=time_frame)
+    assert plan.strategy is strategy
+    assert plan.fields == fields
+    assert plan.lazy is (strategy is not Strategy.FULL)
+
+
+def test_unknown_command_fields():
+    """Check that commands that do not declare their attributes get full lines."""
+
+    class Custom(commands.BaseCommandMixin):
+        def __call__(self, line):
+            pass
+
+    plan = plan_query([Custom(), commands.Counter()])
+    assert plan.strategy is Strategy.FULL
+
+
+def test_parse_line_with_plan(http_line_factory):
+    """Check that only the attributes on the plan are decoded."""
+    raw_line = http_line_factory().raw_line
+    plan = plan_query([commands.StatusCodesCounter()], [filters.filter_ssl()])
+    line = parse_line(raw_line, plan=plan)
+    assert line.is_valid
+    assert line.status_code == '200'
+    assert line.is_https is False
+    assert line.server_name is None
+    assert line.accept_date is None
+    assert line.raw_line == raw_line
+
+
+def test_parse_line_without_plan(http_line_factory):
+    """Check that lines are fully parsed if no plan is given."""
+    raw_line = http_line_factory().raw_line
+    line = parse_line(raw_line)
+    assert line.server_name == 'instance8'
+    assert line.accept_date is not None
+
+
+def test_plan_query_merge_by_date():
+    """Check that lines merged by date get their accept date decoded."""
+    plan = plan_query([commands.Print()], merge_by_date=True)
+    assert plan.strategy is Strategy.PARTIAL
+    assert plan.fields == ('accept_date',)
+
+
+def test_plan_query_raw_line():
+    """Check that the plan tells whether the raw line is read."""
+    assert plan_query([commands.Print()]).raw_line is True
+    assert plan_query([commands.Counter()]).raw_line is False
+    assert plan_query([commands.StatusCodesCounter()]).raw_line is False
@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime
+from haproxy.readers import compression
+from haproxy.readers import find_logfiles
+from haproxy.readers import GZIP_MEMBER_MAGIC
+from haproxy.readers import gzip_members
+from haproxy.readers import GzipMember
+from haproxy.readers import iter_lines
+from haproxy.readers import line_blocks
+from haproxy.readers import lines_containing
+from haproxy.readers import map_file
+from haproxy.readers import merge_lines
+from haproxy.readers import prefetch
+from haproxy.readers import read_accept_date
+from haproxy.readers import read_blocks
+from haproxy.readers import seek_date
+from haproxy.readers import split_buffer
+
+import bz2
+import gzip
+import io
+import lzma
+import pytest
+import zlib
+
+
+CONTENT = b''.join(b'line %d\n' % index * (index % 4 + 1) for index in range(20))
+
+
+@pytest.mark.parametrize('chunks', [1, 2, 3, 5, 50])
+def test_split_buffer(chunks):
+    """Check that byte ranges cover the whole buffer and start on new lines."""
+    ranges = split_buffer(CONTENT, chunks)
+    assert len(ranges) <= chunks
+    assert ranges[0][0] == 0
+    assert ranges[-1][1] == len(CONTENT)
+    for (_, previous_end), (start, end) in zip(ranges, ranges[1:]):
+        assert previous_end == start
+        assert CONTENT[start - 1 : start] == b'\n'
+        assert start < end
+
+
+def test_split_empty_buffer():
+    """Check that empty buffers are handled."""
+    assert split_buffer(b'', 4) == [(0, 0)]
+
+
+@pytest.mark.parametrize(
+    'buffer, chunk, expected',
+    [
+        (b'first\nsecond\nthird', None, [b'first\n', b'second\n', b'third']),
+        (b'first\nsecond\nthird', (0, 6), [b'first\n']),
+        (b'first\nsecond\nthird', (6, 18), [b'second\n', b'third']),
+        (b'first\n\nthird\n', None, [b'first\n', b'\n', b'third\n']),
+        (b'', None, []),
+    ],
+)
+def test_iter_lines(buffer, chunk, expected):
+    """Check that only the lines on the byte range are returned."""
+    lines = list(iter_lines(buffer, chunk))
+    assert all(isinstance(line, memoryview) for line in lines)
+    assert [bytes(line) for line in lines] == expected
+
+
+@pytest.mark.parametrize(
+    'texts, chunk, expected, total',
+    [
+        ((b'ir',), None, [b'first\n', b'third'], 4),
+        ((b'ir', b'th'), None, [b'third'], 4),
+        ((b'd',), None, [b'second\n', b'third'], 4),
+        ((b'd',), (0, 13), [b'second\n'], 2),
+        ((b'third',), (0, 14), [], 3),
+        ((b'x',), None, [], 4),
+    ],
+)
+def test_lines_containing(texts, chunk, expected, total):
+    """Check that only the lines with all the texts are returned, and that
+    all the lines of the byte range are counted.
+    """
+    buffer = b'first\nsecond\n\nthird'
+    lines, count = lines_containing(buffer, texts, chunk)
+    lines = list(lines)
+    assert all(isinstance(line, memoryview) for line in lines)
+    assert [bytes(line) for line in lines] == expected
+    assert count == total
+
+
+def test_lines_containing_mapping(tmp_path, monkeypatch):
+    """Check that mapped log files are searched and counted where they are,
+    on byte ranges that span several blocks.
+    """
+    monkeypatch.setattr('haproxy.readers.BLOCK_SIZE', 7)
+    file_path = tmp_path / 'haproxy.log'
+    file_path.write_bytes(CONTENT)
+    buffer = map_file(file_path)
+    start = CONTENT.index(b'line 5\n')
+    end = CONTENT.index(b'line 12\n')
+    lines, count = lines_containing(buffer, (b'1', b'line'), (start, end))
+    assert [bytes(line) for line in lines] == [b'line 10\n'] * 3 + [b'line 11\n'] * 4
+    assert count == CONTENT[start:end].count(b'\n')
+
+
+def test_map_file(tmp_path):
+    """Check that files are mapped and lines read out of them."""
+    file_path = tmp_path / 'haproxy.log'
+    file_path.write_bytes(CONTENT)
+    buffer = map_file(file_path)
+    assert len(buffer) == len(CONTENT)
+    chunks = split_buffer(buffer, 3)
+    lines = [bytes(line) for chunk in chunks for line in iter_lines(buffer, chunk)]
+    assert b''.join(lines) == CONTENT
+
+
+def test_map_empty_file(tmp_path):
+    """Check that empty files, that can not be mapped, are handled."""
+    file_path = tmp_path / 'haproxy.log'
+    file_path.write_bytes(b'')
+    assert list(iter_lines(map_file(file_path))) == []
+
+
+@pytest.mark.parametrize(
+    'chunks, expected',
+    [
+        ([b'first\nsec', b'ond\nthird'], [b'first\n', b'second\n', b'third']),
+        ([b'fir', b'st', b'\n'], [b'first\n']),
+        ([b'first\n', b'', b'second\n'], [b'first\n', b'second\n']),
+        ([], []),
+    ],
+)
+def test_line_blocks(chunks, expected):
+    """Check that blocks only have whole lines."""
+    assert list(line_blocks(chunks)) == expected
+
+
+@pytest.mark.parametrize(
+    'compress, opener',
+    [
+        (lambda data: data, None),
+        (gzip.compress, gzip.open),
+        (bz2.compress, bz2.open),
+        (lzma.compress, lzma.open),
+    ],
+)
+def test_compression(compress, opener):
+    """Check that compressed data is detected by its magic bytes."""
+    assert compression(compress(CONTENT)) is opener
+
+
+def test_prefetch():
+    """Check that all items are yielded, in order."""
+    assert list(prefetch(iter(range(100)), size=3)) == list(range(100))
+
+
+def test_prefetch_error():
+    """Check that errors on the thread are raised on the caller."""
+
+    def failing():
+        yield 1
+        raise EOFError('truncated')
+
+    items = prefetch(failing())
+    assert next(items) == 1
+    with pytest.raises(EOFError):
+        next(items)
+
+
+def test_read_blocks():
+    """Check that decompressed data is read in blocks of whole lines."""
+    file_obj = gzip.GzipFile(fileobj=io.BytesIO(gzip.compress(CONTENT)))
+    blocks = list(read_blocks(file_obj, 10))
+    assert b''.join(blocks) == CONTENT
+    assert all(block.endswith(b'\n') for block in blocks)
+    assert file_obj.closed
+
+
+def test_gzip_members():
+    """Check that the start of all gzip members are found."""
+    members = [gzip.compress(b'line %d\n' % index) for index in range(5)]
+    buffer = b''.join(members)
+    offsets = gzip_members(buffer)
+    assert offsets == [sum(len(member) for member in members[:i]) for i in range(5)]
+
+    member = GzipMember(buffer, offsets[1])
+    assert b''.join(member) == b'line 1\n'
+    assert member.end == offsets[2]
+
+
+def test_gzip_members_false_positives():
+    """Check that gzip magic bytes within compressed data are discarded."""
+    buffer = gzip.compress(b'\x1f\x8b\x08\x00 not a member\n' * 3, compresslevel=0)
+    assert buffer.count(GZIP_MEMBER_MAGIC) == 4
+    assert gzip_members(buffer) == [0]
+    with pytest.raises(zlib.error):
+        list(GzipMember(buffer, buffer.find(GZIP_MEMBER_MAGIC, 1)))
+
+
+def test_gzip_members_not_gzip():
+    """Check that data that is not gzip compressed has no members."""
+    assert gzip_members(CONTENT) == []
+    assert gzip_members(bz2.compress(CONTENT)) == []
+
+
+def test_gzip_member_truncated():
+    """Check that truncated gzip members are reported."""
+    buffer = gzip.compress(CONTENT)[:-10]
+    with pytest.raises(EOFError):
+        list(GzipMember(buffer, 0))
+
+
+def test_find_logfiles(tmp_path):
+    """Check that glob patterns are expanded, paths are kept as given."""
+    for name in ('haproxy.log.2', 'haproxy.log.1', 'haproxy.log.[3]'):
+        (tmp_path / name).write_text('')
+    logfiles = find_logfiles(
+        [tmp_path / 'haproxy.log.[3]', f'{tmp_path}/haproxy.log.?', 'missing.log']
+    )
+    assert logfiles == [
+        tmp_path / 'haproxy.log.[3]',
+        f'{tmp_path}/haproxy.log.1',
+        f'{tmp_path}/haproxy.log.2',
+        'missing.log',
+    ]
+
+
+def test_merge_lines(http_line_factory):
+    """Check that lines are sorted by their accept date."""
+    first = [
+        http_line_factory(accept_date='09/Dec/2013:12:59:46.633'),
+        http_line_factory(accept_date='09/Dec/2013:13:59:46.633'),
+    ]
+    second = [
+        http_line_factory(accept_date='09/Dec/2013:11:59:46.633'),
+        http_line_factory(accept_date='09/Dec/2013:12:59:47.633'),
+    ]
+    merged = list(merge_lines([first, [], second]))
+    assert merged == [second[0], first[0], second[1], first[1]]
+
+
+def _dated_lines(http_line_factory, minutes):
+    return b''.join(
+        http_line_factory(accept_date=f'09/Dec/2013:12:{minute:02}:00.000')
+        .raw_line.encode()
+        + b'\n'
+        for minute in minutes
+    )
+
+
+@pytest.mark.parametrize(
+    'raw_line, expected',
+    [
+        (
+            b'127.0.0.1:38037 [09/Dec/2013:12:59:46.633] loadbalancer default/srv',
+            datetime(2013, 12, 9, 12, 59, 46, 633000),
+        ),
+        (
+            b'Dec  9 haproxy[12345]: 1.2.3.4:80 [09/Dec/2013:12:59:46.6] fe be/srv',
+            datetime(2013, 12, 9, 12, 59, 46, 600000),
+        ),
+        (b'127.0.0.1:38037 [09/Dec/2013:12:59:46] loadbalancer', None),
+        (b'127.0.0.1:38037 [99/Dec/2013:12:59:46.633] loadbalancer', None),
+        (b'invalid', None),
+    ],
+)
+def test_read_accept_date(raw_line, expected):
+    """Check that the accept date is read out of raw log lines."""
+    assert read_accept_date(raw_line) == expected
+
+
+@pytest.mark.parametrize(
+    'minute, expected_line',
+    [(0, 0), (4, 2), (5, 4), (10, 4), (11, 6), (30, 10), (45, 10)],
+)
+def test_seek_date(http_line_factory, minute, expected_line):
+    """Check that the first line at or after the date is found."""
+    minutes = (1, 2, 4, 4, 10, 10, 20, 21, 22, 29)
+    buffer = _dated_lines(http_line_factory, minutes)
+    offsets = [0] + [index + 1 for index, byte in enumerate(buffer) if byte == 10]
+    date = datetime(2013, 12, 9, 12, minute)
+    assert seek_date(buffer, date) == offsets[expected_line]
+
+
+def test_seek_date_invalid_lines(http_line_factory):
+    """Check that lines without date are skipped over."""
+    buffer = _dated_lines(http_line_factory, (1, 2, 3, 4))
+    lines = buffer.splitlines(keepends=True)
+    buffer = b''.join([lines[0], b'invalid\n', lines[1], b'\n' * 5] + lines[2:])
+    date = datetime(2013, 12, 9, 12, 3)
+    # the lines without date right before it might be kept
+    assert buffer[seek_date(buffer, date) :].lstrip(b'\n') == b''.join(lines[2:])
+    assert seek_date(b'invalid\n' * 10, date) == 0
+
+
+def test_split_buffer_range():
+    """Check that only the byte range given is split."""
+    start = CONTENT.index(b'line 5')
+    end = CONTENT.index(b'line 15')
+    ranges = split_buffer(CONTENT, 4, start, end)
+    assert ranges[0][0] == start
+    assert ranges[-1][1] == end
+    assert len(ranges) == 4
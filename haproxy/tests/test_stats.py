@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+from haproxy import commands
+from haproxy.line import Line
+from haproxy.stats import memory_size
+from haproxy.stats import STAGES
+from haproxy.stats import Stats
+
+import os
+import pytest
+import sys
+
+
+def test_add_task():
+    """Check that the time of a task not spent on other stages is reading."""
+    stats = Stats()
+    stats.stages['parse'] = 2.0
+    stats.stages['command'] = 0.5
+    stats.add_task(3.0, 2.5, 10)
+    assert stats.stages['read'] == 0.5
+    assert stats.workers == {os.getpid(): [1, 10, 3.0, 2.5]}
+
+
+def test_merge():
+    stats = Stats()
+    for _ in range(2):
+        other = Stats()
+        other.stages['parse'] = 1.0
+        other.bytes = 100
+        other.add_task(1.5, 1.25, 10)
+        stats.merge(other)
+    assert stats.stages['parse'] == 2.0
+    assert stats.stages['read'] == 1.0
+    assert stats.bytes == 200
+    assert stats.workers == {os.getpid(): [2, 20, 3.0, 2.5]}
+
+
+@pytest.mark.parametrize('negate', [False, True, None])
+def test_timed_filters(negate):
+    """Check that the filters tell the same as when compiled, while every one
+    of them is measured.
+    """
+    filters = [lambda line: line > 1, lambda line: line > 2]
+    stats = Stats()
+    predicate = stats.timed_filters(filters, (1, 0), negate)
+    assert [predicate(line) for line in (1, 2, 3)] == (
+        [True, True, False] if negate else [False, False, True]
+    )
+    # by their position, the second one is evaluated first
+    assert [profile[:2] for profile in stats.filters] == [[1, 1], [3, 1]]
+    assert stats.stages['filter'] > 0
+
+
+def test_timed_command():
+    """Check that commands are measured on their own only with a name."""
+    lines = []
+    stats = Stats()
+    stats.timed_command(lines.append, 'collect')(1)
+    stats.timed_command(lines.append)(2)
+    assert lines == [1, 2]
+    assert stats.commands['collect'][0] == 1
+    assert stats.stages['command'] >= stats.commands['collect'][1]
+
+
+def test_report():
+    stats = Stats()
+    stats.wall, stats.cpu = 2.0, 1.5
+    stats.bytes = 4 * 1024 * 1024
+    stats.add_task(1.0, 0.75, 10)
+    report = stats.report(6, 2, 'serial', 2)
+    assert report['mode'] == 'serial'
+    assert report['lines'] == 10
+    assert report['skipped_lines'] == 2
+    # skipped lines might be invalid too
+    assert report['invalid_rate'] is None
+    assert report['lines_per_second'] == 5.0
+    assert report['mb_per_second'] == 2.0
+    assert list(report['stages']) == list(STAGES)
+    assert report['workers'] == [
+        {'pid': os.getpid(), 'tasks': 1, 'lines': 10, 'wall': 1.0, 'cpu': 0.75}
+    ]
+
+
+def test_report_invalid_rate():
+    """Check that the rate of invalid lines is given when every line was
+    parsed.
+    """
+    report = Stats().report(6, 2)
+    assert report['invalid_lines'] == 2
+    assert report['invalid_rate'] == 0.25
+
+
+def test_report_nothing():
+    """Check that nothing processed does not divide by zero."""
+    report = Stats().report(0, 0)
+    assert report['invalid_rate'] == 0.0
+    assert report['lines_per_second'] == 0.0
+
+
+def test_merge_profiles():
+    stats = Stats()
+    for _ in range(2):
+        other = Stats()
+        other.filter(1)[:] = [4, 1, 0.5]
+        other.command('counter')[:] = [1, 0.25]
+        stats.merge(other)
+    assert stats.filters == [[0, 0, 0.0], [8, 2, 1.0]]
+    assert stats.commands == {'counter': [2, 0.5]}
+
+
+def test_profile():
+    """Check that filters get their pass rate, commands their memory."""
+    stats = Stats()
+    stats.filter(0)[:] = [10, 4, 0.5]
+    stats.command('ip_counter')[:] = [4, 0.25]
+    cmd = commands.IpCounter()
+    empty = stats.profile(['ip[1.2.3.4]', 'ssl'], [cmd])
+    cmd.stats['1.2.3.4'] = 4
+    profile = stats.profile(['ip[1.2.3.4]', 'ssl'], [cmd])
+    assert profile['filters'] == [
+        {
+            'filter': 'ip[1.2.3.4]',
+            'calls': 10,
+            'passed': 4,
+            'pass_rate': 0.4,
+            'seconds': 0.5,
+        },
+        {'filter': 'ssl', 'calls': 0, 'passed': 0, 'pass_rate': 0.0, 'seconds': 0.0},
+    ]
+    assert profile['commands'][0]['calls'] == 4
+    assert profile['commands'][0]['memory'] > empty['commands'][0]['memory']
+
+
+def test_memory_size():
+    """Check that containers, attributes and slots are followed, once."""
+    line = Line('invalid')
+    shared = ['x' * 1000]
+    assert memory_size([shared, shared]) < memory_size([shared, ['x' * 1000]])
+    assert memory_size({'key': shared}) > 1000
+    assert memory_size(line) > sys.getsizeof(line) + len('invalid')
+    # classes and functions are not followed
+    assert memory_size([memory_size]) == sys.getsizeof([memory_size])
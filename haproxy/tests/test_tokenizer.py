@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+from haproxy import line as line_module
+from haproxy.line import HAPROXY_LINE_REGEX
+from haproxy.line import Line
+from haproxy.line import tokenize_line
+
+import glob
+import os
+import pytest
+
+
+TESTS_FOLDER = os.path.dirname(__file__)
+
+LINE_ATTRIBUTES = (
+    'is_valid',
+    'log_type',
+    'client_ip',
+    'client_port',
+    'raw_accept_date',
+    'accept_date',
+    'request_date',
+    'frontend_name',
+    'backend_name',
+    'server_name',
+    'time_wait_request',
+    'time_wait_queues',
+    'time_connect_server',
+    'time_wait_response',
+    'total_time',
+    'status_code',
+    'bytes_read',
+    'connections_active',
+    'connections_frontend',
+    'connections_backend',
+    'connections_server',
+    'retries',
+    'queue_server',
+    'queue_backend',
+    'captured_request_headers',
+    'captured_response_headers',
+    'raw_http_request',
+    'http_request_method',
+    'http_request_path',
+    'http_request_protocol',
+)
+
+
+def _log_files_lines():
+    lines = []
+    for filename in sorted(glob.glob(os.path.join(TESTS_FOLDER, 'files', '*.log'))):
+        with open(filename) as logfile:
+            lines.extend(raw_line.strip() for raw_line in logfile)
+    return lines
+
+
+# variations of the factories' default values,
+# taken from the parametrized tests of the regular expression
+HTTP_VARIATIONS = [
+    {},
+    {'client_ip': '192.168.0.250', 'client_port': '34'},
+    {'client_ip': 'fe80::9379:c29e:6701:cef8'},
+    {'client_ip': 'fe80::9379:c29e::'},
+    {'accept_date': '10/Dec/2013:13:01:26.1'},
+    {'http_frontend_name': 'SomeThing4', 'http_backend_name': 'Another1'},
+    {'http_server_name': 'Cloud9'},
+    {'http_server_name': 'with/slash'},
+    {'http_server_name': ''},
+    {'Tq': '-23', 'Tw': '-33', 'Tc': '-3', 'Tr': '-4', 'Ta': '5'},
+    {'Tq': '23', 'Tw': '33', 'Tc': '3', 'Tr': '4', 'Ta': '+5'},
+    {'http_status_code': '-301', 'http_bytes_read': '543'},
+    {'http_status_code': '200', 'http_bytes_read': '+543'},
+    {'retries': '+14'},
+    {'srv_queue': '200', 'backend_queue': '200'},
+    {'headers': ''},
+    {'headers': ' {}'},
+    {'headers': ' {something here}'},
+    {'headers': ' {} {}'},
+    {'headers': ' {something here} {and there}'},
+    {'headers': ' {multiple | request | headers} {and | multiple | response ones}'},
+    {'http_request': 'something in the air'},
+    {'http_request': 'GET /'},
+    {'http_request': '<BADREQ>'},
+    {'http_request': 'GET /domain:443/to/image HTTP/1.1'},
+    {'http_request': 'GET /here_or[here] HTTP/1.1'},
+    {'http_request': 'GET /georg}von{grote/ HTTP/1.1'},
+    {'syslog_date': '2017-07-06T14:29:39+02:00'},
+    {'process_name_and_pid': 'dvd-ctrl1 haproxy[403100]:'},
+    # lines that do not have the expected shape, the regular expression
+    # needs to handle them
+    {'headers': ' {with {nested} curly brackets}'},
+    {'headers': ' {one} {two} {three}'},
+    {'headers': ' {quoted "header"}'},
+    {'headers': '  '},
+    {'http_frontend_name': 'two  spaces'},
+    {'http_frontend_name': 'lb', 'http_backend_name': 'de\tfault'},
+    {'http_frontend_name': 'lb\rde', 'http_backend_name': 'fault'},
+    {'http_server_name': 'srv\x0b2'},
+    {'http_request': 'GET /with\ttab HTTP/1.1'},
+    {'http_bytes_read': 'wroooong'},
+    {'client_port': 'random-value-that-breaks'},
+]
+
+TCP_VARIATIONS = [
+    {},
+    {'Tw': '-23', 'Tc': '-33', 'Tt': '5'},
+    {'Tw': '23', 'Tc': '33', 'Tt': '+5'},
+    {'tcp_frontend_name': 'SomeThing4', 'tcp_server_name': 'Cloud9'},
+    {'tcp_bytes_read': '+18923'},
+    {'tcp_bytes_read': 'wroooong'},
+]
+
+
+@pytest.fixture
+def corpus(http_line_factory, tcp_line_factory, plain_line_factory):
+    """Log lines from the test files and from the line factories."""
+    lines = _log_files_lines()
+    for variation in HTTP_VARIATIONS:
+        lines.append(http_line_factory(**variation).raw_line)
+    for variation in TCP_VARIATIONS:
+        lines.append(tcp_line_factory(**variation).raw_line)
+        lines.append(plain_line_factory(**variation).raw_line)
+
+    # truncated log lines
+    http_line_factory.line_format = http_line_factory.line_format[:-1]
+    lines.append(http_line_factory(http_request='GET /truncated_pat').raw_line)
+    return lines
+
+
+def test_tokenizer_matches_regex(corpus):
+    """Check that the tokenizer extracts exactly what the regex extracts."""
+    tokenized = 0
+    for raw_line in corpus:
+        fields = tokenize_line(raw_line)
+        if fields is None:
+            continue
+        tokenized += 1
+        matches = HAPROXY_LINE_REGEX.match(raw_line)
+        assert matches is not None, raw_line
+        expected = {
+            key: value for key, value in matches.groupdict().items() if value is not None
+        }
+        assert fields == expected, raw_line
+
+    # most of the corpus has the standard shape
+    assert tokenized > len(corpus) / 2
+
+
+def test_line_attributes_are_identical(corpus, monkeypatch):
+    """Check that lines parsed by the tokenizer and the regex are equal."""
+    fast_lines = [Line(raw_line) for raw_line in corpus]
+    monkeypatch.setattr(line_module, 'tokenize_line', lambda raw_line: None)
+    regex_lines = [Line(raw_line) for raw_line in corpus]
+
+    for fast, regex in zip(fast_lines, regex_lines):
+        for attribute in LINE_ATTRIBUTES:
+            assert getattr(fast, attribute) == getattr(regex, attribute), (
+                attribute,
+                fast.raw_line,
+            )
+
+
+@pytest.mark.parametrize(
+    'headers', [' {with {nested} curly brackets}', ' {quoted "header"}', '  ']
+)
+def test_unexpected_shapes_fall_back(http_line_factory, headers):
+    """Check that lines without the standard shape are left to the regex."""
+    line = http_line_factory(headers=headers)
+    assert tokenize_line(line.raw_line) is None
+    assert line.is_valid is (HAPROXY_LINE_REGEX.match(line.raw_line) is not None)
+
+
+@pytest.mark.parametrize(
+    'raw_line',
+    [
+        '',
+        'something completely different',
+        '127.0.0.1:39759 [] loadbalancer default/instance8',
+        '127.0.0.1: [09/Dec/2013:12:59:46.633] fe be/srv 1/2/3 4 -- 1/2/3/4/5 6/7',
+        '127.0.0.1:80 [09/Dec/2013:12:59:46.633] fe be/srv 1/2 4 -- 1/2/3/4/5 6/7',
+        '127.0.0.1:80 [09/Dec/2013:12:59:46.633] fe be/srv 1/2/3 4 -- 1/2/3/4 6/7',
+        '127.0.0.1:80 [09/Dec/2013:12:59:46.633] lb de\tfault/srv2 1/2/3/4/5 200 6 '
+        '- - ---- 1/2/3/4/5 6/7 "GET / HTTP/1.1"',
+    ],
+)
+def test_invalid_lines(raw_line):
+    """Check that lines that can not be tokenized are reported as such."""
+    assert tokenize_line(raw_line) is None
@@ -57,12 +57,12 @@ def validate_arg_date(start):
         raise ValueError('--start argument is not valid')
 
 
-def validate_arg_delta(delta):
+def validate_arg_delta(delta, argument='--delta'):
     """Check that the delta argument is valid."""
     try:
         delta_str_to_timedelta(delta)
     except Exception:
-        raise ValueError('--delta argument is not valid')
+        raise ValueError(f'{argument} argument is not valid')
 
 
 def list_filters():